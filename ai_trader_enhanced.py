@@ -5,10 +5,12 @@ Enhanced AI Trader - Combines Technical Strategy with AI Judgment
 import json
 import pandas as pd
 from typing import Dict, Optional, List
+from urllib.parse import urlsplit
 from openai import OpenAI, APIConnectionError, APIError
 from strategy import create_strategy
 from indicators_advanced import create_multi_indicator_analyzer
 from trading_knowledge_modules import TradingKnowledgeManager
+from metrics import LLM_REQUEST_SECONDS, LLM_REQUESTS
 
 
 class EnhancedAITrader:
@@ -41,6 +43,9 @@ class EnhancedAITrader:
         self.knowledge_modules = knowledge_modules or []
         self.knowledge_params = knowledge_params or {}
 
+        # 复用同一个 OpenAI 客户端（保持 HTTP keep-alive 连接池）
+        self._client = None
+
         # 初始化交易知识模块管理器
         self.knowledge_manager = TradingKnowledgeManager()
 
@@ -110,32 +115,33 @@ class EnhancedAITrader:
         获取技术指标策略的信号
 
         Args:
-            historical_data: 历史价格数据字典 {coin: [prices]}
+            historical_data: 每个币种的K线数据，支持三种格式:
+                {coin: {timeframe: DataFrame}}  多周期 OHLCV（CandleFeed，第一个周期为主周期）
+                {coin: DataFrame}               单周期 OHLCV
+                {coin: [prices]}                仅收盘价（旧格式，OHLC 均用收盘价近似）
 
         Returns:
             策略信号字典 {coin: {action, confidence, reason, indicators_detail}}
         """
         signals = {}
 
-        for coin, prices in historical_data.items():
-            if not prices or len(prices) < 20:
+        for coin, data in historical_data.items():
+            frames = self._to_frames(data)
+            if not frames:
                 continue
 
-            try:
-                # 构建DataFrame
-                df = pd.DataFrame({
-                    'timestamp': range(len(prices)),
-                    'open': prices,
-                    'high': prices,
-                    'low': prices,
-                    'close': prices,
-                    'volume': [0] * len(prices)  # 简化处理
-                })
+            # 共享的 DataFrame 可能被多个引擎同时使用，指标计算在副本上进行
+            df = next(iter(frames.values())).copy()
+            if len(df) < 20:
+                continue
 
+            try:
                 # 使用多指标分析器或单一策略
                 if self.multi_indicator_analyzer:
-                    # 使用多指标分析器
-                    result = self.multi_indicator_analyzer.generate_combined_signal(df)
+                    # 使用多指标分析器（多周期数据用于趋势强度分析）
+                    price_data_by_timeframe = {tf: frame.copy() for tf, frame in frames.items()} \
+                        if len(frames) > 1 else None
+                    result = self.multi_indicator_analyzer.generate_combined_signal(df, price_data_by_timeframe)
                     signals[coin] = {
                         'action': result['action'],
                         'confidence': result['confidence'] / 100.0,  # 转换为0-1范围
@@ -161,6 +167,26 @@ class EnhancedAITrader:
 
         return signals
 
+    @staticmethod
+    def _to_frames(data) -> Dict[str, pd.DataFrame]:
+        """把 historical_data 中单个币种的数据统一为 {timeframe: DataFrame}"""
+        if isinstance(data, dict):
+            return {tf: df for tf, df in data.items() if df is not None and len(df)}
+        if isinstance(data, pd.DataFrame):
+            return {'primary': data} if len(data) else {}
+        if not data:
+            return {}
+
+        prices = list(data)
+        return {'primary': pd.DataFrame({
+            'timestamp': range(len(prices)),
+            'open': prices,
+            'high': prices,
+            'low': prices,
+            'close': prices,
+            'volume': [0] * len(prices)  # 旧格式没有成交量
+        })}
+
     def _get_signal_reason(self, df: pd.DataFrame, action: str) -> str:
         """根据技术指标生成信号理由"""
         if len(df) == 0:
@@ -298,9 +324,9 @@ Analyze and output JSON only.
 
         return prompt
 
-    def _call_llm(self, prompt: str) -> str:
-        """调用LLM API"""
-        try:
+    def _get_client(self) -> OpenAI:
+        """获取（懒加载）复用的 OpenAI 客户端"""
+        if self._client is None:
             base_url = self.api_url.rstrip('/')
             if not base_url.endswith('/v1'):
                 if '/v1' in base_url:
@@ -308,10 +334,27 @@ Analyze and output JSON only.
                 else:
                     base_url = base_url + '/v1'
 
-            client = OpenAI(
+            self._client = OpenAI(
                 api_key=self.api_key,
                 base_url=base_url
             )
+        return self._client
+
+    def _call_llm(self, prompt: str) -> str:
+        """调用LLM API"""
+        labels = {'provider': urlsplit(self.api_url or '').hostname or '', 'model': self.model_name}
+        try:
+            with LLM_REQUEST_SECONDS.time(**labels):
+                content = self._request_completion(prompt)
+        except Exception:
+            LLM_REQUESTS.inc(outcome='error', **labels)
+            raise
+        LLM_REQUESTS.inc(outcome='ok', **labels)
+        return content
+
+    def _request_completion(self, prompt: str) -> str:
+        try:
+            client = self._get_client()
 
             response = client.chat.completions.create(
                 model=self.model_name,
@@ -1,5 +1,7 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_cors import CORS
+import os
+import atexit
 import time
 import threading
 import json
@@ -8,7 +10,21 @@ from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from trading_engine import TradingEngine
-from market_data import MarketDataFetcher
+from async_market_data import AsyncMarketDataFetcher
+from candle_store import CandleStore
+from market_cache import MarketDataCache, DEFAULT_TTLS
+from market_recorder import MarketRecorder, MarketReplay
+from symbol_registry import SymbolRegistry
+from market_snapshot import MarketSnapshotBroker
+from market_refresher import MarketRefresher
+from candle_feed import CandleFeed
+from cycle_executor import CycleExecutor
+from model_config_cache import ModelConfigCache
+from position_book import PositionBook
+from retention import RetentionJob
+from trading_pipeline import TradingPipeline
+import metrics
+from http_client import http_get
 from ai_trader_enhanced import EnhancedAITrader
 from database import Database
 from version import __version__, __github_owner__, __repo__, GITHUB_REPO_URL, LATEST_RELEASE_URL
@@ -20,9 +36,57 @@ app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 CORS(app)
 
-db = Database('AITradeGame.db')
-market_fetcher = MarketDataFetcher()
+# 连接池（WAL 模式）：DB_POOL_SIZE 为最大连接数，DB_BUSY_TIMEOUT 为等待写锁的秒数
+db = Database('AITradeGame.db', pool_size=int(os.getenv('DB_POOL_SIZE', '32')),
+              busy_timeout=float(os.getenv('DB_BUSY_TIMEOUT', '5')))
+atexit.register(db.close)  # 最后执行：在持仓写入之后关闭连接
+symbol_registry = SymbolRegistry(db)  # 币种符号映射（coins 表），币种接口变更后刷新
+
+# 行情数据模式: live（默认）/ record（响应录制到 MARKET_DATA_LOG）/ replay（从 MARKET_DATA_LOG 回放，不访问外部 API）
+MARKET_DATA_MODE = os.getenv('MARKET_DATA_MODE', 'live')
+MARKET_DATA_LOG = os.getenv('MARKET_DATA_LOG', 'market_data_log.jsonl.gz')
+market_recorder = MarketRecorder(MARKET_DATA_LOG) if MARKET_DATA_MODE == 'record' else None
+if market_recorder is not None:
+    atexit.register(market_recorder.close)  # 写入 gzip 结尾，日志可被完整读取
+market_replay = None
+if MARKET_DATA_MODE == 'replay':
+    replay_speed = float(os.getenv('MARKET_REPLAY_SPEED', '1'))
+    market_replay = MarketReplay(MARKET_DATA_LOG, speed=replay_speed)
+    # 回放数据不写入共享的 L2 缓存和实盘K线库；缓存有效期按回放速度缩短
+    candle_store = CandleStore('market_candles_replay.db')
+    market_cache = MarketDataCache(None, max_entries=2048, registry=symbol_registry,
+                                   ttls={k: v / replay_speed for k, v in DEFAULT_TTLS.items()})
+    print(f"[INFO] Replaying market data from {MARKET_DATA_LOG} at {replay_speed}x")
+else:
+    candle_store = CandleStore('market_candles.db')  # 本地K线库，每个周期只补抓最新K线
+    market_cache = MarketDataCache(db, max_entries=2048, registry=symbol_registry)  # L1 内存 + L2 market_data_cache 表，多 worker 共享
+
+market_fetcher = AsyncMarketDataFetcher(candle_store=candle_store, cache=market_cache, registry=symbol_registry,
+                                        recorder=market_recorder, replay=market_replay)  # 批量并发抓取历史数据
+snapshot_broker = MarketSnapshotBroker(market_fetcher, tick_seconds=60)  # 所有引擎共享每个 tick 的行情快照
+candle_feed = CandleFeed(market_fetcher, tick_seconds=60)  # 策略信号使用的多周期K线，每个 tick 批量抓取一次
+MARKET_COINS = ['BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE']  # 首页展示的币种
+market_refresher = MarketRefresher(market_fetcher, db, extra_coins=MARKET_COINS)  # 后台刷新，前台接口只读缓存
 trading_engines = {}
+model_configs = ModelConfigCache(db)  # 引擎使用的模型配置/币种池缓存，相关接口变更后失效
+position_book = PositionBook(db)  # 内存持仓簿，持仓变更在交易周期的事务中写入 portfolios 表
+atexit.register(position_book.flush)  # 退出前写入尚未持久化的持仓变更
+# 交易周期按阶段（gather/analyze/decide/execute/persist）在流水线中执行，LLM 调用阶段的线程数最多
+trading_pipeline = TradingPipeline(stage_workers={'decide': int(os.getenv('CYCLE_WORKERS', '16'))})
+# 所有模型共享的交易周期执行器，按 LLM 提供商/交易所限制并发（周期在流水线中执行，不另建线程池）
+cycle_executor = CycleExecutor(
+    provider_limit=int(os.getenv('LLM_PROVIDER_CONCURRENCY', '4')),
+    exchange_limit=int(os.getenv('EXCHANGE_CONCURRENCY', '2')),
+    pipeline=trading_pipeline
+)
+# 历史数据保留（天数为 0 表示不清理），由调度器每 RETENTION_INTERVAL_MINUTES 分钟执行一次
+retention_job = RetentionJob(db, policy={
+    'account_values_days': float(os.getenv('RETENTION_ACCOUNT_VALUES_DAYS', '30')),
+    'conversations_days': float(os.getenv('RETENTION_CONVERSATIONS_DAYS', '7')),
+    'rollup_1m_days': float(os.getenv('RETENTION_ROLLUP_1M_DAYS', '14')),
+    'rollup_1h_days': float(os.getenv('RETENTION_ROLLUP_1H_DAYS', '365')),
+}, convert_vacuum=os.getenv('RETENTION_CONVERT_VACUUM', 'false').lower() == 'true')
+RETENTION_INTERVAL_MINUTES = int(os.getenv('RETENTION_INTERVAL_MINUTES', '60'))
 auto_trading = True
 TRADE_FEE_RATE = 0.001  # 默认交易费率
 
@@ -34,6 +98,27 @@ live_executor = None
 scheduler = BackgroundScheduler()
 model_jobs = {}  # 存储每个模型的任务ID {model_id: job_id}
 
+_background_lock = threading.Lock()
+_background_started = False
+
+
+def start_background_services():
+    """启动后台行情刷新，每个进程只启动一次；退出时先于持仓写入和关闭连接停止"""
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    market_refresher.start()
+    atexit.register(market_refresher.stop)
+
+
+@app.before_request
+def ensure_background_services():
+    """WSGI 服务器（gunicorn 等）不执行 __main__，在每个 worker 的第一个请求时启动后台服务"""
+    if not _background_started:
+        start_background_services()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -68,6 +153,24 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }), 503
 
+@app.route('/api/executor/stats', methods=['GET'])
+def executor_stats():
+    """交易周期执行器的排队/执行指标、流水线各阶段的队列深度和耗时，以及各提供商、交易所的并发占用"""
+    return jsonify(cycle_executor.get_stats())
+
+@app.route('/api/retention/stats', methods=['GET'])
+def retention_stats():
+    """数据保留任务的累计清理行数、上次执行时间和保留策略"""
+    return jsonify(retention_job.get_stats())
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式的运行指标（各阶段/外部调用/数据库耗时直方图和计数器）"""
+    for stage, stats in trading_pipeline.get_stats().items():
+        metrics.PIPELINE_QUEUE_DEPTH.set(stats['queue_depth'], stage=stage)
+        metrics.PIPELINE_BUSY_WORKERS.set(stats['busy'], stage=stage)
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 # ============ Provider API Endpoints ============
 
 @app.route('/api/providers', methods=['GET'])
@@ -96,6 +199,7 @@ def delete_provider(provider_id):
     """Delete API provider"""
     try:
         db.delete_provider(provider_id)
+        invalidate_model_config()
         return jsonify({'message': 'Provider deleted successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -141,12 +245,11 @@ def fetch_provider_models():
         else:
             # 尝试调用API获取，但只保留2025最新模型
             try:
-                import requests
                 headers = {
                     'Authorization': f'Bearer {api_key}',
                     'Content-Type': 'application/json'
                 }
-                response = requests.get(f'{api_url}/models', headers=headers, timeout=10)
+                response = http_get(f'{api_url}/models', headers=headers)
                 if response.status_code == 200:
                     result = response.json()
                     all_models = [m['id'] for m in result.get('data', [])]
@@ -179,6 +282,16 @@ def fetch_provider_models():
 
 # ============ Model API Endpoints ============
 
+def invalidate_model_config(model_id=None):
+    """模型、币种池、币种或提供商变更后丢弃缓存的配置（model_id 为 None 时全部），并刷新引擎的币种列表"""
+    model_configs.invalidate(model_id)
+    if model_id is None:
+        engines = list(trading_engines.values())
+    else:
+        engines = [trading_engines[model_id]] if model_id in trading_engines else []
+    for engine in engines:
+        engine.refresh_coins()
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
     models = db.get_all_models()
@@ -236,7 +349,12 @@ def add_model():
                 indicators_config=indicators_config
             ),
             trade_fee_rate=TRADE_FEE_RATE,
-            live_executor=live_executor  # 传入实盘执行器
+            live_executor=live_executor,  # 传入实盘执行器
+            snapshot_broker=snapshot_broker,
+            candle_feed=candle_feed,
+            cycle_executor=cycle_executor,
+            model_config=model_configs,
+            position_book=position_book
         )
 
         if indicators_config:
@@ -261,6 +379,8 @@ def delete_model(model_id):
         model_name = model['name'] if model else f"ID-{model_id}"
 
         db.delete_model(model_id)
+        model_configs.invalidate(model_id)
+        position_book.invalidate(model_id)
 
         # 移除模型的定时任务
         remove_model_job(model_id)
@@ -276,10 +396,10 @@ def delete_model(model_id):
 
 @app.route('/api/models/<int:model_id>/portfolio', methods=['GET'])
 def get_portfolio(model_id):
-    prices_data = market_fetcher.get_current_prices(['BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE'])
+    prices_data = market_fetcher.get_cached_prices(MARKET_COINS)
     current_prices = {coin: prices_data[coin]['price'] for coin in prices_data}
     
-    portfolio = db.get_portfolio(model_id, current_prices)
+    portfolio = position_book.get_portfolio(model_id, current_prices, verify=True)
     account_value = db.get_account_value_history(model_id, limit=100)
     
     return jsonify({
@@ -296,13 +416,16 @@ def get_trades(model_id):
 @app.route('/api/models/<int:model_id>/conversations', methods=['GET'])
 def get_conversations(model_id):
     limit = request.args.get('limit', 20, type=int)
+    if request.args.get('archived', 'false').lower() == 'true':
+        # 超过保留期、已压缩归档的对话
+        return jsonify(db.get_archived_conversations(model_id, limit=limit))
     conversations = db.get_conversations(model_id, limit=limit)
     return jsonify(conversations)
 
 @app.route('/api/aggregated/portfolio', methods=['GET'])
 def get_aggregated_portfolio():
     """Get aggregated portfolio data across all models"""
-    prices_data = market_fetcher.get_current_prices(['BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE'])
+    prices_data = market_fetcher.get_cached_prices(MARKET_COINS)
     current_prices = {coin: prices_data[coin]['price'] for coin in prices_data}
 
     # Get aggregated data
@@ -320,7 +443,7 @@ def get_aggregated_portfolio():
     all_positions = {}
 
     for model in models:
-        portfolio = db.get_portfolio(model['id'], current_prices)
+        portfolio = position_book.get_portfolio(model['id'], current_prices, verify=True)
         if portfolio:
             total_portfolio['total_value'] += portfolio.get('total_value', 0)
             total_portfolio['cash'] += portfolio.get('cash', 0)
@@ -358,12 +481,15 @@ def get_aggregated_portfolio():
 
     total_portfolio['positions'] = list(all_positions.values())
 
-    # Get multi-model chart data
-    chart_data = db.get_multi_model_chart_data(limit=100)
+    # Get multi-model chart data (hours 为图表时间范围，决定使用分钟/小时/天汇总)
+    limit = request.args.get('limit', 100, type=int)
+    hours = request.args.get('hours', type=float)
+    chart_data = db.get_multi_model_chart_data(limit=limit, hours=hours)
 
     return jsonify({
         'portfolio': total_portfolio,
         'chart_data': chart_data,
+        'total_history': db.get_aggregated_account_value_history(limit=limit, hours=hours),
         'model_count': len(models)
     })
 
@@ -371,13 +497,13 @@ def get_aggregated_portfolio():
 def get_models_chart_data():
     """Get chart data for all models"""
     limit = request.args.get('limit', 100, type=int)
-    chart_data = db.get_multi_model_chart_data(limit=limit)
+    hours = request.args.get('hours', type=float)
+    chart_data = db.get_multi_model_chart_data(limit=limit, hours=hours)
     return jsonify(chart_data)
 
 @app.route('/api/market/prices', methods=['GET'])
 def get_market_prices():
-    coins = ['BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE']
-    prices = market_fetcher.get_current_prices(coins)
+    prices = market_fetcher.get_cached_prices(MARKET_COINS)
     return jsonify(prices)
 
 @app.route('/api/models/<int:model_id>/execute', methods=['POST'])
@@ -402,12 +528,19 @@ def execute_trading(model_id):
                 model_name=model['model_name']
             ),
             trade_fee_rate=TRADE_FEE_RATE,  # 新增：传入费率
-            live_executor=live_executor
+            live_executor=live_executor,
+            snapshot_broker=snapshot_broker,
+            candle_feed=candle_feed,
+            cycle_executor=cycle_executor,
+            model_config=model_configs,
+            position_book=position_book
         )
     
     try:
-        result = trading_engines[model_id].execute_trading_cycle()
-        return jsonify(result)
+        future = cycle_executor.submit_cycle(model_id, trading_engines[model_id])
+        if future is None:
+            return jsonify({'error': 'Trading cycle already running'}), 409
+        return jsonify(future.result())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -425,10 +558,19 @@ def trading_loop():
             print(f"[INFO] Active models: {len(trading_engines)}")
             print(f"{'='*60}")
             
+            # 所有模型并行提交到周期执行器，再按顺序汇总结果
+            futures = {}
             for model_id, engine in list(trading_engines.items()):
+                print(f"\n[EXEC] Model {model_id}")
+                future = cycle_executor.submit_cycle(model_id, engine)
+                if future is None:
+                    print(f"[SKIP] Model {model_id} cycle still running")
+                else:
+                    futures[model_id] = future
+
+            for model_id, future in futures.items():
                 try:
-                    print(f"\n[EXEC] Model {model_id}")
-                    result = engine.execute_trading_cycle()
+                    result = future.result()
                     
                     if result.get('success'):
                         print(f"[OK] Model {model_id} completed")
@@ -469,11 +611,11 @@ def get_leaderboard():
     models = db.get_all_models()
     leaderboard = []
     
-    prices_data = market_fetcher.get_current_prices(['BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE'])
+    prices_data = market_fetcher.get_cached_prices(MARKET_COINS)
     current_prices = {coin: prices_data[coin]['price'] for coin in prices_data}
     
     for model in models:
-        portfolio = db.get_portfolio(model['id'], current_prices)
+        portfolio = position_book.get_portfolio(model['id'], current_prices, verify=True)
         account_value = portfolio.get('total_value', model['initial_capital'])
         returns = ((account_value - model['initial_capital']) / model['initial_capital']) * 100
         
@@ -527,8 +669,6 @@ def get_version():
 def check_update():
     """Check for GitHub updates"""
     try:
-        import requests
-
         # Get latest release from GitHub
         headers = {
             'Accept': 'application/vnd.github.v3+json',
@@ -537,7 +677,7 @@ def check_update():
 
         # Try to get latest release
         try:
-            response = requests.get(
+            response = http_get(
                 f"https://api.github.com/repos/{__github_owner__}/{__repo__}/releases/latest",
                 headers=headers,
                 timeout=5
@@ -643,7 +783,12 @@ def init_trading_engines():
                         model_name=model['model_name']
                     ),
                     trade_fee_rate=TRADE_FEE_RATE,
-                    live_executor=live_executor
+                    live_executor=live_executor,
+                    snapshot_broker=snapshot_broker,
+                    candle_feed=candle_feed,
+                    cycle_executor=cycle_executor,
+                    model_config=model_configs,
+                    position_book=position_book
                 )
 
                 # 为该模型添加定时任务
@@ -769,6 +914,7 @@ def create_coin():
 
         conn.commit()
         coin_id = cursor.lastrowid
+        symbol_registry.refresh()
 
         # Retrieve the created coin
         cursor.execute("SELECT * FROM coins WHERE id = ?", (coin_id,))
@@ -844,6 +990,8 @@ def update_coin(coin_id):
         update_values.append(coin_id)
         cursor.execute(query, update_values)
         conn.commit()
+        symbol_registry.refresh()
+        invalidate_model_config()  # is_active 影响所有模型的币种池
 
         # Retrieve updated coin
         cursor.execute("SELECT * FROM coins WHERE id = ?", (coin_id,))
@@ -894,6 +1042,8 @@ def delete_coin(coin_id):
         """, (coin_id,))
         conn.commit()
         conn.close()
+        symbol_registry.refresh()
+        invalidate_model_config()
 
         return jsonify({
             'message': f'Coin {coin["symbol"]} ({coin["name"]}) has been deactivated',
@@ -1012,6 +1162,7 @@ def add_model_coins(model_id):
 
         conn.commit()
         conn.close()
+        invalidate_model_config(model_id)
 
         return jsonify({
             'message': f'Added {len(added_coins)} coins to model {model_id}',
@@ -1064,6 +1215,7 @@ def update_model_coin(model_id, coin_id):
         cursor.execute(query, update_values)
         conn.commit()
         conn.close()
+        invalidate_model_config(model_id)
 
         return jsonify({'message': 'Model coin settings updated successfully'})
     except Exception as e:
@@ -1096,6 +1248,7 @@ def remove_model_coin(model_id, coin_id):
         """, (model_id, coin_id))
         conn.commit()
         conn.close()
+        invalidate_model_config(model_id)
 
         return jsonify({
             'message': f'Removed {coin["symbol"]} ({coin["name"]}) from model {model_id}',
@@ -1357,18 +1510,29 @@ def toggle_dry_run():
 
 # ============ 调度管理函数 ============
 
-def execute_model_trading(model_id):
-    """执行指定模型的交易周期（由调度器调用）"""
+def submit_model_trading(model_id):
+    """把模型的交易周期提交到周期执行器（由调度器调用，立即返回）"""
     try:
-        if model_id in trading_engines:
-            print(f"[SCHEDULER] Executing trading cycle for model {model_id}")
-            result = trading_engines[model_id].execute_trading_cycle()
-            if result['success']:
-                print(f"[SCHEDULER] Model {model_id} trading cycle completed successfully")
-            else:
-                print(f"[SCHEDULER] Model {model_id} trading cycle failed: {result.get('error', 'Unknown error')}")
-        else:
+        if model_id not in trading_engines:
             print(f"[SCHEDULER] Model {model_id} not found in trading engines")
+            return
+        print(f"[SCHEDULER] Executing trading cycle for model {model_id}")
+        future = cycle_executor.submit_cycle(model_id, trading_engines[model_id])
+        if future is None:
+            print(f"[SCHEDULER] Model {model_id} previous cycle still running, skipped")
+            return
+        future.add_done_callback(lambda f: log_model_trading_result(model_id, f))
+    except Exception as e:
+        print(f"[SCHEDULER] Error executing trading cycle for model {model_id}: {e}")
+
+def log_model_trading_result(model_id, future):
+    """记录交易周期的结果（周期结束时回调）"""
+    try:
+        result = future.result()
+        if result['success']:
+            print(f"[SCHEDULER] Model {model_id} trading cycle completed successfully")
+        else:
+            print(f"[SCHEDULER] Model {model_id} trading cycle failed: {result.get('error', 'Unknown error')}")
     except Exception as e:
         print(f"[SCHEDULER] Error executing trading cycle for model {model_id}: {e}")
 
@@ -1381,12 +1545,12 @@ def add_model_job(model_id, interval_minutes):
 
         # 创建新的定时任务
         job = scheduler.add_job(
-            func=execute_model_trading,
+            func=submit_model_trading,
             trigger=IntervalTrigger(minutes=interval_minutes),
             args=[model_id],
             id=f'model_{model_id}',
             replace_existing=True,
-            max_instances=1  # 防止任务重叠
+            max_instances=1  # 周期执行器同样会跳过仍在执行的模型
         )
 
         model_jobs[model_id] = job.id
@@ -1420,12 +1584,25 @@ if __name__ == '__main__':
     print("[INFO] Initializing database...")
 
     db.init_db()
+    symbol_registry.refresh()
 
     print("[INFO] Database initialized")
     print("[INFO] Initializing trading engines...")
 
     init_trading_engines()
 
+    # 后台保持行情缓存最新
+    start_background_services()
+
+    # 历史数据保留任务（分批执行，不长时间占用写锁）
+    scheduler.add_job(
+        func=retention_job.run,
+        trigger=IntervalTrigger(minutes=RETENTION_INTERVAL_MINUTES),
+        id='retention',
+        replace_existing=True,
+        max_instances=1
+    )
+
     # 启动调度器
     print("[INFO] Starting scheduler...")
     scheduler.start()
@@ -0,0 +1,283 @@
+"""
+Async market data - concurrent bulk fetches for large coin pools
+异步行情抓取 - 用 asyncio + aiohttp 并发抓取所有币种的历史数据，
+按主机限制并发数和请求速率预算，并为现有调用方提供同步接口
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from candle_store import TIMEFRAME_MS
+from http_client import DEFAULT_TIMEOUT, MAX_RETRIES, RETRY_BACKOFF, RETRY_STATUSES
+from market_data import MarketDataFetcher
+from metrics import MARKET_DATA_SECONDS, MARKET_DATA_HTTP_SECONDS, MARKET_DATA_HTTP_REQUESTS, timed
+
+
+# 每个主机的 (最大并发数, 每秒请求数, 突发请求数)
+DEFAULT_HOST_LIMITS = {
+    'api.binance.com': (10, 20.0, 50),
+    'api.coingecko.com': (5, 0.5, 30),  # 免费档约 30 次/分钟
+}
+FALLBACK_HOST_LIMIT = (5, 5.0, 10)
+DB_WORKERS = 4  # 协程中的 SQLite 读写（K线库、L2 缓存）在这些线程上执行，不阻塞事件循环
+
+
+class HostBudget:
+    """Per-host concurrency limit plus a token-bucket request budget"""
+
+    def __init__(self, concurrency: int, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    async def _take_token(self):
+        # 持锁等待，保证令牌按请求到达顺序发放
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self._tokens = 1.0
+                self._updated = time.monotonic()
+            self._tokens -= 1
+
+    async def __aenter__(self):
+        await self._take_token()
+        await self._semaphore.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+
+class AsyncMarketDataFetcher(MarketDataFetcher):
+    """
+    MarketDataFetcher 的异步批量版本
+
+    事件循环运行在独立的后台线程中；*_bulk 方法是同步接口，
+    可在 Flask 请求线程和调度器线程中直接调用，一次并发抓取所有币种。
+    """
+
+    def __init__(self, *args, host_limits: Optional[Dict[str, Tuple[int, float, int]]] = None, **kwargs):
+        """
+        Args:
+            host_limits: 覆盖默认的 {主机名: (最大并发数, 每秒请求数, 突发请求数)}
+            其余参数同 MarketDataFetcher
+        """
+        super().__init__(*args, **kwargs)
+        self.host_limits = dict(DEFAULT_HOST_LIMITS)
+        if host_limits:
+            self.host_limits.update(host_limits)
+
+        self._budgets: Dict[str, HostBudget] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name='market-data-async')
+        self._thread.start()
+        self._db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='market-data-db')
+
+        self.async_stats = {'batches': 0, 'requests': 0, 'retries': 0, 'failures': 0}
+
+    # ============ Event loop plumbing ============
+
+    def _run(self, coro, timeout: Optional[float] = None):
+        """在后台事件循环中执行协程并等待结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def close(self):
+        if self._session is not None:
+            self._run(self._session.close())
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._db_executor.shutdown(wait=False)
+
+    async def _in_db_thread(self, func, *args):
+        """在 DB 线程池中执行阻塞的 SQLite 调用，事件循环继续处理其他请求"""
+        return await self._loop.run_in_executor(self._db_executor, func, *args)
+
+    def _budget(self, url: str) -> HostBudget:
+        host = urlsplit(url).hostname or ''
+        budget = self._budgets.get(host)
+        if budget is None:
+            budget = HostBudget(*self.host_limits.get(host, FALLBACK_HOST_LIMIT))
+            self._budgets[host] = budget
+        return budget
+
+    async def _get_json_async(self, url: str, params: Optional[Dict] = None):
+        """GET a JSON document within the host's budget, retrying 429/5xx with backoff"""
+        if self.replay is not None:
+            return self.replay.lookup(url, params)
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(sock_connect=DEFAULT_TIMEOUT[0], sock_read=DEFAULT_TIMEOUT[1]),
+                headers={'User-Agent': 'AITradeGame/1.0'},
+            )
+        query = {k: str(v) for k, v in (params or {}).items()}
+        budget = self._budget(url)
+        host = urlsplit(url).hostname or ''
+
+        for attempt in range(MAX_RETRIES + 1):
+            async with budget:
+                self.async_stats['requests'] += 1
+                try:
+                    with MARKET_DATA_HTTP_SECONDS.time(host=host):
+                        async with self._session.get(url, params=query) as response:
+                            if response.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                                retry_after = response.headers.get('Retry-After')
+                                delay = float(retry_after) if retry_after and retry_after.isdigit() \
+                                    else RETRY_BACKOFF * (2 ** attempt)
+                            else:
+                                response.raise_for_status()
+                                data = await response.json(content_type=None)
+                                if self.recorder is not None:
+                                    self.recorder.record(url, params, data)
+                                MARKET_DATA_HTTP_REQUESTS.inc(host=host, outcome='ok')
+                                return data
+                except Exception:
+                    MARKET_DATA_HTTP_REQUESTS.inc(host=host, outcome='error')
+                    raise
+            MARKET_DATA_HTTP_REQUESTS.inc(host=host, outcome='retry')
+            self.async_stats['retries'] += 1
+            await asyncio.sleep(delay)
+
+    async def _gather(self, label: str, coros: Dict):
+        """并发执行 {key: coroutine}，返回成功的 {key: result}"""
+        self.async_stats['batches'] += 1
+        keys = list(coros.keys())
+        results = await asyncio.gather(*coros.values(), return_exceptions=True)
+
+        succeeded = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                self.async_stats['failures'] += 1
+                print(f"[ERROR] Failed to get {label} for {key}: {result}")
+            else:
+                succeeded[key] = result
+        return succeeded
+
+    # ============ Sync facade ============
+
+    @timed(MARKET_DATA_SECONDS, method='get_historical_prices_bulk')
+    def get_historical_prices_bulk(self, coins: List[str], days: int = 7) -> Dict[str, List[Dict]]:
+        """Historical prices for all coins, fetched concurrently ({coin: [{timestamp, price}]})"""
+        histories = {}
+        if self.candle_store:
+            for coin, candles in self.get_candles_bulk(coins, '1h', days=days).items():
+                if candles:
+                    histories[coin] = [{'timestamp': c['timestamp'], 'price': c['close']} for c in candles]
+
+        missing = [coin for coin in coins if coin not in histories]
+        if missing:
+            histories.update(self._market_charts_bulk(missing, days))
+        return histories
+
+    @timed(MARKET_DATA_SECONDS, method='get_candles_bulk')
+    def get_candles_bulk(self, coins: List[str], timeframe: str = '1h', days: int = 14) -> Dict[str, List[Dict]]:
+        """OHLCV candles for all coins, fetched concurrently ({coin: candles})"""
+        window_start = int(self.clock() * 1000) - days * 24 * 60 * 60 * 1000
+
+        if not self.candle_store:
+            keys = [(coin, timeframe, window_start) for coin in coins]
+            fetched = self.inflight.do_many('klines', keys, lambda batch: self._run(self._gather('klines', {
+                key: self._fetch_klines_async(key[0], timeframe, window_start) for key in batch
+            })))
+            return {coin: fetched.get((coin, timeframe, window_start), []) for coin in coins}
+
+        keys = [(coin, timeframe) for coin in coins]
+        self.inflight.do_many('klines', keys, lambda batch: self._run(self._gather('klines', {
+            key: self._backfill_candles_async(key[0], timeframe, window_start) for key in batch
+        })))
+        return {coin: self.candle_store.get_candles(coin, timeframe, since=window_start) for coin in coins}
+
+    @timed(MARKET_DATA_SECONDS, method='calculate_technical_indicators_bulk')
+    def calculate_technical_indicators_bulk(self, coins: List[str]) -> Dict[str, Dict]:
+        """Technical indicators for all coins from one concurrent history fetch"""
+        histories = self.get_historical_prices_bulk(coins, days=14)
+        return {coin: self._indicators_from_history(histories.get(coin, [])) for coin in coins}
+
+    def _market_charts_bulk(self, coins: List[str], days: int) -> Dict[str, List[Dict]]:
+        data_type = f'market_chart:{days}'
+        charts = {}
+        stale = []
+        for coin in coins:
+            cached = self.cache.get(data_type, coin)
+            if cached is not None:
+                charts[coin] = cached
+            else:
+                stale.append(coin)
+
+        if stale:
+            # 与 get_historical_prices 使用相同的 ('market_chart', (coin, days)) 键，同步和批量请求互相合并
+            fetched = self.inflight.do_many('market_chart', [(coin, days) for coin in stale],
+                                            lambda batch: self._run(self._fetch_market_charts(batch, data_type)))
+            for (coin, _), prices in fetched.items():
+                charts[coin] = prices
+        return charts
+
+    # ============ Coroutines ============
+
+    async def _fetch_market_charts(self, keys: List[Tuple[str, int]], data_type: str) -> Dict:
+        fetched = await self._gather('historical prices', {
+            key: self._fetch_market_chart_async(*key) for key in keys
+        })
+        await self._in_db_thread(self.cache.set_many, data_type,
+                                 {coin: prices for (coin, _), prices in fetched.items() if prices}, 'coingecko')
+        return fetched
+
+    async def _fetch_market_chart_async(self, coin: str, days: int) -> List[Dict]:
+        coin_id = self.registry.coingecko_id(coin)
+        data = await self._get_json_async(
+            f"{self.coingecko_base_url}/coins/{coin_id}/market_chart",
+            params={'vs_currency': 'usd', 'days': days}
+        )
+        return [{'timestamp': p[0], 'price': p[1]} for p in data.get('prices', [])]
+
+    async def _backfill_candles_async(self, coin: str, timeframe: str, window_start: int):
+        fetched = 0
+        for start, end in await self._in_db_thread(self._backfill_ranges, coin, timeframe, window_start):
+            bars = await self._fetch_klines_async(coin, timeframe, start, end)
+            await self._in_db_thread(self._record_backfill, coin, timeframe, window_start, start, bars)
+            fetched += len(bars)
+        return fetched
+
+    async def _fetch_klines_async(self, coin: str, timeframe: str, start_ms: int,
+                                  end_ms: Optional[int] = None) -> List[Dict]:
+        symbol = self.registry.binance_symbol(coin)
+        if not symbol:
+            return []
+
+        params = {'symbol': symbol, 'interval': timeframe, 'limit': 1000}
+        if end_ms is not None:
+            params['endTime'] = end_ms
+        bars = []
+        while True:
+            data = await self._get_json_async(
+                f"{self.binance_base_url}/klines",
+                params=dict(params, startTime=start_ms)
+            )
+            for k in data:
+                bars.append({
+                    'timestamp': int(k[0]),
+                    'open': float(k[1]),
+                    'high': float(k[2]),
+                    'low': float(k[3]),
+                    'close': float(k[4]),
+                    'volume': float(k[5])
+                })
+
+            if len(data) < 1000:
+                return bars
+            start_ms = int(data[-1][0]) + TIMEFRAME_MS[timeframe]
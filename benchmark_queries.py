@@ -0,0 +1,136 @@
+"""
+Query benchmark - dashboard query latency with and without the managed indexes
+查询基准测试 - 生成大量历史数据（trades / conversations / account_values），
+分别在删除 database.INDEXES 和 init_db 重新创建索引后测量仪表盘热点查询的耗时
+
+用法:
+    python benchmark_queries.py --rows 2000000 --models 20 --repeat 20
+
+--rows 为 account_values 的行数，trades 为其 1/4，conversations 为其 1/20；
+数据库默认写入 benchmark_queries.db，已存在且行数足够时直接复用
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from database import Database, INDEXES
+
+
+def populate(db: Database, rows: int, models: int):
+    """每个模型一条持仓，按分钟生成账户价值，按 4 分钟生成交易，按 20 分钟生成对话"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM account_values')
+    if cursor.fetchone()[0] >= rows:
+        conn.close()
+        print(f"[INFO] Reusing existing data ({rows} account values)")
+        return
+
+    started = time.perf_counter()
+    for table in ('models', 'providers', 'portfolios', 'trades', 'conversations', 'account_values', 'model_ledger',
+                  'account_value_rollups', 'account_value_latest'):
+        cursor.execute(f'DELETE FROM {table}')
+    cursor.execute("INSERT INTO providers (name, api_url, api_key) VALUES ('bench', 'http://127.0.0.1', 'key')")
+    provider_id = cursor.lastrowid
+    model_ids = []
+    for i in range(models):
+        cursor.execute('INSERT INTO models (name, provider_id, model_name, initial_capital) VALUES (?, ?, ?, ?)',
+                       (f'bench-{i}', provider_id, 'bench', 10000))
+        model_ids.append(cursor.lastrowid)
+        cursor.execute('INSERT INTO portfolios (model_id, coin, quantity, avg_price, leverage, side) '
+                       'VALUES (?, ?, ?, ?, ?, ?)', (model_ids[-1], 'BTC', 0.1, 60000, 2, 'long'))
+
+    per_model = rows // models
+    start = datetime(2024, 1, 1)
+    rng = random.Random(42)
+    response = 'x' * 1024
+
+    def stamp(minute):
+        return (start + timedelta(minutes=minute)).strftime('%Y-%m-%d %H:%M:%S')
+
+    # 模型交错写入，和真实库一样按时间顺序混在一起
+    cursor.executemany(
+        'INSERT INTO account_values (model_id, total_value, cash, positions_value, timestamp) VALUES (?, ?, ?, ?, ?)',
+        ((model_id, 10000 + rng.uniform(-500, 500), 5000, 5000, stamp(m))
+         for m in range(per_model) for model_id in model_ids))
+    cursor.executemany(
+        'INSERT INTO trades (model_id, coin, signal, quantity, price, leverage, side, pnl, fee, timestamp) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        ((model_id, 'BTC', 'close_position', 0.1, 60000, 2, 'long', rng.uniform(-50, 50), 6, stamp(m))
+         for m in range(0, per_model, 4) for model_id in model_ids))
+    cursor.executemany(
+        'INSERT INTO conversations (model_id, user_prompt, ai_response, timestamp) VALUES (?, ?, ?, ?)',
+        ((model_id, 'prompt', response, stamp(m))
+         for m in range(0, per_model, 20) for model_id in model_ids))
+    db._rebuild_ledger(cursor)
+    db._rebuild_rollups(cursor)
+    conn.commit()
+    conn.close()
+    print(f"[INFO] Generated {per_model * models} account values for {models} models "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def drop_indexes(db: Database):
+    conn = db.get_connection()
+    for name in INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    conn.commit()
+    conn.close()
+
+
+def measure(db: Database, repeat: int) -> dict:
+    """每个查询的耗时中位数（毫秒）"""
+    model_ids = [m['id'] for m in db.get_all_models()]
+    queries = {
+        'get_trades(50)': lambda mid: db.get_trades(mid, 50),
+        'get_conversations(20)': lambda mid: db.get_conversations(mid, 20),
+        'get_account_value_history(100)': lambda mid: db.get_account_value_history(mid, 100),
+        'get_portfolio': lambda mid: db.get_portfolio(mid),
+        'get_multi_model_chart_data(100)': lambda mid: db.get_multi_model_chart_data(100),
+        'get_aggregated_account_value_history(100)': lambda mid: db.get_aggregated_account_value_history(100),
+    }
+    results = {}
+    for label, query in queries.items():
+        samples = []
+        for i in range(repeat):
+            started = time.perf_counter()
+            query(model_ids[i % len(model_ids)])
+            samples.append((time.perf_counter() - started) * 1000)
+        results[label] = statistics.median(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dashboard query latency with and without indexes')
+    parser.add_argument('--db', default='benchmark_queries.db')
+    parser.add_argument('--rows', type=int, default=2_000_000, help='account_values rows')
+    parser.add_argument('--models', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keep', action='store_true', help='keep the database file afterwards')
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    db.init_db()
+    drop_indexes(db)  # 不带索引写入更快
+    populate(db, args.rows, args.models)
+
+    before = measure(db, args.repeat)
+    db.init_db()  # 通过升级路径重新创建索引
+    after = measure(db, args.repeat)
+
+    print(f"\n{'query':<44}{'no index (ms)':>15}{'indexed (ms)':>15}{'speedup':>10}")
+    for label in before:
+        print(f"{label:<44}{before[label]:>15.2f}{after[label]:>15.3f}{before[label] / after[label]:>9.0f}x")
+
+    db.close()
+    if not args.keep:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+
+if __name__ == '__main__':
+    main()
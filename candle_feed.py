@@ -0,0 +1,160 @@
+"""
+Candle feed - real OHLCV DataFrames for strategy signals
+K线数据源 - 为策略信号提供真实的 OHLCV K线（本地K线库或交易所），
+每个 tick 每个币种只抓取一次最细周期，高周期由 CandleResampler 本地合成，所有引擎共享
+"""
+import math
+import threading
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from candle_resampler import CandleResampler
+from candle_store import TIMEFRAME_MS
+
+
+# 与 TrendStrengthAnalyzer 默认分析的周期一致，第一个为主周期
+DEFAULT_TIMEFRAMES = ('1h', '4h', '1d')
+LOOKBACK_BARS = 700  # 覆盖多指标分析器最长的 EMA_676
+DERIVED_BARS = 60  # 合成的高周期至少覆盖的K线数
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+
+def candles_to_frame(candles: List[Dict]) -> pd.DataFrame:
+    """K线字典列表 -> DataFrame（与 ExchangeConnector.fetch_ohlcv 的格式相同）"""
+    df = pd.DataFrame(candles, columns=OHLCV_COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    return df
+
+
+class CandleFeed:
+    """
+    按 tick 缓存的多周期 K线
+
+    有 exchange（ExchangeConnector）时通过 fetch_ohlcv 获取，否则通过
+    MarketDataFetcher 的本地K线库（支持批量抓取时一次并发抓取所有币种）。
+    """
+
+    def __init__(self, market_fetcher, exchange=None, timeframes=DEFAULT_TIMEFRAMES,
+                 lookback_bars: int = LOOKBACK_BARS, derived_bars: int = DERIVED_BARS,
+                 tick_seconds: int = 60, resampler: CandleResampler = None):
+        """
+        Args:
+            market_fetcher: MarketDataFetcher 实例
+            exchange: ExchangeConnector 实例（可选），优先使用交易所K线
+            timeframes: 默认获取的周期
+            lookback_bars: 最细周期的K线数量
+            derived_bars: 合成的高周期至少包含的K线数量（决定最细周期需要抓取的历史长度）
+            tick_seconds: K线缓存的时间窗口（秒）
+            resampler: CandleResampler 实例（可选）
+        """
+        self.market_fetcher = market_fetcher
+        self.exchange = exchange
+        self.timeframes = tuple(timeframes)
+        self.lookback_bars = lookback_bars
+        self.derived_bars = derived_bars
+        self.tick_seconds = tick_seconds
+        self.resampler = resampler or CandleResampler()
+
+        self._lock = threading.Lock()
+        self._tick = None
+        self._frames: Dict[Tuple[str, str], pd.DataFrame] = {}
+        self._short_coins = set()  # 基础K线不足、已经告警过的币种
+
+        self.stats = {'batches': 0, 'frames_fetched': 0, 'frames_resampled': 0, 'frame_hits': 0, 'short_frames': 0}
+
+    def get_frames(self, coins: List[str], timeframes=None) -> Dict[str, Dict[str, pd.DataFrame]]:
+        """
+        返回 {coin: {timeframe: DataFrame}}，没有数据的币种/周期不出现在结果中
+
+        DataFrame 在同一 tick 内由多个引擎共享，调用方不要原地修改。
+        """
+        timeframes = tuple(timeframes or self.timeframes)
+        base_tf = min(timeframes, key=TIMEFRAME_MS.get)
+        tick = int(self.market_fetcher.clock() // self.tick_seconds)
+
+        with self._lock:
+            if tick != self._tick:
+                self._tick = tick
+                self._frames = {}
+
+            # 只抓取最细周期，一个批次覆盖所有缺失的币种
+            missing = [coin for coin in coins if (coin, base_tf) not in self._frames]
+            self.stats['frame_hits'] += len(coins) - len(missing)
+            if missing:
+                self.stats['batches'] += 1
+                base_bars = self._base_bars(base_tf, timeframes)
+                fetched = self._fetch(missing, base_tf, base_bars)
+                self._check_lengths(fetched, base_tf, base_bars, timeframes)
+                for coin in missing:
+                    # 抓取失败的币种在本 tick 内不再重试
+                    self._frames[(coin, base_tf)] = fetched.get(coin)
+                    self.stats['frames_fetched'] += coin in fetched
+
+            result = {}
+            for coin in coins:
+                base = self._frames[(coin, base_tf)]
+                if base is None:
+                    continue
+                frames = {}
+                for tf in timeframes:
+                    if tf == base_tf:
+                        frames[tf] = base.iloc[-self.lookback_bars:].reset_index(drop=True)
+                        continue
+                    if (coin, tf) not in self._frames:
+                        self._frames[(coin, tf)] = self.resampler.resample(coin, base, tf)
+                        self.stats['frames_resampled'] += 1
+                    frames[tf] = self._frames[(coin, tf)]
+                result[coin] = frames
+            return result
+
+    def _base_bars(self, base_tf: str, timeframes) -> int:
+        """最细周期需要的K线数：自身的 lookback 和每个高周期 derived_bars 对应的长度取最大"""
+        base_ms = TIMEFRAME_MS[base_tf]
+        return max([self.lookback_bars] +
+                   [self.derived_bars * TIMEFRAME_MS[tf] // base_ms for tf in timeframes])
+
+    def _check_lengths(self, fetched: Dict[str, pd.DataFrame], base_tf: str, base_bars: int, timeframes):
+        """基础K线少于需要的数量时高周期会被截短：每个币种在恢复完整之前只告警一次"""
+        for coin, df in fetched.items():
+            if len(df) >= base_bars:
+                self._short_coins.discard(coin)
+                continue
+            self.stats['short_frames'] += 1
+            if coin in self._short_coins:
+                continue
+            self._short_coins.add(coin)
+            derived = ', '.join(f"{tf}={len(df) * TIMEFRAME_MS[base_tf] // TIMEFRAME_MS[tf]}"
+                                for tf in timeframes if tf != base_tf)
+            print(f"[WARN] Candle feed got {len(df)}/{base_bars} {base_tf} bars for {coin}, "
+                  f"derived frames are short ({derived})")
+
+    def _fetch(self, coins: List[str], timeframe: str, bars: int) -> Dict[str, pd.DataFrame]:
+        if self.exchange is not None:
+            return self._fetch_from_exchange(coins, timeframe, bars)
+
+        days = math.ceil(bars * TIMEFRAME_MS[timeframe] / TIMEFRAME_MS['1d'])
+        if hasattr(self.market_fetcher, 'get_candles_bulk'):
+            candles = self.market_fetcher.get_candles_bulk(coins, timeframe, days=days)
+        else:
+            candles = {coin: self.market_fetcher.get_candles(coin, timeframe, days=days) for coin in coins}
+
+        return {coin: candles_to_frame(rows[-bars:]) for coin, rows in candles.items() if rows}
+
+    def _fetch_from_exchange(self, coins: List[str], timeframe: str, bars: int) -> Dict[str, pd.DataFrame]:
+        frames = {}
+        for coin in coins:
+            try:
+                df = self.exchange.fetch_ohlcv(f"{coin}/USDT", timeframe, limit=bars)
+                if len(df):
+                    frames[coin] = df
+            except Exception as e:
+                print(f"[WARN] Candle feed failed for {coin} {timeframe}: {e}")
+        return frames
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['cached_frames'] = sum(1 for df in self._frames.values() if df is not None)
+        stats['resampler'] = self.resampler.get_stats()
+        return stats
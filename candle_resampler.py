@@ -0,0 +1,152 @@
+"""
+Candle resampler - derive higher timeframes from the finest stored bars
+K线周期合成 - 用向量化的 numpy 分组归约从最细周期K线合成 4h/1d 等高周期K线，
+按 (coin, timeframe) 缓存结果，新的基础K线到达时只重算最新一根（未完成的）高周期K线
+"""
+import threading
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from candle_store import TIMEFRAME_MS
+
+
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+
+def _timestamps_ms(df: pd.DataFrame) -> np.ndarray:
+    """timestamp 列（datetime 或毫秒整数）-> 毫秒 int64 数组"""
+    ts = df['timestamp'].to_numpy()
+    if np.issubdtype(ts.dtype, np.datetime64):
+        return ts.astype('datetime64[ms]').astype(np.int64)
+    return ts.astype(np.int64)
+
+
+def _arrays(df: pd.DataFrame) -> Tuple[np.ndarray, ...]:
+    """DataFrame -> (毫秒时间戳, open, high, low, close, volume) 数组"""
+    return (_timestamps_ms(df),) + tuple(df[col].to_numpy(dtype=np.float64) for col in OHLCV_COLUMNS[1:])
+
+
+def resample_ohlcv(df: pd.DataFrame, timeframe: str, drop_partial_head: bool = True) -> pd.DataFrame:
+    """
+    把升序的基础K线合成为 timeframe 周期（按 UTC 对齐，与交易所一致）
+
+    用 reduceat 按桶归约而不是固定步长 reshape，基础K线有缺口时也能正确分组；
+    最后一根高周期K线可能未完成（只包含已有的基础K线）。
+
+    Args:
+        drop_partial_head: 第一根基础K线不在周期起点时丢弃不完整的第一根高周期K线
+    """
+    ts = _timestamps_ms(df) if not df.empty else None
+    period = TIMEFRAME_MS[timeframe]
+    if drop_partial_head and ts is not None and ts[0] % period:
+        df = df[ts >= ts[0] - ts[0] % period + period]
+    if df.empty:
+        return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+    ts, open_, high, low, close, volume = _arrays(df)
+    buckets = ts - ts % period
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.concatenate((starts[1:], [len(ts)])) - 1
+
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(buckets[starts], unit='ms'),
+        'open': open_[starts],
+        'high': np.maximum.reduceat(high, starts),
+        'low': np.minimum.reduceat(low, starts),
+        'close': close[ends],
+        'volume': np.add.reduceat(volume, starts),
+    })
+
+
+class _Resampled:
+    """一个 (coin, timeframe) 的缓存结果及其对应的第一根/最新基础K线"""
+
+    __slots__ = ('frame', 'first_base_ts', 'last_base_ts', 'last_base_bar')
+
+    def __init__(self, frame: pd.DataFrame, first_base_ts: int, last_base_ts: int, last_base_bar: Tuple[float, ...]):
+        self.frame = frame
+        self.first_base_ts = first_base_ts
+        self.last_base_ts = last_base_ts
+        self.last_base_bar = last_base_bar
+
+
+class CandleResampler:
+    """Per-(coin, timeframe) cache of resampled candles with incremental tail updates"""
+
+    def __init__(self, max_bars: int = 1000):
+        """
+        Args:
+            max_bars: 每个 (coin, timeframe) 缓存的最大K线数
+        """
+        self.max_bars = max_bars
+        self._lock = threading.Lock()
+        self._cache: Dict[Tuple[str, str], _Resampled] = {}
+        self.stats = {'hits': 0, 'incremental': 0, 'full': 0}
+
+    def resample(self, coin: str, base: pd.DataFrame, timeframe: str) -> pd.DataFrame:
+        """
+        由基础K线（升序 DataFrame）得到 timeframe 周期K线
+
+        - 最新基础K线未变化：直接返回缓存
+        - 有新的基础K线或最新一根被更新：只重算缓存中最后一根（未完成的）K线及之后的部分
+        - 无缓存、历史不连续或基础K线向前延伸（补抓了窗口开头）：全量计算
+        """
+        if base.empty:
+            return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+        base_ts = _timestamps_ms(base)
+        last = base.iloc[-1]
+        last_ts = int(base_ts[-1])
+        last_bar = (float(last['open']), float(last['high']), float(last['low']),
+                    float(last['close']), float(last['volume']))
+        key = (coin, timeframe)
+
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and base_ts[0] < cached.first_base_ts:
+            # 缓存由更短的基础K线算出，开头缺少的高周期K线只能全量重算
+            cached = None
+
+        if cached is not None and cached.last_base_ts == last_ts and cached.last_base_bar == last_bar:
+            with self._lock:
+                self.stats['hits'] += 1
+            return cached.frame
+
+        frame = None
+        if cached is not None and last_ts >= cached.last_base_ts and len(cached.frame):
+            # 从缓存最后一根K线的起点开始重算
+            partial_start = int(_timestamps_ms(cached.frame.iloc[-1:])[0])
+            if base_ts[0] <= partial_start:
+                tail = base[base_ts >= partial_start]
+                frame = pd.concat([cached.frame.iloc[:-1], resample_ohlcv(tail, timeframe, drop_partial_head=False)],
+                                  ignore_index=True)
+                stat = 'incremental'
+
+        if frame is None:
+            frame = resample_ohlcv(base, timeframe)
+            stat = 'full'
+
+        if len(frame) > self.max_bars:
+            frame = frame.iloc[-self.max_bars:].reset_index(drop=True)
+
+        with self._lock:
+            self._cache[key] = _Resampled(frame, int(base_ts[0]), last_ts, last_bar)
+            self.stats[stat] += 1
+        return frame
+
+    def invalidate(self, coin: str = None):
+        with self._lock:
+            if coin is None:
+                self._cache.clear()
+            else:
+                for key in [k for k in self._cache if k[0] == coin]:
+                    del self._cache[key]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['cached_series'] = len(self._cache)
+        return stats
@@ -0,0 +1,135 @@
+"""
+Candle store - persistent local OHLCV history
+本地K线存储 - 持久化历史K线，重启后只需补抓最新的几根
+"""
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+
+# 各周期对应的毫秒数
+TIMEFRAME_MS = {
+    '1m': 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+}
+
+
+class CandleStore:
+    """SQLite-backed OHLCV candle store keyed by (coin, timeframe, timestamp)"""
+
+    def __init__(self, db_path: str = 'market_candles.db'):
+        self.db_path = db_path
+        self.init_db()
+
+    def get_connection(self):
+        """Get database connection"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        """Initialize candle table"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS candles (
+                coin TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,  -- 开盘时间（毫秒）
+                open REAL NOT NULL,
+                high REAL NOT NULL,
+                low REAL NOT NULL,
+                close REAL NOT NULL,
+                volume REAL DEFAULT 0,
+                PRIMARY KEY (coin, timeframe, timestamp)
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+        conn.close()
+
+    def get_last_timestamp(self, coin: str, timeframe: str) -> Optional[int]:
+        """Get the open time of the newest stored bar"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT MAX(timestamp) AS last_ts FROM candles
+            WHERE coin = ? AND timeframe = ?
+        ''', (coin, timeframe))
+        row = cursor.fetchone()
+        conn.close()
+        return row['last_ts'] if row else None
+
+    def get_time_range(self, coin: str, timeframe: str) -> Tuple[Optional[int], Optional[int]]:
+        """Get the open times of the oldest and newest stored bars"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT MIN(timestamp) AS first_ts, MAX(timestamp) AS last_ts FROM candles
+            WHERE coin = ? AND timeframe = ?
+        ''', (coin, timeframe))
+        row = cursor.fetchone()
+        conn.close()
+        return (row['first_ts'], row['last_ts']) if row else (None, None)
+
+    def upsert_candles(self, coin: str, timeframe: str, candles: List[Dict]):
+        """Insert bars, replacing existing ones with the same open time (the newest bar may be partial)"""
+        if not candles:
+            return
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO candles (coin, timeframe, timestamp, open, high, low, close, volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (coin, timeframe, int(c['timestamp']), c['open'], c['high'], c['low'], c['close'], c.get('volume', 0))
+            for c in candles
+        ])
+        conn.commit()
+        conn.close()
+
+    def get_candles(self, coin: str, timeframe: str, since: Optional[int] = None,
+                    limit: Optional[int] = None) -> List[Dict]:
+        """
+        Get stored bars in ascending time order
+
+        Args:
+            coin: 币种
+            timeframe: 周期 ('1h', '4h', ...)
+            since: 只返回开盘时间 >= since（毫秒）的K线
+            limit: 只返回最新的 limit 根
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        query = '''
+            SELECT timestamp, open, high, low, close, volume FROM candles
+            WHERE coin = ? AND timeframe = ?
+        '''
+        params = [coin, timeframe]
+        if since is not None:
+            query += ' AND timestamp >= ?'
+            params.append(int(since))
+        query += ' ORDER BY timestamp DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.close()
+
+        return [dict(row) for row in reversed(rows)]
+
+    def prune(self, coin: str, timeframe: str, before: int):
+        """Delete bars older than `before` (毫秒)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM candles WHERE coin = ? AND timeframe = ? AND timestamp < ?
+        ''', (coin, timeframe, int(before)))
+        conn.commit()
+        conn.close()
@@ -0,0 +1,230 @@
+"""
+Cycle executor - bounded parallel execution of model trading cycles
+交易周期执行器 - 用固定大小的线程池并行执行各模型的交易周期，
+按 LLM 提供商和交易所分别限制并发数，并统计排队/执行指标
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+
+DEFAULT_WORKERS = 16
+DEFAULT_PROVIDER_LIMIT = 4  # 每个 LLM 提供商（API 主机）同时进行的请求数
+DEFAULT_EXCHANGE_LIMIT = 2  # 每个交易所同时执行的实盘下单数
+TIMING_WINDOW = 1000  # 排队/执行耗时统计保留的最近周期数
+
+
+class ConcurrencyLimiter:
+    """Named semaphores (one per provider or exchange) with wait statistics"""
+
+    def __init__(self, default_limit: int, limits: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            default_limit: 未单独配置的名称的并发上限
+            limits: 覆盖默认值的 {名称: 并发上限}
+        """
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._stats: Dict[str, Dict] = {}
+
+    def _semaphore(self, key: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limits.get(key, self.default_limit))
+                self._semaphores[key] = semaphore
+                self._stats[key] = {'in_use': 0, 'acquired': 0, 'waited': 0, 'wait_time': 0.0, 'max_wait': 0.0}
+            return semaphore
+
+    @contextmanager
+    def slot(self, key: str):
+        """占用 key 的一个并发名额，名额用完时阻塞等待"""
+        semaphore = self._semaphore(key)
+        start = time.monotonic()
+        if not semaphore.acquire(blocking=False):
+            semaphore.acquire()
+        wait = time.monotonic() - start
+
+        with self._lock:
+            stats = self._stats[key]
+            stats['in_use'] += 1
+            stats['acquired'] += 1
+            if wait > 0.001:
+                stats['waited'] += 1
+                stats['wait_time'] += wait
+                stats['max_wait'] = max(stats['max_wait'], wait)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stats[key]['in_use'] -= 1
+            semaphore.release()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                key: dict(stats, limit=self.limits.get(key, self.default_limit),
+                          wait_time=round(stats['wait_time'], 3), max_wait=round(stats['max_wait'], 3))
+                for key, stats in self._stats.items()
+            }
+
+
+class CycleExecutor:
+    """
+    所有模型共享的交易周期线程池
+
+    调度器线程只负责提交；同一模型的周期未结束时不会重复排队（替代 APScheduler 的
+    max_instances=1）。一个模型等待 LLM 或交易所时只占用自己的 worker 和对应
+    提供商/交易所的名额，不阻塞其他模型。
+
+    两种执行方式二选一：
+      - 未提供 pipeline：周期在本执行器的 max_workers 线程池中整体执行（submit / submit_cycle）
+      - 提供 pipeline：submit_cycle 把周期交给流水线，线程数由各阶段的 stage_workers 决定，
+        不创建本执行器的线程池，max_workers 和 submit 不可用
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, provider_limit: int = DEFAULT_PROVIDER_LIMIT,
+                 exchange_limit: int = DEFAULT_EXCHANGE_LIMIT, provider_limits: Optional[Dict[str, int]] = None,
+                 exchange_limits: Optional[Dict[str, int]] = None, pipeline=None):
+        """
+        Args:
+            max_workers: 同时执行的交易周期数（仅在没有 pipeline 时使用）
+            provider_limit: 每个 LLM 提供商（按 API 主机名区分）的默认并发上限
+            exchange_limit: 每个交易所的默认并发上限
+            provider_limits: 覆盖默认值的 {API 主机名: 并发上限}
+            exchange_limits: 覆盖默认值的 {交易所ID: 并发上限}
+            pipeline: TradingPipeline 实例（可选），提供时交易周期按阶段在流水线中执行
+        """
+        self.max_workers = max_workers
+        self.providers = ConcurrencyLimiter(provider_limit, provider_limits)
+        self.exchanges = ConcurrencyLimiter(exchange_limit, exchange_limits)
+        self.pipeline = pipeline
+        self._pool = None
+        if pipeline is None:
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='trading-cycle')
+
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}  # model_id -> 排队中或执行中的周期
+        self._running = 0
+        self._queue_waits = deque(maxlen=TIMING_WINDOW)
+        self._run_times = deque(maxlen=TIMING_WINDOW)
+        self._completions = deque()  # 最近 60 秒内完成的周期的时间
+        self.stats = {'submitted': 0, 'skipped': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, model_id: int, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """
+        提交模型的一个交易周期
+
+        Returns:
+            Future；该模型已有周期在排队或执行时返回 None
+        """
+        if self._pool is None:
+            raise RuntimeError("CycleExecutor runs cycles in the pipeline, use submit_cycle")
+        with self._lock:
+            if model_id in self._pending:
+                self.stats['skipped'] += 1
+                return None
+            self.stats['submitted'] += 1
+            future = self._pool.submit(self._run, model_id, time.monotonic(), fn, args, kwargs)
+            self._pending[model_id] = future
+        return future
+
+    def submit_cycle(self, model_id: int, engine) -> Optional[Future]:
+        """
+        提交 engine 的一个交易周期（有流水线时交给流水线，否则在线程池中整体执行）
+
+        Returns:
+            Future（结果为 execute_trading_cycle 的返回值）；该模型已有周期在排队或执行时返回 None
+        """
+        if self.pipeline is None:
+            return self.submit(model_id, engine.execute_trading_cycle)
+
+        with self._lock:
+            if model_id in self._pending:
+                self.stats['skipped'] += 1
+                return None
+            self.stats['submitted'] += 1
+            self._running += 1
+            started = time.monotonic()
+            future = self.pipeline.submit(engine)
+            self._pending[model_id] = future
+        # 流水线中的排队时间按阶段统计（pipeline.get_stats）
+        future.add_done_callback(
+            lambda f: self._finish(model_id, started, f.exception() is not None or self._is_failure(f.result())))
+        return future
+
+    def _run(self, model_id: int, queued_at: float, fn: Callable, args, kwargs):
+        started = time.monotonic()
+        with self._lock:
+            self._running += 1
+            self._queue_waits.append(started - queued_at)
+
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = self._is_failure(result)
+            return result
+        finally:
+            self._finish(model_id, started, failed)
+
+    @staticmethod
+    def _is_failure(result) -> bool:
+        return isinstance(result, dict) and not result.get('success', True)
+
+    def _finish(self, model_id: int, started: float, failed: bool):
+        finished = time.monotonic()
+        with self._lock:
+            self._running -= 1
+            self._pending.pop(model_id, None)
+            self._run_times.append(finished - started)
+            self._completions.append(finished)
+            self.stats['failed' if failed else 'completed'] += 1
+
+    def is_pending(self, model_id: int) -> bool:
+        with self._lock:
+            return model_id in self._pending
+
+    def provider_slot(self, api_url: str):
+        """LLM 请求的并发名额（同一 API 主机上的所有模型共享）"""
+        return self.providers.slot(urlsplit(api_url or '').hostname or api_url or 'default')
+
+    def exchange_slot(self, exchange_id: str):
+        """实盘下单的并发名额"""
+        return self.exchanges.slot(exchange_id or 'default')
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+        if self.pipeline is not None:
+            self.pipeline.stop()
+
+    def get_stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            while self._completions and self._completions[0] < now - 60:
+                self._completions.popleft()
+            waits = list(self._queue_waits)
+            run_times = list(self._run_times)
+            stats = dict(self.stats)
+            stats.update({
+                'workers': self.max_workers if self._pool is not None else 0,  # 流水线的线程数见 pipeline
+                'running': self._running,
+                'queued': len(self._pending) - self._running,
+                'cycles_last_minute': len(self._completions),
+            })
+
+        stats['queue_wait_avg'] = round(sum(waits) / len(waits), 3) if waits else 0.0
+        stats['queue_wait_max'] = round(max(waits), 3) if waits else 0.0
+        stats['run_time_avg'] = round(sum(run_times) / len(run_times), 3) if run_times else 0.0
+        stats['run_time_max'] = round(max(run_times), 3) if run_times else 0.0
+        stats['providers'] = self.providers.get_stats()
+        stats['exchanges'] = self.exchanges.get_stats()
+        if self.pipeline is not None:
+            stats['pipeline'] = self.pipeline.get_stats()
+        return stats
@@ -3,18 +3,314 @@ Database management module
 """
 import sqlite3
 import json
-from datetime import datetime
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+from metrics import (DB_QUERY_SECONDS, DB_ERRORS, DB_COMMIT_SECONDS, DB_POOL_CONNECTIONS,
+                     DB_POOL_CHECKOUTS, DB_POOL_WAIT_SECONDS, instrument_methods)
 
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_BUSY_TIMEOUT = 5.0  # 秒，等待其他连接释放写锁的时间
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHED_STATEMENTS = 256  # 每个连接缓存的预编译语句数
+CHECKOUT_TIMEOUT = 30.0  # 连接池用尽时等待空闲连接的时间（秒）
+
+# 账户价值汇总的时间桶：(名称, 秒数, 时间戳截取长度)，桶起点为 timestamp 截断后补零
+ROLLUP_BUCKETS = (('1m', 60, 16), ('1h', 3600, 13), ('1d', 86400, 10))
+ALL_MODELS = 0  # 汇总表中所有模型合计的 model_id
+
+# 热点查询使用的索引，init_db 时创建缺失的索引：
+# 仪表盘按 model_id 取最近 N 条交易/对话/账户价值（ORDER BY timestamp DESC LIMIT）；
+# 图表读取 account_value_rollups（主键），持仓查询使用 UNIQUE(model_id, coin, side) 自带的索引
+INDEXES = {
+    'idx_trades_model_time': ('trades', '(model_id, timestamp)'),
+    'idx_conversations_model_time': ('conversations', '(model_id, timestamp)'),
+    'idx_account_values_history': ('account_values', '(model_id, timestamp)'),  # get_account_value_history
+    'idx_conversation_archive_model_time': ('conversation_archive', '(model_id, timestamp)'),
+}
+# 不再有查询使用、只增加写入开销的索引，init_db 时删除
+RETIRED_INDEXES = ('idx_account_values_model_time', 'idx_portfolios_open')
+
+
+class ConnectionPool:
+    """
+    SQLite 连接池：连接以 WAL 模式打开并长期复用，每次只借给一个线程
+
+    WAL 模式下读不阻塞写、写不阻塞读，仪表盘的查询与交易周期的写入可以同时进行；
+    写入之间仍然互斥，由 busy timeout 排队等待。
+    """
+
+    def __init__(self, db_path: str, max_connections: int = DEFAULT_POOL_SIZE,
+                 busy_timeout: float = DEFAULT_BUSY_TIMEOUT, mmap_size: int = DEFAULT_MMAP_SIZE,
+                 cached_statements: int = DEFAULT_CACHED_STATEMENTS):
+        self.db_path = db_path
+        self.max_connections = max_connections
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._cond = threading.Condition()
+        self._idle: List[sqlite3.Connection] = []  # 后进先出，优先复用最近用过的连接
+        self._open = 0
+        self._in_use = 0
+        self.stats = {'opened': 0, 'reused': 0, 'waits': 0, 'rollbacks': 0, 'discarded': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        # 只在新建的空数据库上设置（必须在切换 WAL 之前）：已有数据库上这条 PRAGMA 要拿写锁，
+        # 有写入进行时新连接会等到 busy timeout；已有数据库的转换见 retention.py
+        if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')  # 写入数据库文件，已是 WAL 时不做任何事
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL 下只在检查点 fsync，断电最多丢失最近的事务
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """借出一个连接（没有空闲连接且已达上限时等待），用完后必须 release"""
+        started = time.perf_counter()
+        waited = False
+        with self._cond:
+            while not self._idle and self._open >= self.max_connections:
+                remaining = CHECKOUT_TIMEOUT - (time.perf_counter() - started)
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"connection pool exhausted ({self.max_connections} connections in use)")
+                if not waited:
+                    waited = True
+                    self.stats['waits'] += 1
+                self._cond.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+                self.stats['opened'] += 1
+            else:
+                self.stats['reused'] += 1
+            self._in_use += 1
+            self._update_gauges()
+
+        if waited:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        DB_POOL_CHECKOUTS.inc(source='reused' if conn is not None else 'opened')
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._discard()
+                raise
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接：未提交的事务回滚，已损坏的连接直接关闭"""
+        try:
+            rolled_back = conn.in_transaction
+            if rolled_back:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._discard()
+            return
+        with self._cond:
+            if rolled_back:
+                self.stats['rollbacks'] += 1
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._update_gauges()
+            self._cond.notify()
+
+    def _discard(self):
+        with self._cond:
+            self._open -= 1
+            self._in_use -= 1
+            self.stats['discarded'] += 1
+            self._update_gauges()
+            self._cond.notify()
+
+    def _update_gauges(self):
+        DB_POOL_CONNECTIONS.set(self._in_use, state='in_use')
+        DB_POOL_CONNECTIONS.set(len(self._idle), state='idle')
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接归还后照常入池）"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._update_gauges()
+        for conn in idle:
+            conn.close()
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self.stats)
+            stats.update({'max_connections': self.max_connections, 'open': self._open,
+                          'in_use': self._in_use, 'idle': len(self._idle)})
+        return stats
+
+
+class _PooledConnection:
+    """Connection checked out of the pool: close() hands it back instead of closing it"""
+
+    def __init__(self, pool: ConnectionPool, conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+
+    def commit(self):
+        with DB_COMMIT_SECONDS.time():
+            self._conn.commit()
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __del__(self):
+        # 调用方在 close 之前抛出异常时，连接随代理对象回收归还连接池
+        if self.__dict__.get('_conn') is not None:
+            self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _UnitOfWorkConnection:
+    """Connection handed out inside a unit of work: commit/close are deferred to the unit of work"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class UnitOfWork:
+    """
+    一个事务：绑定期间当前线程上所有 Database 方法共用同一个连接，只在 commit 时提交一次
+
+    事务以 BEGIN IMMEDIATE 开始，创建时即持有写锁：只应在所有网络调用之后打开，
+    并在同一线程上提交或回滚，不要跨越流水线队列或 HTTP 请求持有。
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+        self._conn = pool.acquire()
+        try:
+            # 显式开始事务并立即加写锁：避免读后升级写锁时的 SQLITE_BUSY，保存点的 RELEASE 不会提前提交
+            self._conn.execute('BEGIN IMMEDIATE')
+        except Exception:
+            pool.release(self._conn)
+            raise
+        self.connection = _UnitOfWorkConnection(self._conn)
+        self.closed = False
+
+    @contextmanager
+    def savepoint(self, name: str = 'unit_of_work_step'):
+        """with 块抛出异常时只回滚块内的写入，事务中之前的写入保留"""
+        self._conn.execute(f'SAVEPOINT {name}')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute(f'ROLLBACK TO {name}')
+            self._conn.execute(f'RELEASE {name}')
+            raise
+        self._conn.execute(f'RELEASE {name}')
+
+    def commit(self):
+        try:
+            with DB_COMMIT_SECONDS.time():
+                self._conn.commit()
+        finally:
+            self._close()
+
+    def rollback(self):
+        try:
+            self._conn.rollback()
+        finally:
+            self._close()
+
+    def _close(self):
+        self._pool.release(self._conn)
+        self.closed = True
+
+
+@instrument_methods(DB_QUERY_SECONDS, errors=DB_ERRORS,
+                    exclude=('get_connection', 'begin_unit_of_work', 'bind', 'unit_of_work', 'savepoint',
+                             'close'))
 class Database:
-    def __init__(self, db_path: str = 'AITradeGame.db'):
+    def __init__(self, db_path: str = 'AITradeGame.db', pool_size: int = DEFAULT_POOL_SIZE,
+                 busy_timeout: float = DEFAULT_BUSY_TIMEOUT):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, max_connections=pool_size, busy_timeout=busy_timeout)
+        self._local = threading.local()  # 当前线程绑定的 UnitOfWork
         
     def get_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Get database connection (the bound unit of work's connection, if any, else one from the pool)"""
+        unit_of_work = getattr(self._local, 'unit_of_work', None)
+        if unit_of_work is not None:
+            return unit_of_work.connection
+        return _PooledConnection(self.pool, self.pool.acquire())
+
+    def close(self):
+        """关闭连接池中的空闲连接"""
+        self.pool.close_all()
+
+    # ============ Unit of Work ============
+
+    def begin_unit_of_work(self) -> UnitOfWork:
+        """开始一个事务，用 bind() 把它绑定到执行写入的线程，最后 commit() 或 rollback()"""
+        return UnitOfWork(self.pool)
+
+    @contextmanager
+    def bind(self, unit_of_work: UnitOfWork):
+        """with 块内当前线程的 get_connection 返回 unit_of_work 的连接"""
+        previous = getattr(self._local, 'unit_of_work', None)
+        self._local.unit_of_work = unit_of_work
+        try:
+            yield unit_of_work
+        finally:
+            self._local.unit_of_work = previous
+
+    @contextmanager
+    def unit_of_work(self):
+        """
+        with 块内的所有写入在一个事务中完成：正常退出时提交一次，异常时回滚
+
+        嵌套调用加入外层的事务。
+        """
+        current = getattr(self._local, 'unit_of_work', None)
+        if current is not None:
+            yield current
+            return
+
+        unit_of_work = self.begin_unit_of_work()
+        try:
+            with self.bind(unit_of_work):
+                yield unit_of_work
+        except BaseException:
+            unit_of_work.rollback()
+            raise
+        unit_of_work.commit()
+
+    @contextmanager
+    def savepoint(self):
+        """当前线程绑定了 unit of work 时设置保存点（见 UnitOfWork.savepoint），否则不生效"""
+        unit_of_work = getattr(self._local, 'unit_of_work', None)
+        if unit_of_work is None:
+            yield
+            return
+        with unit_of_work.savepoint():
+            yield
     
     def init_db(self):
         """Initialize database tables"""
@@ -155,6 +451,171 @@ class Database:
         # Add trading interval column (per-model trading frequency)
         if 'trading_interval_minutes' not in columns:
             cursor.execute('ALTER TABLE models ADD COLUMN trading_interval_minutes INTEGER DEFAULT 60')
+
+        # Per-model running totals of realized P&L and fees (maintained by add_trade)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'model_ledger'")
+        ledger_exists = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS model_ledger (
+                model_id INTEGER PRIMARY KEY,
+                realized_pnl REAL DEFAULT 0,
+                total_fees REAL DEFAULT 0,
+                trade_count INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (model_id) REFERENCES models(id)
+            )
+        ''')
+        if not ledger_exists:
+            self._rebuild_ledger(cursor)
+
+        # Account value OHLC per time bucket, per model and for all models (maintained by record_account_value)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'account_value_rollups'")
+        rollups_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS account_value_rollups (
+                bucket TEXT NOT NULL,
+                model_id INTEGER NOT NULL,
+                bucket_start TIMESTAMP NOT NULL,
+                open REAL NOT NULL,
+                high REAL NOT NULL,
+                low REAL NOT NULL,
+                close REAL NOT NULL,
+                cash REAL NOT NULL,
+                positions_value REAL NOT NULL,
+                samples INTEGER DEFAULT 1,
+                model_count INTEGER DEFAULT 1,
+                PRIMARY KEY (bucket, model_id, bucket_start)
+            ) WITHOUT ROWID
+        ''')
+        # Latest snapshot of each model, summed into the all-models rollups
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS account_value_latest (
+                model_id INTEGER PRIMARY KEY,
+                total_value REAL NOT NULL,
+                cash REAL NOT NULL,
+                positions_value REAL NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                FOREIGN KEY (model_id) REFERENCES models(id)
+            )
+        ''')
+        if not rollups_exist:
+            self._rebuild_rollups(cursor)
+
+        # Compressed conversations moved out of the conversations table by the retention job
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_archive (
+                id INTEGER PRIMARY KEY,
+                model_id INTEGER NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                payload BLOB NOT NULL,
+                FOREIGN KEY (model_id) REFERENCES models(id)
+            )
+        ''')
+
+        self._ensure_indexes(cursor)
+
+    def _ensure_indexes(self, cursor) -> List[str]:
+        """Create missing INDEXES, drop RETIRED_INDEXES and refresh planner statistics for new indexes"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing = {row[0] for row in cursor.fetchall()}
+        retired = [name for name in RETIRED_INDEXES if name in existing]
+        for name in retired:
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+        if retired:
+            print(f"[INFO] Dropped unused indexes: {', '.join(retired)}")
+        created = []
+        for name, (table, definition) in INDEXES.items():
+            if name not in existing:
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}{definition}')
+                created.append(name)
+        for table in sorted({INDEXES[name][0] for name in created}):
+            cursor.execute(f'ANALYZE {table}')
+        if created:
+            print(f"[INFO] Created indexes: {', '.join(created)}")
+        return created
+
+    def _rebuild_ledger(self, cursor, model_id: int = None):
+        """Recompute model_ledger from the trades table (all models, or one)"""
+        where = 'WHERE model_id = ?' if model_id is not None else ''
+        params = (model_id,) if model_id is not None else ()
+        cursor.execute(f'DELETE FROM model_ledger {where}', params)
+        cursor.execute(f'''
+            INSERT INTO model_ledger (model_id, realized_pnl, total_fees, trade_count, updated_at)
+            SELECT model_id, COALESCE(SUM(pnl), 0), COALESCE(SUM(fee), 0), COUNT(*), CURRENT_TIMESTAMP
+            FROM trades
+            {where}
+            GROUP BY model_id
+        ''', params)
+
+    def _rebuild_rollups(self, cursor):
+        """Recompute account_value_rollups and account_value_latest by replaying account_values in order"""
+        cursor.execute('DELETE FROM account_value_rollups')
+        cursor.execute('DELETE FROM account_value_latest')
+        cursor.execute('SELECT id FROM models')
+        model_ids = {row[0] for row in cursor.fetchall()}
+
+        writer = cursor.connection.cursor()
+        latest = {}
+        current = {}  # (bucket, model_id) -> 正在累计的汇总行
+        finished = []
+        replayed = 0
+        cursor.execute('''
+            SELECT model_id, total_value, cash, positions_value, timestamp
+            FROM account_values ORDER BY id
+        ''')
+        for model_id, total_value, cash, positions_value, timestamp in cursor:
+            if model_id not in model_ids:
+                continue
+            latest[model_id] = (total_value, cash, positions_value, timestamp)
+            snapshots = [
+                (model_id, total_value, cash, positions_value, 1),
+                (ALL_MODELS, sum(v[0] for v in latest.values()), sum(v[1] for v in latest.values()),
+                 sum(v[2] for v in latest.values()), len(latest)),
+            ]
+            for bucket, _, width in ROLLUP_BUCKETS:
+                start = self._bucket_start(timestamp, width)
+                for snapshot_model, value, snapshot_cash, snapshot_positions, count in snapshots:
+                    row = current.get((bucket, snapshot_model))
+                    if row is None or row[2] != start:
+                        if row is not None:
+                            finished.append(row)
+                        current[(bucket, snapshot_model)] = [bucket, snapshot_model, start, value, value, value,
+                                                             value, snapshot_cash, snapshot_positions, 1, count]
+                    else:
+                        row[4] = max(row[4], value)
+                        row[5] = min(row[5], value)
+                        row[6:9] = [value, snapshot_cash, snapshot_positions]
+                        row[9] += 1
+                        row[10] = count
+            replayed += 1
+            if len(finished) >= 10000:
+                writer.executemany('INSERT INTO account_value_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   finished)
+                finished = []
+
+        finished.extend(current.values())
+        writer.executemany('INSERT INTO account_value_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', finished)
+        writer.executemany('''
+            INSERT INTO account_value_latest (model_id, total_value, cash, positions_value, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(model_id,) + values for model_id, values in latest.items()])
+        if replayed:
+            print(f"[INFO] Account value rollups rebuilt from {replayed} snapshots")
+
+    @staticmethod
+    def _bucket_start(timestamp: str, width: int) -> str:
+        """'2024-05-01 12:34:56' 截取前 width 个字符后补零，得到桶的起点"""
+        return timestamp[:width] + '0000-01-01 00:00:00'[width:]
+
+    def rebuild_ledger(self, model_id: int = None) -> int:
+        """Rebuild the realized P&L ledger from trade history; returns the number of ledger rows written"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        self._rebuild_ledger(cursor, model_id)
+        rows = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return rows
     
     # ============ Model Management (Moved) ============
     
@@ -167,6 +628,10 @@ class Database:
         cursor.execute('DELETE FROM trades WHERE model_id = ?', (model_id,))
         cursor.execute('DELETE FROM conversations WHERE model_id = ?', (model_id,))
         cursor.execute('DELETE FROM account_values WHERE model_id = ?', (model_id,))
+        cursor.execute('DELETE FROM model_ledger WHERE model_id = ?', (model_id,))
+        cursor.execute('DELETE FROM account_value_rollups WHERE model_id = ?', (model_id,))
+        cursor.execute('DELETE FROM account_value_latest WHERE model_id = ?', (model_id,))
+        cursor.execute('DELETE FROM conversation_archive WHERE model_id = ?', (model_id,))
         conn.commit()
         conn.close()
     
@@ -205,18 +670,18 @@ class Database:
         ''', (model_id,))
         positions = [dict(row) for row in cursor.fetchall()]
         
-        # Get initial capital
-        cursor.execute('SELECT initial_capital FROM models WHERE id = ?', (model_id,))
-        initial_capital = cursor.fetchone()['initial_capital']
-        
-        # Calculate realized P&L (sum of all trade P&L minus fees)
+        # Get initial capital and realized P&L (ledger running totals: trade P&L minus fees)
         cursor.execute('''
             SELECT
-                COALESCE(SUM(pnl), 0) - COALESCE(SUM(fee), 0) as total_pnl
-            FROM trades
-            WHERE model_id = ?
+                m.initial_capital,
+                COALESCE(l.realized_pnl, 0) - COALESCE(l.total_fees, 0) as total_pnl
+            FROM models m
+            LEFT JOIN model_ledger l ON l.model_id = m.id
+            WHERE m.id = ?
         ''', (model_id,))
-        realized_pnl = cursor.fetchone()['total_pnl']
+        row = cursor.fetchone()
+        initial_capital = row['initial_capital']
+        realized_pnl = row['total_pnl']
         
         # Calculate margin used
         margin_used = sum([p['quantity'] * p['avg_price'] / p['leverage'] for p in positions])
@@ -293,6 +758,16 @@ class Database:
             INSERT INTO trades (model_id, coin, signal, quantity, price, leverage, side, pnl, fee)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (model_id, coin, signal, quantity, price, leverage, side, pnl, fee))
+        # Same transaction as the trade row, so the ledger never drifts from trades
+        cursor.execute('''
+            INSERT INTO model_ledger (model_id, realized_pnl, total_fees, trade_count, updated_at)
+            VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT(model_id) DO UPDATE SET
+                realized_pnl = realized_pnl + excluded.realized_pnl,
+                total_fees = total_fees + excluded.total_fees,
+                trade_count = trade_count + 1,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (model_id, pnl or 0, fee or 0))
         conn.commit()
         conn.close()
     
@@ -333,18 +808,97 @@ class Database:
         rows = cursor.fetchall()
         conn.close()
         return [dict(row) for row in rows]
+
+    def archive_conversations(self, before_id: int, limit: int = 1000) -> int:
+        """把 id 小于 before_id 的最早 limit 条对话压缩后移入 conversation_archive，返回移动的条数"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, model_id, user_prompt, ai_response, cot_trace, timestamp FROM conversations
+            WHERE id < ? ORDER BY id LIMIT ?
+        ''', (before_id, limit))
+        rows = cursor.fetchall()
+        if rows:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO conversation_archive (id, model_id, timestamp, payload)
+                VALUES (?, ?, ?, ?)
+            ''', [(row['id'], row['model_id'], row['timestamp'], zlib.compress(json.dumps({
+                'user_prompt': row['user_prompt'],
+                'ai_response': row['ai_response'],
+                'cot_trace': row['cot_trace']
+            }, ensure_ascii=False).encode('utf-8'))) for row in rows])
+            cursor.execute('DELETE FROM conversations WHERE id <= ?', (rows[-1]['id'],))
+        conn.commit()
+        conn.close()
+        return len(rows)
+
+    def get_archived_conversations(self, model_id: int, limit: int = 20) -> List[Dict]:
+        """Get archived conversation history (same fields as get_conversations)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, model_id, timestamp, payload FROM conversation_archive WHERE model_id = ?
+            ORDER BY timestamp DESC LIMIT ?
+        ''', (model_id, limit))
+        rows = cursor.fetchall()
+        conn.close()
+
+        conversations = []
+        for row in rows:
+            conversation = {'id': row['id'], 'model_id': row['model_id'], 'timestamp': row['timestamp']}
+            conversation.update(json.loads(zlib.decompress(row['payload']).decode('utf-8')))
+            conversations.append(conversation)
+        return conversations
     
     # ============ Account Value History ============
     
     def record_account_value(self, model_id: int, total_value: float, 
                             cash: float, positions_value: float):
-        """Record account value snapshot"""
+        """Record account value snapshot and fold it into the per-model and all-models rollups"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
         cursor.execute('''
-            INSERT INTO account_values (model_id, total_value, cash, positions_value)
-            VALUES (?, ?, ?, ?)
-        ''', (model_id, total_value, cash, positions_value))
+            INSERT INTO account_values (model_id, total_value, cash, positions_value, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (model_id, total_value, cash, positions_value, timestamp))
+        cursor.execute('''
+            INSERT INTO account_value_latest (model_id, total_value, cash, positions_value, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(model_id) DO UPDATE SET
+                total_value = excluded.total_value,
+                cash = excluded.cash,
+                positions_value = excluded.positions_value,
+                timestamp = excluded.timestamp
+        ''', (model_id, total_value, cash, positions_value, timestamp))
+
+        # 所有模型合计 = 每个模型最近一次快照之和
+        cursor.execute('''
+            SELECT SUM(total_value), SUM(cash), SUM(positions_value), COUNT(*)
+            FROM account_value_latest
+        ''')
+        totals = tuple(cursor.fetchone())
+
+        rows = []
+        for bucket, _, width in ROLLUP_BUCKETS:
+            start = self._bucket_start(timestamp, width)
+            for snapshot in ((model_id, total_value, cash, positions_value, 1), (ALL_MODELS,) + totals):
+                value = snapshot[1]
+                rows.append((bucket, snapshot[0], start, value, value, value, value, snapshot[2], snapshot[3],
+                             snapshot[4]))
+        cursor.executemany('''
+            INSERT INTO account_value_rollups
+                (bucket, model_id, bucket_start, open, high, low, close, cash, positions_value, model_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(bucket, model_id, bucket_start) DO UPDATE SET
+                high = MAX(high, excluded.close),
+                low = MIN(low, excluded.close),
+                close = excluded.close,
+                cash = excluded.cash,
+                positions_value = excluded.positions_value,
+                samples = samples + 1,
+                model_count = excluded.model_count
+        ''', rows)
         conn.commit()
         conn.close()
     
@@ -360,41 +914,52 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
 
-    def get_aggregated_account_value_history(self, limit: int = 100) -> List[Dict]:
-        """Get aggregated account value history across all models"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @staticmethod
+    def _choose_bucket(hours: Optional[float], limit: int) -> tuple:
+        """覆盖 hours 小时且点数不超过 limit 的最细时间桶（范围越长桶越粗），返回 ROLLUP_BUCKETS 中的一项；未指定范围时为 1m"""
+        if not hours:
+            return ROLLUP_BUCKETS[0]
+        for bucket in ROLLUP_BUCKETS:
+            if hours * 3600 / bucket[1] <= limit:
+                return bucket
+        return ROLLUP_BUCKETS[-1]
 
-        # Get the most recent timestamp for each time point across all models
-        cursor.execute('''
-            SELECT timestamp,
-                   SUM(total_value) as total_value,
-                   SUM(cash) as cash,
-                   SUM(positions_value) as positions_value,
-                   COUNT(DISTINCT model_id) as model_count
-            FROM (
-                SELECT timestamp,
-                       total_value,
-                       cash,
-                       positions_value,
-                       model_id,
-                       ROW_NUMBER() OVER (PARTITION BY model_id, DATE(timestamp) ORDER BY timestamp DESC) as rn
-                FROM account_values
-            ) grouped
-            WHERE rn <= 10  -- Keep up to 10 records per model per day for aggregation
-            GROUP BY DATE(timestamp), HOUR(timestamp)
-            ORDER BY timestamp DESC
+    def _get_rollups(self, cursor, model_id: int, limit: int, hours: Optional[float]) -> List:
+        """最近的 limit 个桶（新的在前），只在主键索引上查找，耗时与历史长度无关"""
+        bucket, _, width = self._choose_bucket(hours, limit)
+        since = ''
+        if hours:
+            since = self._bucket_start((datetime.utcnow() - timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S'),
+                                       width)
+        cursor.execute('''
+            SELECT bucket_start, open, high, low, close, cash, positions_value, model_count
+            FROM account_value_rollups
+            WHERE bucket = ? AND model_id = ? AND bucket_start >= ?
+            ORDER BY bucket_start DESC
             LIMIT ?
-        ''', (limit,))
+        ''', (bucket, model_id, since, limit))
+        return cursor.fetchall()
 
-        rows = cursor.fetchall()
+    def get_aggregated_account_value_history(self, limit: int = 100, hours: float = None) -> List[Dict]:
+        """Get aggregated account value history across all models
+
+        Args:
+            limit: 最多返回的点数
+            hours: 时间范围（小时），决定使用 1m / 1h / 1d 哪一级汇总；为空时返回最近 limit 分钟
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        rows = self._get_rollups(cursor, ALL_MODELS, limit, hours)
         conn.close()
 
         result = []
         for row in rows:
             result.append({
-                'timestamp': row['timestamp'],
-                'total_value': row['total_value'],
+                'timestamp': row['bucket_start'],
+                'total_value': row['close'],
+                'open': row['open'],
+                'high': row['high'],
+                'low': row['low'],
                 'cash': row['cash'],
                 'positions_value': row['positions_value'],
                 'model_count': row['model_count']
@@ -402,8 +967,8 @@ class Database:
 
         return result
 
-    def get_multi_model_chart_data(self, limit: int = 100) -> List[Dict]:
-        """Get chart data for all models to display in multi-line chart"""
+    def get_multi_model_chart_data(self, limit: int = 100, hours: float = None) -> List[Dict]:
+        """Get chart data for all models to display in multi-line chart (bucket closes, see get_aggregated_account_value_history)"""
         conn = self.get_connection()
         cursor = conn.cursor()
 
@@ -418,14 +983,7 @@ class Database:
             model_name = model['name']
 
             # Get account value history for this model
-            cursor.execute('''
-                SELECT timestamp, total_value FROM account_values
-                WHERE model_id = ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (model_id, limit))
-
-            history = cursor.fetchall()
+            history = self._get_rollups(cursor, model_id, limit, hours)
 
             if history:
                 # Convert to list of dicts with model info
@@ -434,8 +992,8 @@ class Database:
                     'model_name': model_name,
                     'data': [
                         {
-                            'timestamp': row['timestamp'],
-                            'value': row['total_value']
+                            'timestamp': row['bucket_start'],
+                            'value': row['close']
                         } for row in history
                     ]
                 }
@@ -0,0 +1,88 @@
+"""
+HTTP client - pooled keep-alive sessions for all outbound HTTP calls
+HTTP 客户端 - 按主机复用连接池（keep-alive），429/5xx 自动退避重试
+
+配置（环境变量）:
+    HTTP_CONNECT_TIMEOUT  连接超时（秒），默认 3
+    HTTP_READ_TIMEOUT     读取超时（秒），默认 10
+    HTTP_MAX_RETRIES      最大重试次数，默认 3
+    HTTP_RETRY_BACKOFF    退避系数（秒），默认 0.5
+    HTTP_POOL_MAXSIZE     每个主机的最大连接数，默认 20
+"""
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+DEFAULT_TIMEOUT = (
+    float(os.getenv('HTTP_CONNECT_TIMEOUT', '3')),
+    float(os.getenv('HTTP_READ_TIMEOUT', '10')),
+)
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '20'))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,  # 重试耗尽后返回最后一次响应，由调用方 raise_for_status
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': 'AITradeGame/1.0'})
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """Get the shared session (and connection pool) for the host of `url`"""
+    parts = urlsplit(url)
+    host_key = f"{parts.scheme}://{parts.netloc}"
+
+    session = _sessions.get(host_key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host_key)
+            if session is None:
+                session = _build_session()
+                _sessions[host_key] = session
+    return session
+
+
+def http_get(url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+             timeout=None) -> requests.Response:
+    """GET through the pooled session for the URL's host
+
+    Args:
+        timeout: 秒数或 (connect, read) 元组，默认使用 DEFAULT_TIMEOUT
+    """
+    return get_session(url).get(url, params=params, headers=headers,
+                                timeout=timeout if timeout is not None else DEFAULT_TIMEOUT)
+
+
+def close_all():
+    """关闭所有会话（进程退出或测试时使用）"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -6,6 +6,7 @@ from typing import Dict, Optional, List
 from datetime import datetime
 import json
 from exchange_connector import ExchangeManager, ExchangeConnector
+from metrics import LIVE_ORDER_SECONDS, LIVE_ORDERS
 
 logger = logging.getLogger(__name__)
 
@@ -180,6 +181,17 @@ class LiveTradeExecutor:
         Returns:
             执行结果
         """
+        labels = {'exchange': exchange_id, 'action': signal.get('action', '')}
+        try:
+            with LIVE_ORDER_SECONDS.time(**labels):
+                result = self._execute_signal(exchange_id, symbol, signal)
+        except Exception:
+            LIVE_ORDERS.inc(outcome='error', **labels)
+            raise
+        LIVE_ORDERS.inc(outcome='ok' if result.get('success') else 'failed', **labels)
+        return result
+
+    def _execute_signal(self, exchange_id: str, symbol: str, signal: Dict) -> Dict:
         logger.info(f"\n{'='*60}")
         logger.info(f"[执行器] 收到信号: {exchange_id} {symbol}")
         logger.info(f"         动作={signal['action']} 置信度={signal['confidence']}%")
@@ -0,0 +1,286 @@
+"""
+Market data cache - two-level TTL cache for MarketDataFetcher
+行情数据两级缓存：进程内 LRU（L1） + SQLite market_data_cache 表（L2）
+
+L2 让多个 app worker 共享已抓取的行情，并在重启后直接复用，避免同时冲击外部 API。
+过期条目在 max_staleness 秒内仍保留，可通过 get_stale() 先返回旧值再后台刷新。
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+# 各数据类型的默认有效期（秒），data_type 中 ':' 之前的部分用于查找
+DEFAULT_TTLS = {
+    'ticker': 5,
+    'coin_detail': 60,
+    'market_chart': 300,
+}
+
+
+class MarketDataCache:
+    """In-memory LRU (L1) backed by the `market_data_cache` table (L2)"""
+
+    def __init__(self, db=None, max_entries: int = 2048, ttls: Optional[Dict[str, float]] = None,
+                 sweep_interval: float = 300, registry=None, max_staleness: float = 60):
+        """
+        Args:
+            db: Database 实例；为 None 时只使用 L1
+            max_entries: L1 最大条目数，超出后淘汰最久未使用的条目
+            ttls: 覆盖默认的各数据类型有效期
+            sweep_interval: 清理过期 L2 记录的最小间隔（秒）
+            registry: SymbolRegistry 实例，用于 symbol -> coin_id 查找（可选）
+            max_staleness: 过期后仍可由 get_stale() 返回的最长时间（秒）
+        """
+        self.db = db
+        self.registry = registry
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.sweep_interval = sweep_interval
+        self.max_staleness = max_staleness
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (data_type, key) -> (value, stored_at, expires_at)
+        self._coin_ids = {}
+        self._last_sweep = time.time()
+        self.l2_enabled = db is not None and self._check_l2_table()
+
+        self.stats = {
+            'l1_hits': 0,
+            'l2_hits': 0,
+            'misses': 0,
+            'stale_hits': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expired_swept': 0,
+        }
+
+    def ttl_for(self, data_type: str) -> float:
+        return self.ttls.get(data_type.split(':')[0], 5)
+
+    # ============ Public API ============
+
+    def get(self, data_type: str, key: str) -> Optional[Any]:
+        """Look up L1 then L2; returns None on miss or expiry"""
+        now = time.time()
+        cache_key = (data_type, key)
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(cache_key)
+                    self.stats['l1_hits'] += 1
+                    return entry[0]
+                if entry[2] + self.max_staleness <= now:
+                    del self._entries[cache_key]
+
+        if self.l2_enabled:
+            l2_entry = self._l2_get(data_type, key, now)
+            if l2_entry is not None:
+                value, stored_at, expires_at = l2_entry
+                with self._lock:
+                    self._put_l1(cache_key, value, stored_at, expires_at)
+                    self.stats['l2_hits'] += 1
+                return value
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def get_stale(self, data_type: str, key: str) -> Optional[Tuple[Any, bool]]:
+        """
+        Stale-while-revalidate lookup: returns (value, fresh) for entries that
+        are fresh or expired less than max_staleness seconds ago, else None.
+        Never blocks on the network; callers revalidate when fresh is False.
+        """
+        now = time.time()
+        cache_key = (data_type, key)
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[2] + self.max_staleness > now:
+                self._entries.move_to_end(cache_key)
+                fresh = entry[2] > now
+                self.stats['l1_hits' if fresh else 'stale_hits'] += 1
+                return entry[0], fresh
+
+        if self.l2_enabled:
+            l2_entry = self._l2_get(data_type, key, now - self.max_staleness)
+            if l2_entry is not None:
+                value, stored_at, expires_at = l2_entry
+                fresh = expires_at > now
+                with self._lock:
+                    self._put_l1(cache_key, value, stored_at, expires_at)
+                    self.stats['l2_hits' if fresh else 'stale_hits'] += 1
+                return value, fresh
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, data_type: str, key: str, value: Any, data_source: str = 'binance'):
+        """Store in L1 and (for known coins) in L2"""
+        self.set_many(data_type, {key: value}, data_source=data_source)
+
+    def set_many(self, data_type: str, values: Dict[str, Any], data_source: str = 'binance'):
+        """Store several keys from one fetch; the L2 rows are written in a single transaction"""
+        if not values:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_for(data_type)
+
+        with self._lock:
+            for key, value in values.items():
+                self._put_l1((data_type, key), value, now, expires_at)
+            self.stats['sets'] += len(values)
+
+        if self.l2_enabled:
+            self._l2_set_many(data_type, values, data_source, now, expires_at)
+            if now - self._last_sweep >= self.sweep_interval:
+                self.sweep_expired()
+
+    def sweep_expired(self) -> int:
+        """Remove expired entries from both levels, returns number of L2 rows deleted"""
+        now = time.time()
+        self._last_sweep = now
+
+        with self._lock:
+            expired = [k for k, entry in self._entries.items() if entry[2] + self.max_staleness <= now]
+            for k in expired:
+                del self._entries[k]
+
+        deleted = 0
+        if self.l2_enabled:
+            try:
+                conn = self.db.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM market_data_cache WHERE expires_at <= ?', (now - self.max_staleness,))
+                deleted = cursor.rowcount
+                conn.commit()
+                conn.close()
+            except Exception as e:
+                print(f"[WARN] Market cache sweep failed: {e}")
+
+        with self._lock:
+            self.stats['expired_swept'] += len(expired) + deleted
+        return deleted
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['l1_size'] = len(self._entries)
+        lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['l1_hits'] + stats['l2_hits']) / lookups if lookups else 0
+        stats['max_staleness'] = self.max_staleness
+        stats['l2_enabled'] = self.l2_enabled
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_coin_ids(self):
+        """币种表变化后清空 symbol -> coin_id 映射"""
+        with self._lock:
+            self._coin_ids = {}
+
+    # ============ L1 ============
+
+    def _put_l1(self, cache_key, value, stored_at, expires_at):
+        self._entries[cache_key] = (value, stored_at, expires_at)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    # ============ L2 ============
+
+    def _check_l2_table(self) -> bool:
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='market_data_cache'")
+            exists = cursor.fetchone() is not None
+            conn.close()
+            if not exists:
+                print("[WARN] market_data_cache table not found (run database_migration.py), L2 cache disabled")
+            return exists
+        except Exception as e:
+            print(f"[WARN] Market cache L2 unavailable: {e}")
+            return False
+
+    def _coin_id(self, coin: str) -> Optional[int]:
+        """L2 记录以 coins.id 为键；不在币种表中的 key 只缓存在 L1"""
+        if self.registry is not None:
+            return self.registry.coin_id(coin)
+
+        with self._lock:
+            if coin in self._coin_ids:
+                return self._coin_ids[coin]
+
+        coin_id = None
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM coins WHERE symbol = ?', (coin,))
+            row = cursor.fetchone()
+            conn.close()
+            coin_id = row['id'] if row else None
+        except Exception:
+            pass
+
+        with self._lock:
+            self._coin_ids[coin] = coin_id
+        return coin_id
+
+    def _l2_get(self, data_type: str, key: str, expires_after: float):
+        coin_id = self._coin_id(key)
+        if coin_id is None:
+            return None
+
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT data_json, timestamp, expires_at FROM market_data_cache
+                WHERE coin_id = ? AND data_type = ? AND expires_at > ?
+                ORDER BY timestamp DESC LIMIT 1
+            ''', (coin_id, data_type, expires_after))
+            row = cursor.fetchone()
+            conn.close()
+            if row is None:
+                return None
+            return json.loads(row['data_json']), row['timestamp'], row['expires_at']
+        except Exception as e:
+            print(f"[WARN] Market cache L2 read failed: {e}")
+            return None
+
+    def _l2_set_many(self, data_type: str, values: Dict[str, Any], data_source: str, now: float,
+                     expires_at: float):
+        rows = []
+        for key, value in values.items():
+            coin_id = self._coin_id(key)
+            if coin_id is not None:
+                rows.append((coin_id, data_type, data_source, json.dumps(value), now, expires_at))
+        if not rows:
+            return
+
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            cursor.executemany('''
+                DELETE FROM market_data_cache WHERE coin_id = ? AND data_type = ?
+            ''', [row[:2] for row in rows])
+            cursor.executemany('''
+                INSERT INTO market_data_cache (coin_id, data_type, data_source, data_json, timestamp, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"[WARN] Market cache L2 write failed: {e}")
@@ -1,137 +1,232 @@
 """
 Market data module - Binance API integration
 """
-import requests
+import os
+import threading
 import time
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from candle_store import TIMEFRAME_MS
+from market_cache import MarketDataCache
+from singleflight import SingleFlight
+from http_client import http_get
+from symbol_registry import SymbolRegistry
+from price_aggregator import HedgedPriceAggregator
+from metrics import MARKET_DATA_SECONDS, MARKET_DATA_HTTP_SECONDS, MARKET_DATA_HTTP_REQUESTS, timed
 
 class MarketDataFetcher:
     """Fetch real-time market data from Binance API"""
     
-    def __init__(self):
-        self.binance_base_url = "https://api.binance.com/api/v3"
-        self.coingecko_base_url = "https://api.coingecko.com/api/v3"
+    def __init__(self, candle_store=None, cache: MarketDataCache = None, registry: SymbolRegistry = None,
+                 binance_base_url: str = None, coingecko_base_url: str = None,
+                 recorder=None, replay=None):
+        # Base URLs can point at a local stand-in (market_stub_server.py) for load tests
+        self.binance_base_url = (binance_base_url or os.getenv('MARKET_BINANCE_BASE_URL')
+                                 or "https://api.binance.com/api/v3")
+        self.coingecko_base_url = (coingecko_base_url or os.getenv('MARKET_COINGECKO_BASE_URL')
+                                   or "https://api.coingecko.com/api/v3")
         
-        # Binance symbol mapping
-        self.binance_symbols = {
-            'BTC': 'BTCUSDT',
-            'ETH': 'ETHUSDT',
-            'SOL': 'SOLUSDT',
-            'BNB': 'BNBUSDT',
-            'XRP': 'XRPUSDT',
-            'DOGE': 'DOGEUSDT'
-        }
-        
-        # CoinGecko mapping for technical indicators
-        self.coingecko_mapping = {
-            'BTC': 'bitcoin',
-            'ETH': 'ethereum',
-            'SOL': 'solana',
-            'BNB': 'binancecoin',
-            'XRP': 'ripple',
-            'DOGE': 'dogecoin'
-        }
+        # Coin symbol mappings (coins table, with forward and reverse lookups)
+        self.registry = registry or SymbolRegistry()
         
-        self._cache = {}
-        self._cache_time = {}
-        self._cache_duration = 5  # Cache for 5 seconds
+        # Two-level TTL cache (in-process LRU + market_data_cache table when a db is attached)
+        self.cache = cache or MarketDataCache()
+
+        # Concurrent callers asking for the same resource share one in-flight request
+        self.inflight = SingleFlight()
+
+        # Local OHLCV store (optional): history is persisted and only the missing head/tail is re-fetched
+        self.candle_store = candle_store
+        # (coin, timeframe) -> open time of the oldest bar the exchange has (listed inside the window)
+        self._history_start = {}
+
+        # Coins with a background revalidation in progress (get_cached_prices)
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
+
+        # Record every response to a log, or serve responses from a recorded log instead of the APIs
+        self.recorder = recorder
+        self.replay = replay
+        self.clock = replay.now if replay is not None else time.time
+
+        # Price sources in priority order; a slow primary is hedged to the next source
+        self.price_aggregator = HedgedPriceAggregator([
+            ('binance', self._get_prices_from_binance),
+            ('coingecko', self._get_prices_from_coingecko),
+        ])
     
-    def get_current_prices(self, coins: List[str]) -> Dict[str, float]:
-        """Get current prices from Binance API"""
-        # Check cache
-        cache_key = 'prices_' + '_'.join(sorted(coins))
-        if cache_key in self._cache:
-            if time.time() - self._cache_time[cache_key] < self._cache_duration:
-                return self._cache[cache_key]
-        
-        prices = {}
-        
+    def _get_json(self, url: str, params: Dict = None, timeout=None):
+        """GET a JSON document; every market data request goes through here (raises on failure)"""
+        if self.replay is not None:
+            return self.replay.lookup(url, params)
+
+        host = urlsplit(url).hostname or ''
         try:
-            # Batch fetch Binance 24h ticker data
-            symbols = [self.binance_symbols.get(coin) for coin in coins if coin in self.binance_symbols]
-            
-            if symbols:
-                # Build symbols parameter
-                symbols_param = '[' + ','.join([f'"{s}"' for s in symbols]) + ']'
-                
-                response = requests.get(
-                    f"{self.binance_base_url}/ticker/24hr",
-                    params={'symbols': symbols_param},
-                    timeout=5
-                )
+            with MARKET_DATA_HTTP_SECONDS.time(host=host):
+                response = http_get(url, params=params, timeout=timeout)
                 response.raise_for_status()
                 data = response.json()
-                
-                # Parse data
-                for item in data:
-                    symbol = item['symbol']
-                    # Find corresponding coin
-                    for coin, binance_symbol in self.binance_symbols.items():
-                        if binance_symbol == symbol:
-                            prices[coin] = {
-                                'price': float(item['lastPrice']),
-                                'change_24h': float(item['priceChangePercent'])
-                            }
-                            break
-            
-            # Update cache
-            self._cache[cache_key] = prices
-            self._cache_time[cache_key] = time.time()
-            
-            return prices
-            
-        except Exception as e:
-            print(f"[ERROR] Binance API failed: {e}")
-            # Fallback to CoinGecko
-            return self._get_prices_from_coingecko(coins)
-    
-    def _get_prices_from_coingecko(self, coins: List[str]) -> Dict[str, float]:
-        """Fallback: Fetch prices from CoinGecko"""
-        try:
-            coin_ids = [self.coingecko_mapping.get(coin, coin.lower()) for coin in coins]
+        except Exception:
+            MARKET_DATA_HTTP_REQUESTS.inc(host=host, outcome='error')
+            raise
+        MARKET_DATA_HTTP_REQUESTS.inc(host=host, outcome='ok')
+
+        if self.recorder is not None:
+            self.recorder.record(url, params, data)
+        return data
+
+    @timed(MARKET_DATA_SECONDS, method='get_current_prices')
+    def get_current_prices(self, coins: List[str]) -> Dict[str, float]:
+        """Get current prices from Binance API
+
+        Each coin's ticker is cached individually, so overlapping coin pools
+        share entries; only the stale coins of a request are fetched, in one
+        batched /ticker/24hr call (hedged to CoinGecko when Binance is slow).
+        """
+        prices = {}
+        stale = []
+        for coin in coins:
+            cached = self.cache.get('ticker', coin)
+            if cached is not None:
+                prices[coin] = cached
+            else:
+                stale.append(coin)
+
+        if stale:
+            prices.update(self.inflight.do_many('ticker', stale, self._fetch_prices))
+
+        return prices
+
+    def get_cached_prices(self, coins: List[str]) -> Dict[str, float]:
+        """Get prices without blocking on the network (stale-while-revalidate)
+
+        Returns fresh or slightly stale cached tickers (up to the cache's
+        max_staleness); expired or missing coins are revalidated in a
+        background thread and are absent from the result until then.
+        """
+        prices = {}
+        revalidate = []
+        for coin in coins:
+            cached = self.cache.get_stale('ticker', coin)
+            if cached is None:
+                revalidate.append(coin)
+                continue
+            prices[coin], fresh = cached
+            if not fresh:
+                revalidate.append(coin)
+
+        if revalidate:
+            self._revalidate_async(revalidate)
+
+        return prices
+
+    @timed(MARKET_DATA_SECONDS, method='refresh_prices')
+    def refresh_prices(self, coins: List[str]) -> Dict[str, float]:
+        """Fetch tickers for `coins` regardless of cache state (used by background refresh)"""
+        return self.inflight.do_many('ticker', coins, self._fetch_prices)
+
+    def _revalidate_async(self, coins: List[str]):
+        with self._revalidating_lock:
+            coins = [coin for coin in coins if coin not in self._revalidating]
+            self._revalidating.update(coins)
+        if not coins:
+            return
+
+        def run():
+            try:
+                self.refresh_prices(coins)
+            except Exception as e:
+                print(f"[WARN] Background price refresh failed: {e}")
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.difference_update(coins)
+
+        threading.Thread(target=run, daemon=True, name='price-revalidate').start()
+
+    def _fetch_prices(self, coins: List[str]) -> Dict[str, float]:
+        """Fetch tickers for `coins` (Binance, hedged to CoinGecko) and cache each coin"""
+        source, prices = self.price_aggregator.fetch(coins)
+
+        if not prices:
+            print(f"[ERROR] All price sources failed for {coins}")
+            return {coin: {'price': 0, 'change_24h': 0} for coin in coins}
+
+        # Update cache (one L2 transaction for the whole batch)
+        self.cache.set_many('ticker', prices, data_source=source)
+
+        return prices
+
+    def _get_prices_from_binance(self, coins: List[str]) -> Dict[str, float]:
+        """Batch fetch Binance 24h ticker data (raises on failure)"""
+        prices = {}
+        symbols = [self.registry.binance_symbol(coin) for coin in coins if self.registry.binance_symbol(coin)]
+        
+        if symbols:
+            # Build symbols parameter
+            symbols_param = '[' + ','.join([f'"{s}"' for s in symbols]) + ']'
             
-            response = requests.get(
-                f"{self.coingecko_base_url}/simple/price",
-                params={
-                    'ids': ','.join(coin_ids),
-                    'vs_currencies': 'usd',
-                    'include_24hr_change': 'true'
-                },
-                timeout=10
+            data = self._get_json(
+                f"{self.binance_base_url}/ticker/24hr",
+                params={'symbols': symbols_param},
+                timeout=5
             )
-            response.raise_for_status()
-            data = response.json()
             
-            prices = {}
-            for coin in coins:
-                coin_id = self.coingecko_mapping.get(coin, coin.lower())
-                if coin_id in data:
+            # Parse data
+            for item in data:
+                coin = self.registry.coin_for_binance(item['symbol'])
+                if coin:
                     prices[coin] = {
-                        'price': data[coin_id]['usd'],
-                        'change_24h': data[coin_id].get('usd_24h_change', 0)
+                        'price': float(item['lastPrice']),
+                        'change_24h': float(item['priceChangePercent'])
                     }
-            
-            return prices
-        except Exception as e:
-            print(f"[ERROR] CoinGecko fallback also failed: {e}")
-            return {coin: {'price': 0, 'change_24h': 0} for coin in coins}
+        
+        return prices
+    
+    def _get_prices_from_coingecko(self, coins: List[str]) -> Dict[str, float]:
+        """Fetch prices from CoinGecko (raises on failure)"""
+        coin_ids = [self.registry.coingecko_id(coin) for coin in coins]
+        
+        data = self._get_json(
+            f"{self.coingecko_base_url}/simple/price",
+            params={
+                'ids': ','.join(coin_ids),
+                'vs_currencies': 'usd',
+                'include_24hr_change': 'true'
+            }
+        )
+        
+        prices = {}
+        for coin in coins:
+            coin_id = self.registry.coingecko_id(coin)
+            if coin_id in data:
+                prices[coin] = {
+                    'price': data[coin_id]['usd'],
+                    'change_24h': data[coin_id].get('usd_24h_change', 0)
+                }
+        
+        return prices
     
+    @timed(MARKET_DATA_SECONDS, method='get_market_data')
     def get_market_data(self, coin: str) -> Dict:
         """Get detailed market data from CoinGecko"""
-        coin_id = self.coingecko_mapping.get(coin, coin.lower())
+        cached = self.cache.get('coin_detail', coin)
+        if cached is not None:
+            return cached
+
+        return self.inflight.do('coin_detail', coin, lambda: self._fetch_market_data(coin))
+
+    def _fetch_market_data(self, coin: str) -> Dict:
+        coin_id = self.registry.coingecko_id(coin)
         
         try:
-            response = requests.get(
+            data = self._get_json(
                 f"{self.coingecko_base_url}/coins/{coin_id}",
-                params={'localization': 'false', 'tickers': 'false', 'community_data': 'false'},
-                timeout=10
+                params={'localization': 'false', 'tickers': 'false', 'community_data': 'false'}
             )
-            response.raise_for_status()
-            data = response.json()
             
             market_data = data.get('market_data', {})
             
-            return {
+            result = {
                 'current_price': market_data.get('current_price', {}).get('usd', 0),
                 'market_cap': market_data.get('market_cap', {}).get('usd', 0),
                 'total_volume': market_data.get('total_volume', {}).get('usd', 0),
@@ -140,22 +235,53 @@ class MarketDataFetcher:
                 'high_24h': market_data.get('high_24h', {}).get('usd', 0),
                 'low_24h': market_data.get('low_24h', {}).get('usd', 0),
             }
+            self.cache.set('coin_detail', coin, result, data_source='coingecko')
+            return result
         except Exception as e:
             print(f"[ERROR] Failed to get market data for {coin}: {e}")
             return {}
     
+    @timed(MARKET_DATA_SECONDS, method='get_historical_prices')
     def get_historical_prices(self, coin: str, days: int = 7) -> List[Dict]:
+        """Get historical prices (hourly closes from the candle store, or CoinGecko)"""
+        if self.candle_store:
+            candles = self.get_candles(coin, '1h', days=days)
+            if candles:
+                return [{'timestamp': c['timestamp'], 'price': c['close']} for c in candles]
+
+        return self._get_historical_prices_from_coingecko(coin, days)
+
+    @timed(MARKET_DATA_SECONDS, method='refresh_indicator_inputs')
+    def refresh_indicator_inputs(self, coin: str, days: int = 14):
+        """Re-download the history behind calculate_technical_indicators (background refresh)"""
+        if self.candle_store:
+            window_start = int(self.clock() * 1000) - days * 24 * 60 * 60 * 1000
+            self.inflight.do('klines', (coin, '1h'),
+                             lambda: self._backfill_candles(coin, '1h', window_start))
+            return
+
+        data_type = f'market_chart:{days}'
+        self.inflight.do('market_chart', (coin, days),
+                         lambda: self._fetch_market_chart(coin, days, data_type))
+
+    def _get_historical_prices_from_coingecko(self, coin: str, days: int) -> List[Dict]:
         """Get historical prices from CoinGecko"""
-        coin_id = self.coingecko_mapping.get(coin, coin.lower())
+        data_type = f'market_chart:{days}'
+        cached = self.cache.get(data_type, coin)
+        if cached is not None:
+            return cached
+
+        return self.inflight.do('market_chart', (coin, days),
+                                lambda: self._fetch_market_chart(coin, days, data_type))
+
+    def _fetch_market_chart(self, coin: str, days: int, data_type: str) -> List[Dict]:
+        coin_id = self.registry.coingecko_id(coin)
         
         try:
-            response = requests.get(
+            data = self._get_json(
                 f"{self.coingecko_base_url}/coins/{coin_id}/market_chart",
-                params={'vs_currency': 'usd', 'days': days},
-                timeout=10
+                params={'vs_currency': 'usd', 'days': days}
             )
-            response.raise_for_status()
-            data = response.json()
             
             prices = []
             for price_data in data.get('prices', []):
@@ -164,15 +290,113 @@ class MarketDataFetcher:
                     'price': price_data[1]
                 })
             
+            if prices:
+                self.cache.set(data_type, coin, prices, data_source='coingecko')
             return prices
         except Exception as e:
             print(f"[ERROR] Failed to get historical prices for {coin}: {e}")
             return []
+
+    @timed(MARKET_DATA_SECONDS, method='get_candles')
+    def get_candles(self, coin: str, timeframe: str = '1h', days: int = 14) -> List[Dict]:
+        """Get OHLCV candles covering the last `days` days
+
+        With a candle store only the missing bars are downloaded: those after
+        the newest stored one (the newest bar itself is re-fetched since it may
+        have been partial) and, when the window reaches further back than the
+        stored history, those before the oldest one; without a store the whole
+        window is fetched from Binance.
+        """
+        now_ms = int(self.clock() * 1000)
+        window_start = now_ms - days * 24 * 60 * 60 * 1000
+
+        if not self.candle_store:
+            return self.inflight.do('klines', (coin, timeframe, window_start),
+                                    lambda: self._fetch_klines(coin, timeframe, window_start))
+
+        self.inflight.do('klines', (coin, timeframe),
+                         lambda: self._backfill_candles(coin, timeframe, window_start))
+
+        return self.candle_store.get_candles(coin, timeframe, since=window_start)
+
+    def _backfill_candles(self, coin: str, timeframe: str, window_start: int):
+        """Download the bars of the window missing from the candle store"""
+        for start, end in self._backfill_ranges(coin, timeframe, window_start):
+            bars = self._fetch_klines(coin, timeframe, start, end)
+            self._record_backfill(coin, timeframe, window_start, start, bars)
+
+    def _backfill_ranges(self, coin: str, timeframe: str, window_start: int) -> List[Tuple[int, Optional[int]]]:
+        """(start, end) ranges to download: the head before the oldest stored bar and the tail from the newest
+
+        end=None means up to now. The head is skipped once the exchange is known to
+        have nothing older (coin listed inside the window).
+        """
+        first_ts, last_ts = self.candle_store.get_time_range(coin, timeframe)
+        if last_ts is None or last_ts < window_start:
+            return [(window_start, None)]
+
+        ranges = []
+        listed_at = self._history_start.get((coin, timeframe))
+        if first_ts - window_start >= TIMEFRAME_MS[timeframe] and (listed_at is None or first_ts > listed_at):
+            # endTime 包含最早的已存K线：成功的响应至少有一根，空响应表示请求失败
+            ranges.append((window_start, first_ts))
+        ranges.append((last_ts, None))
+        return ranges
+
+    def _record_backfill(self, coin: str, timeframe: str, window_start: int, start: int, bars: List[Dict]):
+        """Store downloaded bars; a window fetch answered with later bars means the exchange has nothing older"""
+        self.candle_store.upsert_candles(coin, timeframe, bars)
+        if start == window_start and bars and bars[0]['timestamp'] - window_start >= TIMEFRAME_MS[timeframe]:
+            self._history_start[(coin, timeframe)] = bars[0]['timestamp']
+
+    def _fetch_klines(self, coin: str, timeframe: str, start_ms: int, end_ms: Optional[int] = None) -> List[Dict]:
+        """Fetch klines from Binance between `start_ms` and `end_ms` (None: now), paging through the 1000-bar limit"""
+        symbol = self.registry.binance_symbol(coin)
+        if not symbol:
+            return []
+
+        params = {'symbol': symbol, 'interval': timeframe, 'limit': 1000}
+        if end_ms is not None:
+            params['endTime'] = end_ms
+        bars = []
+        try:
+            while True:
+                data = self._get_json(
+                    f"{self.binance_base_url}/klines",
+                    params=dict(params, startTime=start_ms)
+                )
+
+                for k in data:
+                    bars.append({
+                        'timestamp': int(k[0]),
+                        'open': float(k[1]),
+                        'high': float(k[2]),
+                        'low': float(k[3]),
+                        'close': float(k[4]),
+                        'volume': float(k[5])
+                    })
+
+                if len(data) < 1000:
+                    break
+                start_ms = int(data[-1][0]) + TIMEFRAME_MS[timeframe]
+
+            return bars
+        except Exception as e:
+            print(f"[ERROR] Failed to get klines for {coin}: {e}")
+            return bars
     
+    @timed(MARKET_DATA_SECONDS, method='calculate_technical_indicators')
     def calculate_technical_indicators(self, coin: str) -> Dict:
         """Calculate technical indicators"""
-        historical = self.get_historical_prices(coin, days=14)
-        
+        return self._indicators_from_history(self.get_historical_prices(coin, days=14))
+
+    @timed(MARKET_DATA_SECONDS, method='calculate_technical_indicators_bulk')
+    def calculate_technical_indicators_bulk(self, coins: List[str]) -> Dict[str, Dict]:
+        """Calculate technical indicators for several coins ({coin: indicators})"""
+        return {coin: self.calculate_technical_indicators(coin) for coin in coins}
+
+    @staticmethod
+    def _indicators_from_history(historical: List[Dict]) -> Dict:
         if not historical or len(historical) < 14:
             return {}
         
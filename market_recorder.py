@@ -0,0 +1,201 @@
+"""
+Market data record & replay - deterministic offline runs
+行情录制与回放 - 录制模式把 MarketDataFetcher 收到的每个响应追加写入 gzip 压缩的
+JSON Lines 日志（带时间戳）；回放模式按真实或加速的时间从日志返回响应，不访问外部 API
+
+日志格式（每行一条）: {"t": 抓取时间, "url": ..., "params": {...}, "data": 响应 JSON}
+"""
+import bisect
+import gzip
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+# 不参与回放匹配的请求参数（随抓取时间变化），回放时用于过滤响应
+VOLATILE_PARAMS = ('startTime',)
+
+
+def _request_key(url: str, params: Optional[Dict]) -> str:
+    """URL 路径 + 排序后的稳定参数（忽略主机，录制和回放可使用不同的 base URL）"""
+    stable = {k: str(v) for k, v in (params or {}).items() if k not in VOLATILE_PARAMS}
+    return urlsplit(url).path + '?' + json.dumps(stable, sort_keys=True)
+
+
+class ReplayMiss(LookupError):
+    """日志中没有该请求的录制"""
+
+
+class MarketRecorder:
+    """Append-only gzip JSON Lines log of market data responses"""
+
+    def __init__(self, path: str = 'market_data_log.jsonl.gz'):
+        self.path = path
+        self._lock = threading.Lock()
+        # 追加模式：每次启动写入一个新的 gzip member，整个文件仍可顺序读取
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self.records = 0
+
+    def record(self, url: str, params: Optional[Dict], data: Any):
+        line = json.dumps({'t': time.time(), 'url': url, 'params': params or {}, 'data': data},
+                          separators=(',', ':'))
+        with self._lock:
+            if self._file.closed:
+                return  # 退出时 close 之后仍在进行的抓取
+            self._file.write(line + '\n')
+            self._file.flush()  # Z_SYNC_FLUSH：进程异常退出时已写入的记录仍可读取
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplayClock:
+    """Replay time: starts at the first recorded timestamp and advances `speed` times faster than wall time"""
+
+    def __init__(self, start: float, speed: float = 1.0):
+        self.start = start
+        self.speed = speed
+        self._wall_start = time.monotonic()
+
+    def now(self) -> float:
+        return self.start + (time.monotonic() - self._wall_start) * self.speed
+
+
+class MarketReplay:
+    """
+    从录制日志回放行情
+
+    每个请求返回回放时钟当前时刻之前最近的一次录制；批量行情接口
+    （Binance /ticker/24hr 和 CoinGecko /simple/price）按单个币种建立索引，
+    因此回放时的批次组合不必与录制时一致。
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, start: Optional[float] = None):
+        """
+        Args:
+            path: 录制日志路径
+            speed: 回放速度倍数（1 为真实速度，60 表示 1 分钟回放 1 小时）
+            start: 回放起始时间（epoch 秒），默认为日志中的第一条记录
+        """
+        self.path = path
+        self._responses: Dict[str, Tuple[List[float], List[Any]]] = {}
+        self._tickers: Dict[str, Tuple[List[float], List[Dict]]] = {}  # Binance symbol -> ticker
+        self._simple_prices: Dict[str, Tuple[List[float], List[Dict]]] = {}  # CoinGecko id -> price
+
+        first, last, count = self._load(path)
+        self.first_timestamp = first
+        self.last_timestamp = last
+        self.records = count
+        self.clock = ReplayClock(start if start is not None else first, speed)
+
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def _load(self, path: str):
+        first = last = None
+        count = 0
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # 录制中断时最后一行可能不完整
+                    t = entry['t']
+                    first = t if first is None else min(first, t)
+                    last = t if last is None else max(last, t)
+                    count += 1
+                    self._index(entry)
+            except EOFError:
+                # 录制进程未调用 close（被杀死或仍在写入）：没有 gzip 结尾，保留已读取的记录
+                print(f"[WARN] Market data log {path} has no gzip trailer, loaded {count} records")
+
+        if count == 0:
+            raise ValueError(f"Market data log {path} is empty")
+
+        for index in (self._responses, self._tickers, self._simple_prices):
+            for times, values in index.values():
+                order = sorted(range(len(times)), key=times.__getitem__)
+                times[:] = [times[i] for i in order]
+                values[:] = [values[i] for i in order]
+        return first, last, count
+
+    @staticmethod
+    def _append(index: Dict, key: str, t: float, value: Any):
+        times, values = index.setdefault(key, ([], []))
+        times.append(t)
+        values.append(value)
+
+    def _index(self, entry: Dict):
+        t, url, data = entry['t'], entry['url'], entry['data']
+        path = urlsplit(url).path
+        if path.endswith('/ticker/24hr') and isinstance(data, list):
+            for item in data:
+                self._append(self._tickers, item['symbol'], t, item)
+        elif path.endswith('/simple/price') and isinstance(data, dict):
+            for coin_id, price in data.items():
+                self._append(self._simple_prices, coin_id, t, price)
+        else:
+            self._append(self._responses, _request_key(url, entry['params']), t, data)
+
+    def now(self) -> float:
+        return self.clock.now()
+
+    @property
+    def finished(self) -> bool:
+        return self.now() > self.last_timestamp
+
+    def _at(self, index: Dict, key: str, now: float):
+        """最近一次 t <= now 的录制；回放开始前只有更晚的录制时返回最早的一条"""
+        entry = index.get(key)
+        if entry is None:
+            return None
+        times, values = entry
+        i = bisect.bisect_right(times, now)
+        return values[i - 1] if i else values[0]
+
+    def lookup(self, url: str, params: Optional[Dict] = None) -> Any:
+        """Return the recorded response for a request (same shape as the live API)"""
+        now = self.now()
+        params = params or {}
+        path = urlsplit(url).path
+
+        if path.endswith('/ticker/24hr') and 'symbols' in params:
+            symbols = json.loads(params['symbols'])
+            data = [item for item in (self._at(self._tickers, s, now) for s in symbols) if item is not None]
+            missing = not data
+        elif path.endswith('/simple/price') and 'ids' in params:
+            data = {}
+            for coin_id in params['ids'].split(','):
+                price = self._at(self._simple_prices, coin_id, now)
+                if price is not None:
+                    data[coin_id] = price
+            missing = not data
+        else:
+            data = self._at(self._responses, _request_key(url, params), now)
+            missing = data is None
+            if not missing and 'startTime' in params and isinstance(data, list):
+                # K线: 只返回请求起始时间之后的部分
+                start = int(params['startTime'])
+                data = [k for k in data if int(k[0]) >= start]
+
+        if missing:
+            self.stats['misses'] += 1
+            raise ReplayMiss(f"No recorded response for {path} {params}")
+
+        self.stats['hits'] += 1
+        return data
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats.update({
+            'records': self.records,
+            'replay_time': self.now(),
+            'first_timestamp': self.first_timestamp,
+            'last_timestamp': self.last_timestamp,
+            'finished': self.finished,
+        })
+        return stats
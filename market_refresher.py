@@ -0,0 +1,124 @@
+"""
+Market refresher - keep hot market data warm in the background
+行情后台刷新 - 定期刷新所有模型币种池中币种的价格和技术指标输入，
+前台接口通过 MarketDataFetcher.get_cached_prices() 直接读取缓存，不再等待网络请求
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class MarketRefresher:
+    """Background threads refreshing tickers and indicator history for pooled coins
+
+    Prices and indicator inputs run on separate threads so a slow history
+    download never delays the next ticker refresh.
+    """
+
+    def __init__(self, market_fetcher, db=None, price_interval: Optional[float] = None,
+                 indicator_interval: float = 60, extra_coins: Optional[List[str]] = None):
+        """
+        Args:
+            market_fetcher: MarketDataFetcher 实例
+            db: Database 实例，用于读取 model_coin_pools；为 None 时只刷新 extra_coins
+            price_interval: 价格刷新间隔（秒），默认在 ticker 缓存过期前刷新
+            indicator_interval: 技术指标输入（K线/历史价格）刷新间隔（秒）
+            extra_coins: 额外需要保持最新的币种（如首页展示的币种）
+        """
+        self.market_fetcher = market_fetcher
+        self.db = db
+        if price_interval is None:
+            price_interval = max(1.0, market_fetcher.cache.ttl_for('ticker') * 0.8)
+        self.price_interval = price_interval
+        self.indicator_interval = indicator_interval
+        self.extra_coins = list(extra_coins or [])
+
+        self._stop = threading.Event()
+        self._threads = []
+
+        self.stats = {
+            'price_refreshes': 0,
+            'indicator_refreshes': 0,
+            'failures': 0,
+            'last_price_refresh': None,
+            'coins': 0,
+        }
+
+    def start(self):
+        if any(t.is_alive() for t in self._threads):
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, args=(self.refresh_prices, self.price_interval),
+                             daemon=True, name='market-refresher-prices'),
+            threading.Thread(target=self._run, args=(self.refresh_indicators, self.indicator_interval),
+                             daemon=True, name='market-refresher-indicators'),
+        ]
+        for thread in self._threads:
+            thread.start()
+        print(f"[INFO] Market refresher started (prices every {self.price_interval:.1f}s, "
+              f"indicators every {self.indicator_interval:.0f}s)")
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def hot_coins(self) -> List[str]:
+        """所有模型币种池中启用的币种（去重）加上 extra_coins"""
+        coins = []
+        if self.db is not None:
+            try:
+                conn = self.db.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT DISTINCT c.symbol
+                    FROM model_coin_pools mcp
+                    JOIN coins c ON c.id = mcp.coin_id
+                    WHERE mcp.is_enabled = 1 AND c.is_active = 1
+                ''')
+                coins = [row['symbol'] for row in cursor.fetchall()]
+                conn.close()
+            except Exception as e:
+                print(f"[WARN] Market refresher could not load coin pools: {e}")
+
+        for coin in self.extra_coins:
+            if coin not in coins:
+                coins.append(coin)
+        return coins
+
+    def refresh_prices(self):
+        coins = self.hot_coins()
+        self.stats['coins'] = len(coins)
+        if not coins:
+            return
+
+        try:
+            self.market_fetcher.refresh_prices(coins)
+            self.stats['price_refreshes'] += 1
+            self.stats['last_price_refresh'] = time.time()
+        except Exception as e:
+            self.stats['failures'] += 1
+            print(f"[WARN] Market refresher price update failed: {e}")
+
+    def refresh_indicators(self):
+        for coin in self.hot_coins():
+            if self._stop.is_set():
+                return
+            try:
+                self.market_fetcher.refresh_indicator_inputs(coin)
+            except Exception as e:
+                self.stats['failures'] += 1
+                print(f"[WARN] Market refresher indicator update failed for {coin}: {e}")
+        self.stats['indicator_refreshes'] += 1
+
+    def _run(self, refresh, interval: float):
+        while not self._stop.is_set():
+            started = time.time()
+            refresh()
+            self._stop.wait(max(0.0, interval - (time.time() - started)))
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['running'] = any(t.is_alive() for t in self._threads)
+        return stats
@@ -0,0 +1,181 @@
+"""
+Market snapshot broker - share one market snapshot per trading tick
+行情快照代理 - 同一个交易时间窗口内只抓取一次行情，供所有 TradingEngine 共享
+"""
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
+
+from singleflight import SingleFlight
+
+
+def _freeze(value):
+    """递归地把 dict/list 转为只读结构"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    """把只读结构还原为普通 dict/list（每个引擎拿到独立副本）"""
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class MarketSnapshot:
+    """Immutable market state (price, 24h change, indicators per coin) for one tick"""
+
+    def __init__(self, tick: int, created_at: float, coins: Dict[str, Dict]):
+        self.tick = tick
+        self.created_at = created_at
+        self._coins = MappingProxyType({coin: _freeze(data) for coin, data in coins.items()})
+
+    @property
+    def coins(self) -> MappingProxyType:
+        return self._coins
+
+    def age(self, now: Optional[float] = None) -> float:
+        return (now if now is not None else time.time()) - self.created_at
+
+    def covers(self, coins: List[str]) -> bool:
+        """快照是否已包含所有请求的币种"""
+        return all(coin in self._coins for coin in coins)
+
+    def market_state(self, coins: List[str]) -> Dict:
+        """返回 TradingEngine 使用的 market_state 格式（可自由修改的副本）"""
+        return {coin: _thaw(self._coins[coin]) for coin in coins if coin in self._coins}
+
+
+class MarketSnapshotBroker:
+    """
+    行情快照代理
+
+    第一个在本时间窗口内请求行情的引擎负责抓取价格和技术指标，
+    同一窗口内的其他引擎直接复用该快照；请求到快照中没有的币种时，
+    只补抓缺失的币种并生成新的快照（tick 不变）。
+
+    抓取在锁外进行，同时到达的请求通过 SingleFlight 合并为一次抓取；
+    时间取自 market_fetcher.clock（回放时为回放时钟）。价格抓取失败（或为 0）
+    的币种不放入快照，下一次请求时重新抓取。
+    """
+
+    def __init__(self, market_fetcher, tick_seconds: int = 60):
+        """
+        Args:
+            market_fetcher: MarketDataFetcher 实例
+            tick_seconds: 快照有效时间窗口（秒）
+        """
+        self.market_fetcher = market_fetcher
+        self.tick_seconds = tick_seconds
+        self.clock = getattr(market_fetcher, 'clock', time.time)
+
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._snapshot: Optional[MarketSnapshot] = None
+        self._tick = 0
+
+        self.stats = {'snapshots_built': 0, 'snapshots_extended': 0, 'snapshot_hits': 0, 'coins_fetched': 0,
+                      'coins_failed': 0}
+
+    def _current(self) -> Optional[MarketSnapshot]:
+        """当前 tick 的快照（调用方持有 _lock），已过期时返回 None"""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.age(self.clock()) < self.tick_seconds:
+            return snapshot
+        return None
+
+    def get_snapshot(self, coins: List[str]) -> MarketSnapshot:
+        """获取覆盖指定币种的当前 tick 快照，必要时抓取"""
+        with self._lock:
+            snapshot = self._current()
+            if snapshot is not None and snapshot.covers(coins):
+                self.stats['snapshot_hits'] += 1
+                return snapshot
+
+        attempted = ()
+        if snapshot is None:
+            # 新 tick：同时到达的请求共享一次抓取
+            snapshot, attempted = self._flight.do('snapshot', 'build', lambda: self._build(coins))
+
+        # 同一 tick 内补抓缺失币种（等待者请求的币种可能与发起抓取的请求不同）；
+        # 刚刚在这次抓取中失败的币种留给下一次请求
+        missing = [coin for coin in coins if coin not in snapshot.coins and coin not in attempted]
+        if not missing:
+            return snapshot
+        return self._extend(snapshot, missing)
+
+    def _build(self, coins: List[str]) -> Tuple[MarketSnapshot, Tuple[str, ...]]:
+        """抓取新 tick 的快照，返回 (快照, 本次抓取的币种)"""
+        with self._lock:
+            snapshot = self._current()
+            if snapshot is not None:
+                return snapshot, ()  # 另一个请求刚刚建好本 tick 的快照
+            self._tick += 1
+            tick = self._tick
+            now = self.clock()
+
+        snapshot = MarketSnapshot(tick, now, self._fetch_coins(list(coins)))
+        with self._lock:
+            self._snapshot = snapshot
+            self.stats['snapshots_built'] += 1
+        return snapshot, tuple(coins)
+
+    def _extend(self, snapshot: MarketSnapshot, missing: List[str]) -> MarketSnapshot:
+        keys = [(snapshot.tick, coin) for coin in missing]
+        fetched = self._flight.do_many('coins', keys, lambda batch: {
+            (snapshot.tick, coin): data for coin, data in self._fetch_coins([coin for _, coin in batch]).items()
+        })
+        fetched = {coin: data for (_, coin), data in fetched.items()}
+
+        with self._lock:
+            current = self._snapshot
+            if current is not None and current.tick == snapshot.tick:
+                base = current  # 合并到最新的快照（抓取期间可能已被其他请求扩展）
+            else:
+                base = snapshot  # 抓取期间快照已过期或被丢弃：结果只返回给本次请求
+            if all(coin in base.coins for coin in fetched):
+                return base
+            merged = {coin: _thaw(data) for coin, data in base.coins.items()}
+            merged.update(fetched)
+            extended = MarketSnapshot(base.tick, base.created_at, merged)
+            if base is current:
+                self._snapshot = extended
+                self.stats['snapshots_extended'] += 1
+        return extended
+
+    def get_market_state(self, coins: List[str]) -> Dict:
+        """TradingEngine._get_market_state 的共享实现"""
+        return self.get_snapshot(coins).market_state(coins)
+
+    def invalidate(self):
+        """丢弃当前快照，下一次请求会重新抓取"""
+        with self._lock:
+            self._snapshot = None
+
+    def _fetch_coins(self, coins: List[str]) -> Dict[str, Dict]:
+        if not coins:
+            return {}
+
+        market_state = {}
+        prices = self.market_fetcher.get_current_prices(coins)
+
+        # 所有数据源都失败时价格为 0，不能进入快照
+        priced = [coin for coin in coins if (prices.get(coin) or {}).get('price')]
+        indicators = self.market_fetcher.calculate_technical_indicators_bulk(priced) if priced else {}
+
+        for coin in priced:
+            market_state[coin] = dict(prices[coin])
+            market_state[coin]['indicators'] = indicators.get(coin, {})
+
+        with self._lock:
+            self.stats['coins_fetched'] += len(priced)
+            self.stats['coins_failed'] += len(coins) - len(priced)
+        if len(priced) < len(coins):
+            print(f"[WARN] No price for {sorted(set(coins) - set(priced))}, will retry on the next request")
+        return market_state
@@ -0,0 +1,366 @@
+"""
+Market stub server - local Binance/CoinGecko REST stand-in for load testing
+本地行情模拟服务器 - 实现 MarketDataFetcher 用到的 Binance / CoinGecko 接口子集，
+为任意数量的币种生成随机游走行情，并可注入延迟、错误和 429 限流
+
+用法:
+    python market_stub_server.py --port 8900 --symbols 5000 --latency 80 --jitter 40 --error-rate 0.01
+
+然后让应用指向模拟服务器:
+    MARKET_BINANCE_BASE_URL=http://127.0.0.1:8900/api/v3
+    MARKET_COINGECKO_BASE_URL=http://127.0.0.1:8900/api/v3
+
+支持的接口:
+    GET /api/v3/ticker/24hr?symbols=["BTCUSDT",...]     （不带 symbols 返回全部币种）
+    GET /api/v3/klines?symbol=BTCUSDT&interval=1h&startTime=...&endTime=...&limit=1000
+    GET /api/v3/simple/price?ids=bitcoin,...&vs_currencies=usd&include_24hr_change=true
+    GET /api/v3/coins/{id}
+    GET /api/v3/coins/{id}/market_chart?vs_currency=usd&days=7
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from candle_store import TIMEFRAME_MS
+from symbol_registry import DEFAULT_COINS
+
+
+HOUR = 3600
+HISTORY_HOURS = 24 * 90  # 随机游走起点：服务器启动前 90 天
+
+# 默认币种的大致价格量级，合成币种随机取值
+START_PRICES = {'BTC': 60000, 'ETH': 3000, 'SOL': 150, 'BNB': 550, 'XRP': 0.6, 'DOGE': 0.15}
+
+
+class RandomWalk:
+    """Deterministic hourly random walk for one symbol, interpolated (with jitter) in between"""
+
+    CHUNK_HOURS = 24 * 30
+
+    def __init__(self, name: str, anchor: float, start_price: Optional[float] = None):
+        seed = zlib.crc32(name.encode())
+        self._rng = np.random.default_rng(seed)
+        self._seed = seed
+        self.anchor = anchor
+        self.volatility = 0.004 + (seed % 100) / 10000  # 每小时 0.4% ~ 1.4%
+        if start_price is None:
+            start_price = 10 ** self._rng.uniform(-2, 4)  # 初始价格 0.01 ~ 10000
+        self._hours = np.array([start_price])
+        self._lock = threading.Lock()
+        self._extend(HISTORY_HOURS + self.CHUNK_HOURS)
+
+    def _extend(self, length: int):
+        steps = self._rng.normal(0, self.volatility, length - len(self._hours) + 1)
+        tail = self._hours[-1] * np.exp(np.cumsum(steps))
+        self._hours = np.concatenate([self._hours, tail])
+
+    def _hourly(self, index: int) -> float:
+        if index >= len(self._hours):
+            with self._lock:
+                if index >= len(self._hours):
+                    self._extend(index + self.CHUNK_HOURS)
+        return float(self._hours[max(0, index)])
+
+    def price(self, t: float) -> float:
+        offset = (t - self.anchor) / HOUR
+        index = int(math.floor(offset))
+        frac = offset - index
+        a, b = self._hourly(index), self._hourly(index + 1)
+        # 秒级确定性抖动，保证同一时刻多次请求结果一致
+        jitter = ((zlib.crc32(f"{self._seed}:{int(t)}".encode()) % 2001) - 1000) / 1000 * self.volatility * 0.1
+        return (a + (b - a) * frac) * (1 + jitter)
+
+    def bar(self, start_ms: int, interval_ms: int) -> List:
+        start, end = start_ms / 1000, min((start_ms + interval_ms) / 1000 - 1, time.time())
+        samples = [self.price(start + (end - start) * i / 8) for i in range(9)]  # 未完成的K线只取到当前时刻
+        open_, close = samples[0], samples[-1]
+        volume = (zlib.crc32(f"{self._seed}:{start_ms}".encode()) % 100000) / 10 + 1
+        return [start_ms, f"{open_:.8f}", f"{max(samples):.8f}", f"{min(samples):.8f}",
+                f"{close:.8f}", f"{volume:.4f}", start_ms + interval_ms - 1]
+
+
+class MarketUniverse:
+    """Symbol universe: the default coins plus `count` synthetic ones, walks created on demand"""
+
+    def __init__(self, count: int = 1000):
+        self.anchor = time.time() - HISTORY_HOURS * HOUR
+        self.coins: List[Tuple[str, str, str]] = [(s, b, g) for s, b, _, g in DEFAULT_COINS]
+        for i in range(max(0, count - len(self.coins))):
+            symbol = f"SYN{i:04d}"
+            self.coins.append((symbol, f"{symbol}USDT", symbol.lower()))
+        self.by_binance = {b: s for s, b, _ in self.coins}
+        self.by_coingecko = {g: s for s, _, g in self.coins}
+        self._walks: Dict[str, RandomWalk] = {}
+        self._lock = threading.Lock()
+
+    def walk(self, symbol: str) -> RandomWalk:
+        walk = self._walks.get(symbol)
+        if walk is None:
+            with self._lock:
+                walk = self._walks.get(symbol)
+                if walk is None:
+                    walk = RandomWalk(symbol, self.anchor, START_PRICES.get(symbol))
+                    self._walks[symbol] = walk
+        return walk
+
+    def resolve_binance(self, binance_symbol: str) -> Optional[str]:
+        """未知的 XXXUSDT 交易对同样生成行情，便于测试任意币种"""
+        if binance_symbol in self.by_binance:
+            return self.by_binance[binance_symbol]
+        return binance_symbol[:-4] if binance_symbol.endswith('USDT') else None
+
+    def resolve_coingecko(self, coin_id: str) -> str:
+        return self.by_coingecko.get(coin_id, coin_id.upper())
+
+    def change_24h(self, symbol: str, now: float) -> float:
+        walk = self.walk(symbol)
+        before = walk.price(now - 24 * HOUR)
+        return (walk.price(now) - before) / before * 100
+
+
+class FaultInjector:
+    """Latency, 5xx and 429 injection plus an optional request-per-second limit"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 throttle_rate: float = 0, max_rps: float = 0, retry_after: int = 1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self._window_start = time.time()
+        self._window_count = 0
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0}
+
+    def before_request(self) -> Optional[int]:
+        """Sleep for the injected latency; returns an HTTP status to fail with, or None"""
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.max_rps:
+                now = time.time()
+                if now - self._window_start >= 1:
+                    self._window_start, self._window_count = now, 0
+                self._window_count += 1
+                if self._window_count > self.max_rps:
+                    self.stats['throttled'] += 1
+                    return 429
+
+            roll = random.random()
+            if roll < self.throttle_rate:
+                self.stats['throttled'] += 1
+                return 429
+            if roll < self.throttle_rate + self.error_rate:
+                self.stats['errors'] += 1
+                return random.choice((500, 502, 503))
+        return None
+
+
+class MarketStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    universe: MarketUniverse = None
+    faults: FaultInjector = None
+    quiet = True
+
+    ROUTES = [
+        (re.compile(r'^/api/v3/ticker/24hr$'), 'ticker_24hr'),
+        (re.compile(r'^/api/v3/klines$'), 'klines'),
+        (re.compile(r'^/api/v3/simple/price$'), 'simple_price'),
+        (re.compile(r'^/api/v3/coins/([^/]+)/market_chart$'), 'market_chart'),
+        (re.compile(r'^/api/v3/coins/([^/]+)$'), 'coin_detail'),
+    ]
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, payload, headers: Optional[Dict] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+
+        for pattern, name in self.ROUTES:
+            match = pattern.match(parts.path)
+            if match:
+                break
+        else:
+            return self._send(404, {'error': f'unknown endpoint {parts.path}'})
+
+        status = self.faults.before_request()
+        if status == 429:
+            return self._send(429, {'code': -1003, 'msg': 'Too many requests'},
+                              {'Retry-After': str(self.faults.retry_after)})
+        if status:
+            return self._send(status, {'error': 'injected failure'})
+
+        try:
+            payload = getattr(self, name)(query, *match.groups())
+        except (KeyError, ValueError) as e:
+            return self._send(400, {'error': f'bad request: {e}'})
+        if payload is None:
+            return self._send(404, {'error': 'not found'})
+        self._send(200, payload)
+
+    # ============ Binance ============
+
+    def ticker_24hr(self, query: Dict):
+        now = time.time()
+        if 'symbols' in query:
+            pairs = json.loads(query['symbols'])
+        elif 'symbol' in query:
+            pairs = [query['symbol']]
+        else:
+            pairs = [b for _, b, _ in self.universe.coins]
+
+        tickers = []
+        for pair in pairs:
+            symbol = self.universe.resolve_binance(pair)
+            if symbol is None:
+                continue
+            price = self.universe.walk(symbol).price(now)
+            tickers.append({
+                'symbol': pair,
+                'lastPrice': f"{price:.8f}",
+                'priceChangePercent': f"{self.universe.change_24h(symbol, now):.3f}",
+                'closeTime': int(now * 1000),
+            })
+        return tickers
+
+    def klines(self, query: Dict):
+        symbol = self.universe.resolve_binance(query['symbol'])
+        if symbol is None:
+            return None
+        interval_ms = TIMEFRAME_MS[query.get('interval', '1h')]
+        limit = min(int(query.get('limit', 500)), 1000)
+        now_ms = int(time.time() * 1000)
+        earliest = int(self.universe.anchor * 1000)
+
+        start = int(query.get('startTime', now_ms - limit * interval_ms))
+        start = max(start - start % interval_ms, earliest - earliest % interval_ms + interval_ms)
+        end = min(int(query.get('endTime', now_ms)), now_ms)
+        walk = self.universe.walk(symbol)
+        bars = []
+        t = start
+        while t <= end and len(bars) < limit:
+            bars.append(walk.bar(t, interval_ms))
+            t += interval_ms
+        return bars
+
+    # ============ CoinGecko ============
+
+    def simple_price(self, query: Dict):
+        now = time.time()
+        result = {}
+        for coin_id in query['ids'].split(','):
+            symbol = self.universe.resolve_coingecko(coin_id)
+            entry = {'usd': self.universe.walk(symbol).price(now)}
+            if query.get('include_24hr_change') == 'true':
+                entry['usd_24h_change'] = self.universe.change_24h(symbol, now)
+            result[coin_id] = entry
+        return result
+
+    def coin_detail(self, query: Dict, coin_id: str):
+        now = time.time()
+        symbol = self.universe.resolve_coingecko(coin_id)
+        walk = self.universe.walk(symbol)
+        price = walk.price(now)
+        day = [walk.price(now - i * HOUR) for i in range(25)]
+        return {
+            'id': coin_id,
+            'symbol': symbol.lower(),
+            'market_data': {
+                'current_price': {'usd': price},
+                'market_cap': {'usd': price * 1e7},
+                'total_volume': {'usd': price * 1e5},
+                'price_change_percentage_24h': self.universe.change_24h(symbol, now),
+                'price_change_percentage_7d': (price - walk.price(now - 7 * 24 * HOUR)) / walk.price(now - 7 * 24 * HOUR) * 100,
+                'high_24h': {'usd': max(day)},
+                'low_24h': {'usd': min(day)},
+            },
+        }
+
+    def market_chart(self, query: Dict, coin_id: str):
+        now = time.time()
+        days = min(float(query.get('days', 1)), HISTORY_HOURS / 24)
+        walk = self.universe.walk(self.universe.resolve_coingecko(coin_id))
+        # CoinGecko: 1 天内 5 分钟粒度，90 天内按小时
+        step = 300 if days <= 1 else HOUR
+        start = now - days * 24 * HOUR
+        points = int((now - start) // step)
+        return {'prices': [[int((start + i * step) * 1000), walk.price(start + i * step)] for i in range(points + 1)]}
+
+
+def create_server(host: str = '127.0.0.1', port: int = 8900, symbols: int = 1000,
+                  faults: Optional[FaultInjector] = None, quiet: bool = True) -> ThreadingHTTPServer:
+    """创建模拟服务器（port=0 时随机端口，便于在测试中启动）"""
+    handler = type('BoundMarketStubHandler', (MarketStubHandler,), {
+        'universe': MarketUniverse(symbols),
+        'faults': faults or FaultInjector(),
+        'quiet': quiet,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(**kwargs) -> Tuple[ThreadingHTTPServer, str]:
+    """在后台线程启动模拟服务器，返回 (server, base_url)"""
+    server = create_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True, name='market-stub').start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/api/v3"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Binance/CoinGecko stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--symbols', type=int, default=1000, help='number of symbols in the universe')
+    parser.add_argument('--latency', type=float, default=0, help='mean latency in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='latency jitter in ms (uniform +/-)')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests failing with 5xx')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='fraction of requests failing with 429')
+    parser.add_argument('--max-rps', type=float, default=0, help='answer 429 above this many requests per second')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    faults = FaultInjector(args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                           args.max_rps, args.retry_after)
+    server = create_server(args.host, args.port, args.symbols, faults, quiet=not args.verbose)
+    print(f"[INFO] Market stub server on http://{args.host}:{args.port}/api/v3 ({args.symbols} symbols)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[INFO] Served {faults.stats}")
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Metrics - in-process counters and latency histograms
+运行指标 - 进程内的计数器、仪表和耗时直方图，由 /api/metrics 以 Prometheus 文本格式输出
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+
+# 覆盖数据库查询（毫秒级）到 LLM 调用（数十秒）的耗时桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                                 for key, value in values]
+
+
+class Gauge(_Metric):
+    """Point-in-time value per label set"""
+
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                                 for key, value in values]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket latency histogram per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series: Dict[Tuple, list] = {}  # key -> [每个桶的计数..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计 with 块的耗时（异常退出时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels) -> Tuple[int, float]:
+        """(count, sum)"""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return (series[-1], series[-2]) if series else (0, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = self._header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(values[-2])}')
+            lines.append(f'{self.name}_count{labels} {values[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    """All metrics of the process, rendered together"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, cls, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Prometheus 文本格式（text/plain; version=0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram: Histogram, **labels):
+    """装饰器：统计函数耗时"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def counted_errors(counter: Counter, **labels):
+    """装饰器：函数抛出的异常按类型计数（标签 error=异常类名）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                counter.inc(error=type(e).__name__, **labels)
+                raise
+        return wrapper
+    return decorator
+
+
+def instrument_methods(histogram: Histogram, exclude: Sequence[str] = (), errors: Counter = None):
+    """类装饰器：统计类中每个公开方法的耗时（标签 method=方法名），指定 errors 时同时按异常类型计数"""
+    def decorator(cls):
+        for name, attr in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not callable(attr):
+                continue
+            method = timed(histogram, method=name)(attr)
+            if errors is not None:
+                method = counted_errors(errors, method=name)(method)
+            setattr(cls, name, method)
+        return cls
+    return decorator
+
+
+REGISTRY = MetricsRegistry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# ============ Trading cycle ============
+
+CYCLE_STAGE_SECONDS = REGISTRY.histogram(
+    'trading_cycle_stage_seconds', 'Time spent in each trading cycle stage', ('stage',))
+CYCLE_STAGE_FAILURES = REGISTRY.counter(
+    'trading_cycle_stage_failures_total', 'Trading cycle stages that raised', ('stage',))
+PIPELINE_QUEUE_DEPTH = REGISTRY.gauge(
+    'trading_pipeline_queue_depth', 'Cycles waiting for each pipeline stage', ('stage',))
+PIPELINE_BUSY_WORKERS = REGISTRY.gauge(
+    'trading_pipeline_busy_workers', 'Pipeline threads currently running a stage', ('stage',))
+
+# ============ External calls ============
+
+MARKET_DATA_SECONDS = REGISTRY.histogram(
+    'market_data_call_seconds', 'MarketDataFetcher call latency', ('method',))
+MARKET_DATA_HTTP_SECONDS = REGISTRY.histogram(
+    'market_data_http_request_seconds', 'Market data HTTP request latency', ('host',))
+MARKET_DATA_HTTP_REQUESTS = REGISTRY.counter(
+    'market_data_http_requests_total', 'Market data HTTP requests', ('host', 'outcome'))
+
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    'llm_request_seconds', 'LLM chat completion latency', ('provider', 'model'))
+LLM_REQUESTS = REGISTRY.counter(
+    'llm_requests_total', 'LLM chat completion requests', ('provider', 'model', 'outcome'))
+
+LIVE_ORDER_SECONDS = REGISTRY.histogram(
+    'live_order_seconds', 'LiveTradeExecutor.execute_signal latency', ('exchange', 'action'))
+LIVE_ORDERS = REGISTRY.counter(
+    'live_orders_total', 'Live trade signals handled', ('exchange', 'action', 'outcome'))
+
+# ============ Database ============
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'db_method_seconds', 'Database method latency', ('method',))
+DB_ERRORS = REGISTRY.counter(
+    'db_method_errors_total', 'Database methods that raised (OperationalError includes lock timeouts)',
+    ('method', 'error'))
+DB_COMMIT_SECONDS = REGISTRY.histogram(
+    'db_commit_seconds', 'Transaction commit latency')
+DB_POOL_CONNECTIONS = REGISTRY.gauge(
+    'db_pool_connections', 'Pooled database connections', ('state',))
+DB_POOL_CHECKOUTS = REGISTRY.counter(
+    'db_pool_checkouts_total', 'Connections taken from the pool', ('source',))
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a free pooled connection')
+
+# ============ Retention ============
+
+RETENTION_ROWS = REGISTRY.counter(
+    'retention_rows_total', 'Rows removed from history tables by the retention job', ('table', 'action'))
+RETENTION_RUN_SECONDS = REGISTRY.histogram(
+    'retention_run_seconds', 'Retention job run duration')
@@ -0,0 +1,79 @@
+"""
+Model config cache - per-model settings and coin pools held in memory
+模型配置缓存 - 缓存 models/providers 联表得到的模型配置和 model_coin_pools 中启用的币种，
+交易周期中不再查询配置；模型、币种池、币种或提供商变更时由对应接口调用 invalidate
+"""
+import threading
+from typing import Dict, List, Optional
+
+
+class ModelConfigCache:
+    """Model rows (db.get_model) and enabled coin lists, loaded on first use"""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._models: Dict[int, Optional[Dict]] = {}
+        self._coins: Dict[int, List[str]] = {}
+        # 加载期间发生 invalidate 时丢弃加载结果，避免把旧配置写回缓存
+        self._generation = 0
+        self.stats = {'hits': 0, 'loads': 0, 'invalidations': 0}
+
+    def get_model(self, model_id: int) -> Optional[Dict]:
+        """模型配置（与 db.get_model 相同，包含提供商的 api_key/api_url），调用方不要修改返回的字典"""
+        with self._lock:
+            if model_id in self._models:
+                self.stats['hits'] += 1
+                return self._models[model_id]
+            generation = self._generation
+
+        model = self.db.get_model(model_id)
+        self._store(self._models, model_id, model, generation)
+        return model
+
+    def get_coins(self, model_id: int) -> List[str]:
+        """模型启用的币种（按市值排名），数据库错误时抛出异常"""
+        with self._lock:
+            if model_id in self._coins:
+                self.stats['hits'] += 1
+                return list(self._coins[model_id])
+            generation = self._generation
+
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.symbol
+            FROM model_coin_pools mcp
+            JOIN coins c ON mcp.coin_id = c.id
+            WHERE mcp.model_id = ? AND mcp.is_enabled = 1 AND c.is_active = 1
+            ORDER BY c.market_cap_rank ASC, c.symbol ASC
+        """, (model_id,))
+        coins = [row['symbol'] for row in cursor.fetchall()]
+        conn.close()
+
+        self._store(self._coins, model_id, coins, generation)
+        return list(coins)
+
+    def _store(self, cache: Dict, model_id: int, value, generation: int):
+        with self._lock:
+            self.stats['loads'] += 1
+            if generation == self._generation:
+                cache[model_id] = value
+
+    def invalidate(self, model_id: int = None):
+        """丢弃一个模型（或全部模型）的缓存配置，下次访问时重新加载"""
+        with self._lock:
+            self._generation += 1
+            self.stats['invalidations'] += 1
+            if model_id is None:
+                self._models.clear()
+                self._coins.clear()
+            else:
+                self._models.pop(model_id, None)
+                self._coins.pop(model_id, None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['cached_models'] = len(self._models)
+        return stats
@@ -0,0 +1,244 @@
+"""
+Position book - in-memory open positions with write-behind persistence
+持仓簿 - 每个模型的持仓按 (coin, side) 保存在内存中，交易周期内读取持仓和组合不访问数据库；
+持仓变更先记入待写队列（同一持仓只保留最新状态），由 persist 阶段在本周期的事务中写入 portfolios 表
+
+交易引擎读取时不访问数据库；接口读取（verify=True）先用 model_ledger 的一行（交易笔数、盈亏、手续费）
+检查数据库是否被其他进程（另一个 worker、rebuild_ledger.py）修改过，修改过时重新加载。
+"""
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class _ModelBook:
+    """一个模型的账户状态：初始资金、已实现盈亏（扣除手续费）和持仓"""
+
+    __slots__ = ('initial_capital', 'realized_pnl', 'positions', 'pending', 'generation', 'expected')
+
+    def __init__(self, initial_capital: float, generation: Tuple, positions: Dict[Tuple[str, str], Dict]):
+        self.initial_capital = initial_capital
+        self.realized_pnl = generation[1] - generation[2]
+        self.positions = positions
+        self.pending: Dict[Tuple[str, str], Optional[Dict]] = {}  # (coin, side) -> 最新持仓，None 表示平仓
+        self.generation = generation  # 加载时数据库中的 (交易笔数, 已实现盈亏, 手续费)
+        self.expected = generation  # 计入本进程内存中交易之后、提交后数据库应有的值
+
+
+class PositionBook:
+    """Per-model (coin, side) position index; the source of truth during a trading cycle"""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.RLock()
+        self._books: Dict[int, _ModelBook] = {}
+        self.stats = {'loads': 0, 'reloads': 0, 'flushes': 0, 'rows_flushed': 0}
+
+    def _book(self, model_id: int) -> _ModelBook:
+        book = self._books.get(model_id)
+        if book is None:
+            book = self._books[model_id] = self._load(model_id)
+        return book
+
+    @staticmethod
+    def _read_generation(cursor, model_id: int) -> Optional[Tuple]:
+        """(initial_capital, (交易笔数, 已实现盈亏, 手续费))，模型不存在时为 None"""
+        cursor.execute('''
+            SELECT
+                m.initial_capital,
+                COALESCE(l.trade_count, 0) as trade_count,
+                COALESCE(l.realized_pnl, 0) as realized_pnl,
+                COALESCE(l.total_fees, 0) as total_fees
+            FROM models m
+            LEFT JOIN model_ledger l ON l.model_id = m.id
+            WHERE m.id = ?
+        ''', (model_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row['initial_capital'], (row['trade_count'], row['realized_pnl'], row['total_fees'])
+
+    def _load(self, model_id: int) -> _ModelBook:
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        state = self._read_generation(cursor, model_id)
+        if state is None:
+            conn.close()
+            raise KeyError(f"Model {model_id} not found")
+        cursor.execute('SELECT * FROM portfolios WHERE model_id = ? AND quantity > 0', (model_id,))
+        positions = {(p['coin'], p['side']): dict(p) for p in cursor.fetchall()}
+        conn.close()
+
+        self.stats['loads'] += 1
+        return _ModelBook(state[0], state[1], positions)
+
+    def refresh(self, model_id: int) -> bool:
+        """
+        数据库中的账本与内存不一致时丢弃该模型的状态（下次访问重新加载），返回是否丢弃
+
+        与加载时相同：尚未提交（persist 事务进行中）；与计入本进程交易后相同：本进程的提交。
+        有待写变更时不丢弃（本进程的状态更新）。
+        """
+        with self._lock:
+            if model_id not in self._books:
+                return False
+        conn = self.db.get_connection()
+        state = self._read_generation(conn.cursor(), model_id)
+        conn.close()
+
+        with self._lock:
+            book = self._books.get(model_id)
+            if book is None or book.pending:
+                return False
+            if state is not None and state[0] == book.initial_capital:
+                if state[1] == book.generation:
+                    return False
+                if state[1] == book.expected:
+                    book.generation = book.expected
+                    return False
+            del self._books[model_id]
+            self.stats['reloads'] += 1
+            return True
+
+    # ============ Reads ============
+
+    def get_position(self, model_id: int, coin: str, side: str = None) -> Optional[Dict]:
+        """coin 的持仓（side 为空时先找多头再找空头）"""
+        with self._lock:
+            positions = self._book(model_id).positions
+            for key in ([(coin, side)] if side else [(coin, 'long'), (coin, 'short')]):
+                if key in positions:
+                    return dict(positions[key])
+        return None
+
+    def get_positions(self, model_id: int) -> List[Dict]:
+        with self._lock:
+            return [dict(p) for p in self._book(model_id).positions.values()]
+
+    def get_portfolio(self, model_id: int, current_prices: Dict = None, verify: bool = False) -> Dict:
+        """
+        与 Database.get_portfolio 结构相同的组合，在内存中计算
+
+        Args:
+            verify: 先用 refresh() 检查数据库是否被其他进程修改（接口读取时使用）
+        """
+        if verify:
+            self.refresh(model_id)
+        with self._lock:
+            book = self._book(model_id)
+            initial_capital = book.initial_capital
+            realized_pnl = book.realized_pnl
+            positions = [dict(p) for p in book.positions.values()]
+
+        unrealized_pnl = 0
+        for pos in positions:
+            current_price = (current_prices or {}).get(pos['coin'])
+            pos['current_price'] = current_price
+            if current_price is None:
+                pos['pnl'] = 0
+                continue
+            if pos['side'] == 'long':
+                pos['pnl'] = (current_price - pos['avg_price']) * pos['quantity']
+            else:
+                pos['pnl'] = (pos['avg_price'] - current_price) * pos['quantity']
+            unrealized_pnl += pos['pnl']
+
+        margin_used = sum(p['quantity'] * p['avg_price'] / p['leverage'] for p in positions)
+        return {
+            'model_id': model_id,
+            'cash': initial_capital + realized_pnl - margin_used,
+            'positions': positions,
+            'positions_value': sum(p['quantity'] * p['avg_price'] for p in positions),
+            'margin_used': margin_used,
+            'total_value': initial_capital + realized_pnl + unrealized_pnl,
+            'realized_pnl': realized_pnl,
+            'unrealized_pnl': unrealized_pnl
+        }
+
+    # ============ Writes (flushed later) ============
+
+    def update_position(self, model_id: int, coin: str, quantity: float, avg_price: float,
+                        leverage: int = 1, side: str = 'long'):
+        with self._lock:
+            book = self._book(model_id)
+            key = (coin, side)
+            position = dict(book.positions.get(key) or {'id': None, 'model_id': model_id, 'coin': coin, 'side': side})
+            position.update({'quantity': quantity, 'avg_price': avg_price, 'leverage': leverage,
+                             'updated_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')})
+            book.positions[key] = position
+            book.pending[key] = position
+
+    def close_position(self, model_id: int, coin: str, side: str = 'long'):
+        with self._lock:
+            book = self._book(model_id)
+            book.positions.pop((coin, side), None)
+            book.pending[(coin, side)] = None
+
+    def record_trade(self, model_id: int, pnl: float = 0, fee: float = 0):
+        """已写入 trades 的交易计入内存中的已实现盈亏（与 model_ledger 一致）"""
+        with self._lock:
+            book = self._book(model_id)
+            book.realized_pnl += (pnl or 0) - (fee or 0)
+            # 与 add_trade 对 model_ledger 的累加顺序相同，提交后与数据库中的值完全相等
+            count, realized, fees = book.expected
+            book.expected = (count + 1, realized + (pnl or 0), fees + (fee or 0))
+
+    # ============ Persistence ============
+
+    def has_pending(self, model_id: int = None) -> bool:
+        with self._lock:
+            books = [self._books.get(model_id)] if model_id is not None else list(self._books.values())
+            return any(book is not None and book.pending for book in books)
+
+    def flush(self, model_id: int = None) -> int:
+        """
+        把待写的持仓变更写入 portfolios 表，返回写入的行数
+
+        在绑定了 unit of work 的线程上调用时与交易记录在同一事务中提交；
+        写入失败时变更保留在队列中，下次 flush 重试。
+        """
+        with self._lock:
+            model_ids = [model_id] if model_id is not None else list(self._books)
+            batches = []
+            for mid in model_ids:
+                book = self._books.get(mid)
+                if book is not None and book.pending:
+                    batches.append((mid, book, book.pending))
+                    book.pending = {}
+
+        rows = 0
+        for mid, book, pending in batches:
+            try:
+                for (coin, side), position in pending.items():
+                    if position is None:
+                        self.db.close_position(mid, coin, side)
+                    else:
+                        self.db.update_position(mid, coin, position['quantity'], position['avg_price'],
+                                                position['leverage'], side)
+                    rows += 1
+            except Exception:
+                with self._lock:
+                    # 失败的批次放回队列，之后产生的变更优先
+                    pending.update(book.pending)
+                    book.pending = pending
+                raise
+
+        with self._lock:
+            self.stats['flushes'] += 1
+            self.stats['rows_flushed'] += rows
+        return rows
+
+    def invalidate(self, model_id: int = None):
+        """丢弃内存中的状态（及未写入的变更），下次访问时从数据库重新加载"""
+        with self._lock:
+            if model_id is None:
+                self._books.clear()
+            else:
+                self._books.pop(model_id, None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['models'] = len(self._books)
+            stats['pending'] = sum(len(book.pending) for book in self._books.values())
+        return stats
@@ -0,0 +1,169 @@
+"""
+Price aggregator - hedged multi-source price fetching
+多数据源价格聚合 - 记录各数据源延迟分位数，主数据源超过其 p95 仍未返回时
+向备用数据源发出对冲请求，采用最先返回的有效结果
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class LatencyTracker:
+    """Sliding window of request latencies for one source"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+
+    def record(self, seconds: float, ok: bool = True):
+        with self._lock:
+            self._samples.append(seconds)
+            if ok:
+                self.successes += 1
+            else:
+                self.failures += 1
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+        return samples[index]
+
+
+class HedgedPriceAggregator:
+    """
+    对冲请求价格聚合器
+
+    sources 中每个数据源是 (name, fetch_fn)，fetch_fn(coins) 返回
+    {coin: {'price': ..., 'change_24h': ...}}，失败时抛出异常。
+    """
+
+    def __init__(self, sources: List[Tuple[str, Callable[[List[str]], Dict]]],
+                 hedge_percentile: float = 95, min_samples: int = 20,
+                 default_hedge_delay: float = 1.0, min_hedge_delay: float = 0.05,
+                 max_median_multiple: float = 4.0, max_workers: int = 8):
+        """
+        Args:
+            sources: 按优先级排列的数据源列表
+            hedge_percentile: 主数据源超过该延迟分位数后发出对冲请求
+            min_samples: 样本不足时使用 default_hedge_delay，并按配置顺序选择主数据源
+            default_hedge_delay: 默认对冲延迟（秒）
+            min_hedge_delay: 对冲延迟下限（秒），避免过早对冲浪费请求
+            max_median_multiple: 对冲延迟上限为中位数的倍数，防止慢请求占比过高时
+                分位数被拉到慢请求本身，导致对冲失效
+        """
+        self.sources = list(sources)
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_median_multiple = max_median_multiple
+
+        self.trackers = {name: LatencyTracker() for name, _ in self.sources}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='price-hedge')
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'failures': 0}
+
+    def _ordered_sources(self) -> List[Tuple[str, Callable]]:
+        """延迟中位数最低的数据源作为主数据源（样本不足时保持配置顺序）"""
+        if any(self.trackers[name].count() < self.min_samples for name, _ in self.sources):
+            return self.sources
+
+        def median(source):
+            return self.trackers[source[0]].percentile(50)
+
+        return sorted(self.sources, key=median)
+
+    def _hedge_delay(self, name: str) -> float:
+        tracker = self.trackers[name]
+        if tracker.count() < self.min_samples:
+            return self.default_hedge_delay
+        delay = min(tracker.percentile(self.hedge_percentile),
+                    tracker.percentile(50) * self.max_median_multiple)
+        return max(self.min_hedge_delay, delay)
+
+    def _run(self, name: str, fn: Callable, coins: List[str]):
+        start = time.perf_counter()
+        try:
+            result = fn(coins)
+        except Exception as e:
+            self.trackers[name].record(time.perf_counter() - start, ok=False)
+            print(f"[WARN] Price source {name} failed: {e}")
+            return None
+        self.trackers[name].record(time.perf_counter() - start, ok=bool(result))
+        return result or None
+
+    def fetch(self, coins: List[str]) -> Tuple[Optional[str], Dict]:
+        """
+        获取价格
+
+        Returns:
+            (source_name, prices)，所有数据源都失败时返回 (None, {})
+        """
+        with self._stats_lock:
+            self.stats['requests'] += 1
+
+        ordered = self._ordered_sources()
+        primary_name = ordered[0][0]
+        pending = {}
+
+        def launch(source):
+            name, fn = source
+            pending[self._executor.submit(self._run, name, fn, coins)] = name
+
+        remaining = list(ordered)
+        launch(remaining.pop(0))
+        hedge_delay = self._hedge_delay(primary_name)
+
+        while pending:
+            timeout = hedge_delay if remaining else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # 主数据源超过 p95 仍未返回：对冲到下一个数据源
+                launch(remaining.pop(0))
+                with self._stats_lock:
+                    self.stats['hedges'] += 1
+                continue
+
+            for future in done:
+                name = pending.pop(future)
+                result = future.result()
+                if result:
+                    if name != primary_name:
+                        with self._stats_lock:
+                            self.stats['hedge_wins'] += 1
+                    return name, result
+
+            # 已完成的请求都失败：立即尝试下一个数据源
+            if remaining and not pending:
+                launch(remaining.pop(0))
+
+        with self._stats_lock:
+            self.stats['failures'] += 1
+        return None, {}
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['sources'] = {
+            name: {
+                'p50': tracker.percentile(50),
+                'p95': tracker.percentile(95),
+                'samples': tracker.count(),
+                'successes': tracker.successes,
+                'failures': tracker.failures,
+            }
+            for name, tracker in self.trackers.items()
+        }
+        return stats
@@ -0,0 +1,28 @@
+"""
+Ledger rebuild script - recompute per-model realized P&L totals from trade history
+账本重建脚本 - 从 trades 表重新计算每个模型的已实现盈亏、手续费和交易笔数（model_ledger 表）
+
+用法: python rebuild_ledger.py [数据库路径] [模型ID]
+"""
+import sys
+
+from database import Database
+
+
+def rebuild_ledger(db_path='AITradeGame.db', model_id=None):
+    """重建账本（init_db 会创建 model_ledger 表，首次创建时自动填充）"""
+    db = Database(db_path)
+    try:
+        db.init_db()
+        rows = db.rebuild_ledger(model_id)
+        scope = f"model {model_id}" if model_id is not None else "all models"
+        print(f"[SUCCESS] Ledger rebuilt for {scope}: {rows} ledger rows")
+    except Exception as e:
+        print(f"[ERROR] Ledger rebuild failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'AITradeGame.db'
+    model_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    rebuild_ledger(db_path, model_id)
@@ -0,0 +1,218 @@
+"""
+Retention job - keep history tables bounded
+数据保留任务 - 定期清理只增不减的历史数据：
+  account_values 超过保留期的原始快照删除（写入时已计入 1m/1h/1d 汇总，图表读取汇总），
+  分钟、小时汇总再按各自的保留期删除，天汇总永久保留；
+  conversations 超过保留期的记录压缩后移入 conversation_archive；
+  删除后空闲的页面用 incremental vacuum 归还给文件系统。
+每批只处理 batch_size 行并单独提交，批次之间释放写锁，交易周期的写入只需等待一个批次。
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from database import ALL_MODELS
+from metrics import RETENTION_ROWS, RETENTION_RUN_SECONDS
+
+
+# 保留天数，0 表示不清理
+DEFAULT_POLICY = {
+    'account_values_days': 30,
+    'conversations_days': 7,
+    'rollup_1m_days': 14,
+    'rollup_1h_days': 365,
+}
+
+
+class RetentionJob:
+    """Batched pruning, archiving and incremental vacuum, run periodically by the scheduler"""
+
+    def __init__(self, db, policy: Optional[Dict[str, float]] = None, batch_size: int = 2000,
+                 pause: float = 0.05, vacuum_pages: int = 1000, convert_vacuum: bool = False):
+        """
+        Args:
+            policy: 覆盖 DEFAULT_POLICY 的保留天数
+            batch_size: 每个事务处理的行数
+            pause: 批次之间的间隔（秒），让交易周期的写入拿到写锁
+            vacuum_pages: 每次 incremental vacuum 释放的页数
+            convert_vacuum: 数据库未启用 auto_vacuum=INCREMENTAL 时执行一次完整 VACUUM 转换（期间阻塞写入）
+        """
+        self.db = db
+        self.policy = dict(DEFAULT_POLICY)
+        if policy:
+            self.policy.update(policy)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.convert_vacuum = convert_vacuum
+        self._lock = threading.Lock()
+        self._warned_vacuum = False
+        self.stats = {'runs': 0, 'account_values_deleted': 0, 'rollups_deleted': 0,
+                      'conversations_archived': 0, 'pages_vacuumed': 0, 'last_run': None, 'last_duration': 0.0}
+
+    def run(self) -> Dict:
+        """执行一轮清理，返回本轮处理的行数/页数；上一轮尚未结束时跳过"""
+        if not self._lock.acquire(blocking=False):
+            print("[WARN] Retention job still running, skipped")
+            return {}
+        try:
+            started = time.monotonic()
+            result = {'account_values_deleted': 0, 'rollups_deleted': 0,
+                      'conversations_archived': 0, 'pages_vacuumed': 0}
+
+            cutoff = self._cutoff('account_values_days')
+            if cutoff:
+                result['account_values_deleted'] = self._prune_account_values(cutoff)
+            for bucket in ('1m', '1h'):
+                cutoff = self._cutoff(f'rollup_{bucket}_days')
+                if cutoff:
+                    result['rollups_deleted'] += self._prune_rollups(bucket, cutoff)
+            cutoff = self._cutoff('conversations_days')
+            if cutoff:
+                result['conversations_archived'] = self._archive_conversations(cutoff)
+            result['pages_vacuumed'] = self._incremental_vacuum()
+
+            duration = time.monotonic() - started
+            RETENTION_RUN_SECONDS.observe(duration)
+            self.stats['runs'] += 1
+            for key, value in result.items():
+                self.stats[key] += value
+            self.stats['last_run'] = datetime.now().isoformat()
+            self.stats['last_duration'] = round(duration, 3)
+            print(f"[INFO] Retention: {result['account_values_deleted']} account values, "
+                  f"{result['rollups_deleted']} rollups deleted, {result['conversations_archived']} conversations "
+                  f"archived, {result['pages_vacuumed']} pages vacuumed in {duration:.1f}s")
+            return result
+        except Exception as e:
+            print(f"[ERROR] Retention job failed: {e}")
+            return {}
+        finally:
+            self._lock.release()
+
+    def _cutoff(self, key: str) -> Optional[str]:
+        days = self.policy.get(key) or 0
+        if days <= 0:
+            return None
+        return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def _boundary_id(self, table: str, cutoff: str) -> int:
+        """第一条不早于 cutoff 的记录的 id（id 随写入时间递增），更小的 id 都已过期"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT id FROM {table} WHERE timestamp >= ? ORDER BY id LIMIT 1', (cutoff,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}')
+            row = cursor.fetchone()
+        conn.close()
+        return row[0]
+
+    def _in_batches(self, step) -> int:
+        """重复执行 step（每次一个事务）直到处理的行数不足一批"""
+        total = 0
+        while True:
+            count = step()
+            total += count
+            if count < self.batch_size:
+                return total
+            time.sleep(self.pause)
+
+    def _prune_account_values(self, cutoff: str) -> int:
+        boundary = self._boundary_id('account_values', cutoff)
+
+        def step():
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM account_values WHERE id IN (
+                    SELECT id FROM account_values WHERE id < ? ORDER BY id LIMIT ?
+                )
+            ''', (boundary, self.batch_size))
+            deleted = cursor.rowcount
+            conn.commit()
+            conn.close()
+            RETENTION_ROWS.inc(deleted, table='account_values', action='deleted')
+            return deleted
+
+        return self._in_batches(step)
+
+    def _prune_rollups(self, bucket: str, cutoff: str) -> int:
+        conn = self.db.get_connection()
+        model_ids = [row[0] for row in conn.execute('SELECT id FROM models').fetchall()] + [ALL_MODELS]
+        conn.close()
+
+        total = 0
+        for model_id in model_ids:
+            def step():
+                conn = self.db.get_connection()
+                cursor = conn.cursor()
+                # 按主键顺序删除最早的一批：找到第 batch_size 个过期桶的起点作为本批上界
+                cursor.execute('''
+                    SELECT bucket_start FROM account_value_rollups
+                    WHERE bucket = ? AND model_id = ? AND bucket_start < ?
+                    ORDER BY bucket_start LIMIT 1 OFFSET ?
+                ''', (bucket, model_id, cutoff, self.batch_size))
+                row = cursor.fetchone()
+                cursor.execute('''
+                    DELETE FROM account_value_rollups WHERE bucket = ? AND model_id = ? AND bucket_start < ?
+                ''', (bucket, model_id, row[0] if row else cutoff))
+                deleted = cursor.rowcount
+                conn.commit()
+                conn.close()
+                RETENTION_ROWS.inc(deleted, table=f'account_value_rollups_{bucket}', action='deleted')
+                return deleted
+
+            total += self._in_batches(step)
+        return total
+
+    def _archive_conversations(self, cutoff: str) -> int:
+        boundary = self._boundary_id('conversations', cutoff)
+
+        def step():
+            moved = self.db.archive_conversations(boundary, self.batch_size)
+            RETENTION_ROWS.inc(moved, table='conversations', action='archived')
+            return moved
+
+        return self._in_batches(step)
+
+    def _incremental_vacuum(self) -> int:
+        """分批释放空闲页；数据库未启用 incremental auto-vacuum 时按 convert_vacuum 转换或跳过"""
+        conn = self.db.get_connection()
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                if not self.convert_vacuum:
+                    if not self._warned_vacuum:
+                        self._warned_vacuum = True
+                        print("[WARN] Database is not in incremental auto-vacuum mode, free pages are reused "
+                              "but not released (set RETENTION_CONVERT_VACUUM=true to convert once)")
+                    return 0
+                print("[INFO] Converting database to incremental auto-vacuum (full VACUUM, writes wait)...")
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+                self.convert_vacuum = False
+
+            freed = 0
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            while free_pages:
+                # executescript 执行到结束；execute 只单步执行一次，每次只释放一页
+                conn.executescript(f'PRAGMA incremental_vacuum({min(free_pages, self.vacuum_pages)})')
+                remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if remaining >= free_pages:
+                    break
+                freed += free_pages - remaining
+                free_pages = remaining
+                time.sleep(self.pause)
+            if freed:
+                # WAL 模式下文件在检查点时才截断；PASSIVE 不等待读写
+                conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+            return freed
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['policy'] = dict(self.policy)
+        stats['running'] = self._lock.locked()
+        return stats
+
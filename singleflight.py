@@ -0,0 +1,112 @@
+"""
+Single-flight request coalescing
+同一资源的并发请求只发出一次，其余调用方等待同一个结果
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """In-flight request registry keyed by (resource, key)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, resource: str, field: str, n: int = 1):
+        counters = self._stats.setdefault(resource, {'issued': 0, 'coalesced': 0})
+        counters[field] += n
+
+    def do(self, resource: str, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn() unless an identical call is already in flight, in which case
+        wait for that call's result (or exception) instead.
+        """
+        call_key = (resource, key)
+        with self._lock:
+            future = self._calls.get(call_key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[call_key] = future
+                self._count(resource, 'issued')
+            else:
+                self._count(resource, 'coalesced')
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[call_key]
+
+    def do_many(self, resource: str, keys: List[Hashable],
+                fetch_fn: Callable[[List[Hashable]], Dict[Hashable, Any]]) -> Dict[Hashable, Any]:
+        """
+        Batched variant: keys already in flight are awaited, the remaining keys
+        are fetched with a single fetch_fn(remaining) call that returns
+        {key: value}. Keys missing from every result are omitted.
+        """
+        with self._lock:
+            waiting = {}
+            mine = {}
+            for key in keys:
+                call_key = (resource, key)
+                if call_key in self._calls:
+                    waiting[key] = self._calls[call_key]
+                else:
+                    mine[key] = Future()
+                    self._calls[call_key] = mine[key]
+            if mine:
+                self._count(resource, 'issued')
+            self._count(resource, 'coalesced', len(waiting))
+
+        results = {}
+        if mine:
+            try:
+                fetched = fetch_fn(list(mine.keys())) or {}
+                for key, future in mine.items():
+                    future.set_result(fetched.get(key))
+                    if key in fetched:
+                        results[key] = fetched[key]
+            except BaseException as e:
+                for future in mine.values():
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    for key in mine:
+                        del self._calls[(resource, key)]
+
+        for key, future in waiting.items():
+            try:
+                value = future.result()
+            except Exception:
+                continue
+            if value is not None:
+                results[key] = value
+
+        return results
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            stats = {resource: dict(counters) for resource, counters in self._stats.items()}
+            in_flight = len(self._calls)
+        total_issued = sum(c['issued'] for c in stats.values())
+        total_coalesced = sum(c['coalesced'] for c in stats.values())
+        return {
+            'issued': total_issued,
+            'coalesced': total_coalesced,
+            'in_flight': in_flight,
+            'by_resource': stats,
+        }
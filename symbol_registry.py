@@ -0,0 +1,134 @@
+"""
+Symbol registry - coin symbol mappings loaded from the coins table
+币种符号注册表 - 从 coins 表加载各数据源的交易对/ID，提供正向和反向 O(1) 查找
+"""
+import threading
+from typing import Dict, List, Optional
+
+
+# coins 表不存在（尚未运行迁移）时使用的默认币种
+DEFAULT_COINS = [
+    # symbol, binance_symbol, okx_symbol, coingecko_id
+    ('BTC', 'BTCUSDT', 'BTC-USDT', 'bitcoin'),
+    ('ETH', 'ETHUSDT', 'ETH-USDT', 'ethereum'),
+    ('SOL', 'SOLUSDT', 'SOL-USDT', 'solana'),
+    ('BNB', 'BNBUSDT', 'BNB-USDT', 'binancecoin'),
+    ('XRP', 'XRPUSDT', 'XRP-USDT', 'ripple'),
+    ('DOGE', 'DOGEUSDT', 'DOGE-USDT', 'dogecoin'),
+]
+
+
+class _SymbolMaps:
+    """一次加载得到的全部映射（只读，刷新时整体替换）"""
+
+    def __init__(self):
+        self.coin_ids: Dict[str, int] = {}
+        self.binance: Dict[str, str] = {}
+        self.okx: Dict[str, str] = {}
+        self.coingecko: Dict[str, str] = {}
+        self.binance_reverse: Dict[str, str] = {}
+        self.okx_reverse: Dict[str, str] = {}
+        self.coingecko_reverse: Dict[str, str] = {}
+
+    def add(self, symbol: str, binance_symbol: Optional[str], okx_symbol: Optional[str],
+            coingecko_id: Optional[str], coin_id: Optional[int] = None):
+        if coin_id is not None:
+            self.coin_ids[symbol] = coin_id
+        if binance_symbol:
+            self.binance[symbol] = binance_symbol
+            self.binance_reverse[binance_symbol] = symbol
+        if okx_symbol:
+            self.okx[symbol] = okx_symbol
+            self.okx_reverse[okx_symbol] = symbol
+        if coingecko_id:
+            self.coingecko[symbol] = coingecko_id
+            self.coingecko_reverse[coingecko_id] = symbol
+
+
+class SymbolRegistry:
+    """Forward (symbol -> source id) and reverse (source id -> symbol) hash maps"""
+
+    def __init__(self, db=None):
+        """
+        Args:
+            db: Database 实例；为 None 时只使用默认币种
+        """
+        self.db = db
+        self._lock = threading.Lock()
+        self._maps = self._default_maps()
+        self.refresh()
+
+    @staticmethod
+    def _default_maps() -> _SymbolMaps:
+        maps = _SymbolMaps()
+        for symbol, binance_symbol, okx_symbol, coingecko_id in DEFAULT_COINS:
+            maps.add(symbol, binance_symbol, okx_symbol, coingecko_id)
+        return maps
+
+    def refresh(self) -> int:
+        """从 coins 表重新加载映射（币种增删改后调用），返回币种数量"""
+        if self.db is None:
+            return len(self._maps.binance)
+
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, symbol, binance_symbol, okx_symbol, coingecko_id
+                FROM coins
+            ''')
+            rows = cursor.fetchall()
+            conn.close()
+        except Exception as e:
+            print(f"[WARN] Symbol registry using default coins: {e}")
+            return len(self._maps.binance)
+
+        if not rows:
+            return len(self._maps.binance)
+
+        maps = _SymbolMaps()
+        for row in rows:
+            maps.add(row['symbol'], row['binance_symbol'], row['okx_symbol'], row['coingecko_id'], row['id'])
+
+        with self._lock:
+            self._maps = maps
+        return len(rows)
+
+    # ============ Forward lookups ============
+
+    def coin_id(self, symbol: str) -> Optional[int]:
+        return self._maps.coin_ids.get(symbol)
+
+    def binance_symbol(self, symbol: str) -> Optional[str]:
+        return self._maps.binance.get(symbol)
+
+    def okx_symbol(self, symbol: str) -> Optional[str]:
+        return self._maps.okx.get(symbol)
+
+    def coingecko_id(self, symbol: str) -> str:
+        """CoinGecko ID，未配置时退回小写符号"""
+        return self._maps.coingecko.get(symbol, symbol.lower())
+
+    # ============ Reverse lookups ============
+
+    def coin_for_binance(self, binance_symbol: str) -> Optional[str]:
+        return self._maps.binance_reverse.get(binance_symbol)
+
+    def coin_for_okx(self, okx_symbol: str) -> Optional[str]:
+        return self._maps.okx_reverse.get(okx_symbol)
+
+    def coin_for_coingecko(self, coingecko_id: str) -> Optional[str]:
+        return self._maps.coingecko_reverse.get(coingecko_id)
+
+    # ============ Bulk views ============
+
+    @property
+    def binance_symbols(self) -> Dict[str, str]:
+        return self._maps.binance
+
+    @property
+    def coingecko_mapping(self) -> Dict[str, str]:
+        return self._maps.coingecko
+
+    def symbols(self) -> List[str]:
+        return list(self._maps.binance.keys() | self._maps.coingecko.keys())
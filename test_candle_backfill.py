@@ -0,0 +1,86 @@
+"""
+Candle backfill - the candle store fills the head of a window it has not seen yet
+K线补抓测试 - 指标先抓 14 天 1h K线后，CandleFeed 请求更长的窗口时必须补抓窗口开头，
+而不只是最新K线之后的部分（针对 market_stub_server，在后台线程启动）
+
+运行:
+    python -m pytest -q test_candle_backfill.py
+"""
+import threading
+
+import pytest
+
+from async_market_data import AsyncMarketDataFetcher
+from candle_feed import CandleFeed
+from candle_store import CandleStore, TIMEFRAME_MS
+from market_data import MarketDataFetcher
+from market_stub_server import start_in_background
+
+
+@pytest.fixture(scope='module')
+def stub_url():
+    server, base_url = start_in_background(port=0, symbols=10)
+    yield base_url
+    server.shutdown()
+
+
+def make_fetcher(cls, stub_url, tmp_path):
+    return cls(candle_store=CandleStore(str(tmp_path / 'candles.db')),
+               binance_base_url=stub_url, coingecko_base_url=stub_url)
+
+
+@pytest.mark.parametrize('cls', [MarketDataFetcher, AsyncMarketDataFetcher])
+def test_feed_after_indicator_fetch_gets_full_window(cls, stub_url, tmp_path):
+    fetcher = make_fetcher(cls, stub_url, tmp_path)
+    fetcher.calculate_technical_indicators_bulk(['BTC', 'ETH'])
+    first_ts, _ = fetcher.candle_store.get_time_range('BTC', '1h')
+
+    frames = CandleFeed(fetcher).get_frames(['BTC', 'ETH'])
+
+    for coin in ('BTC', 'ETH'):
+        assert len(frames[coin]['1h']) == 700
+        assert len(frames[coin]['4h']) >= 360
+        assert len(frames[coin]['1d']) >= 60
+    assert fetcher.candle_store.get_time_range('BTC', '1h')[0] < first_ts
+    if hasattr(fetcher, 'close'):
+        fetcher.close()
+
+
+def test_head_backfill_fills_gap_without_duplicates(stub_url, tmp_path):
+    fetcher = make_fetcher(MarketDataFetcher, stub_url, tmp_path)
+    short = fetcher.get_candles('BTC', '1h', days=2)
+    full = fetcher.get_candles('BTC', '1h', days=10)
+
+    assert len(full) >= 10 * 24
+    timestamps = [bar['timestamp'] for bar in full]
+    assert timestamps == sorted(set(timestamps))
+    assert all(b - a == TIMEFRAME_MS['1h'] for a, b in zip(timestamps, timestamps[1:]))
+    assert timestamps[-len(short):] == [bar['timestamp'] for bar in short][-len(short):]
+
+
+def test_head_not_refetched_before_listing(stub_url, tmp_path):
+    """窗口早于交易所最早的K线时只在第一次请求窗口开头"""
+    fetcher = make_fetcher(MarketDataFetcher, stub_url, tmp_path)
+    fetcher.get_candles('BTC', '1h', days=120)  # 模拟服务器只有 90 天历史
+    first_ts, last_ts = fetcher.candle_store.get_time_range('BTC', '1h')
+
+    window_start = int(fetcher.clock() * 1000) - 120 * TIMEFRAME_MS['1d']
+    assert fetcher._backfill_ranges('BTC', '1h', window_start) == [(last_ts, None)]
+
+
+def test_async_backfill_keeps_sqlite_off_the_event_loop(stub_url, tmp_path):
+    fetcher = make_fetcher(AsyncMarketDataFetcher, stub_url, tmp_path)
+    threads = set()
+    store = fetcher.candle_store
+    for name in ('get_time_range', 'upsert_candles'):
+        method = getattr(store, name)
+
+        def traced(*args, _method=method, **kwargs):
+            threads.add(threading.current_thread().name)
+            return _method(*args, **kwargs)
+        setattr(store, name, traced)
+
+    fetcher.get_candles_bulk(['BTC', 'ETH', 'SOL'], '1h', days=3)
+    fetcher.close()
+
+    assert threads and all(name.startswith('market-data-db') for name in threads)
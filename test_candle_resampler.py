@@ -0,0 +1,145 @@
+"""
+Candle resampler - derived 4h/1d bars match a pandas resample reference
+K线周期合成测试 - resample_ohlcv / CandleResampler 的结果与 pandas resample 逐根比较，
+以及 CandleFeed 在基础K线不足时的告警
+
+运行:
+    python -m pytest -q test_candle_resampler.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from candle_feed import CandleFeed
+from candle_resampler import CandleResampler, resample_ohlcv
+from candle_store import TIMEFRAME_MS
+
+
+HOUR_MS = TIMEFRAME_MS['1h']
+
+
+def hourly_bars(count: int, start_ms: int, seed: int = 7, gaps=()) -> pd.DataFrame:
+    """随机游走的 1h K线，gaps 中的序号被删除（模拟交易所缺失的K线）"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, count)))
+    open_ = np.concatenate(([100.0], close[:-1]))
+    spread = np.abs(rng.normal(0, 0.005, count)) * close
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(start_ms + np.arange(count) * HOUR_MS, unit='ms'),
+        'open': open_,
+        'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread,
+        'close': close,
+        'volume': rng.uniform(1, 100, count),
+    })
+    return df.drop(index=list(gaps)).reset_index(drop=True)
+
+
+def pandas_reference(df: pd.DataFrame, timeframe: str) -> pd.DataFrame:
+    """pandas resample（按 UTC epoch 对齐，左闭），去掉没有基础K线的桶和不完整的第一根"""
+    period = pd.Timedelta(milliseconds=TIMEFRAME_MS[timeframe])
+    first = df['timestamp'].iloc[0]
+    if first != first.floor(period):
+        df = df[df['timestamp'] >= first.floor(period) + period]
+    ref = df.set_index('timestamp').resample(period, origin='epoch', label='left', closed='left').agg({
+        'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum',
+    })
+    return ref.dropna(subset=['open']).reset_index()
+
+
+def assert_same_bars(actual: pd.DataFrame, expected: pd.DataFrame):
+    assert len(actual) == len(expected)
+    assert (pd.to_datetime(actual['timestamp']).to_numpy() == expected['timestamp'].to_numpy()).all()
+    for col in ('open', 'high', 'low', 'close', 'volume'):
+        np.testing.assert_allclose(actual[col].to_numpy(dtype=float), expected[col].to_numpy(), rtol=1e-12)
+
+
+@pytest.mark.parametrize('timeframe', ['4h', '1d'])
+@pytest.mark.parametrize('offset_hours', [0, 5])
+def test_resample_matches_pandas(timeframe, offset_hours):
+    start = 1_700_006_400_000 + offset_hours * HOUR_MS  # 2023-11-15 00:00 UTC
+    df = hourly_bars(1440, start)
+
+    assert_same_bars(resample_ohlcv(df, timeframe), pandas_reference(df, timeframe))
+
+
+@pytest.mark.parametrize('timeframe', ['4h', '1d'])
+def test_resample_with_gaps_matches_pandas(timeframe):
+    df = hourly_bars(500, 1_700_006_400_000, gaps=[3, 4, 5, 6, 7, 100, 250, 251])
+
+    assert_same_bars(resample_ohlcv(df, timeframe), pandas_reference(df, timeframe))
+
+
+def test_bar_counts():
+    df = hourly_bars(1440, 1_700_006_400_000)
+
+    assert len(resample_ohlcv(df, '4h')) == 360
+    assert len(resample_ohlcv(df, '1d')) == 60
+
+
+def test_incremental_update_matches_full_recompute():
+    df = hourly_bars(1000, 1_700_006_400_000 + 3 * HOUR_MS)
+    resampler = CandleResampler()
+    for end in (700, 701, 702, 710, 733, 1000):
+        base = df.iloc[:end].reset_index(drop=True)
+        for timeframe in ('4h', '1d'):
+            assert_same_bars(resampler.resample('BTC', base, timeframe), pandas_reference(base, timeframe))
+    assert resampler.stats['incremental'] > 0
+
+
+def test_updated_last_bar_is_recomputed():
+    df = hourly_bars(200, 1_700_006_400_000)
+    resampler = CandleResampler()
+    resampler.resample('BTC', df, '4h')
+
+    updated = df.copy()
+    updated.loc[updated.index[-1], ['high', 'close', 'volume']] = [500.0, 499.0, 1e6]
+    assert_same_bars(resampler.resample('BTC', updated, '4h'), pandas_reference(updated, '4h'))
+
+
+def test_longer_base_extending_the_head_is_recomputed():
+    """指标先抓的 14 天基础K线缓存后，补抓到 60 天时不能继续返回 14 根 1d K线"""
+    df = hourly_bars(1440, 1_700_006_400_000)
+    resampler = CandleResampler()
+    assert len(resampler.resample('BTC', df.iloc[-337:].reset_index(drop=True), '1d')) == 14
+
+    assert_same_bars(resampler.resample('BTC', df, '1d'), pandas_reference(df, '1d'))
+
+    assert resampler.stats['full'] == 2
+
+    # 向前延伸的同时最新一根也被更新
+    resampler = CandleResampler()
+    resampler.resample('BTC', df.iloc[-337:].reset_index(drop=True), '1d')
+    updated = df.copy()
+    updated.loc[updated.index[-1], ['close', 'volume']] = [150.0, 5e5]
+    assert_same_bars(resampler.resample('BTC', updated, '1d'), pandas_reference(updated, '1d'))
+    assert resampler.stats == {'hits': 0, 'incremental': 0, 'full': 2}
+
+
+class ShortHistoryFetcher:
+    """只有 days 天以内的部分K线（模拟新上线的币种）"""
+
+    def __init__(self, bars: int):
+        self.bars = bars
+
+    def clock(self):
+        return 1_700_006_400
+
+    def get_candles(self, coin, timeframe, days=14):
+        df = hourly_bars(self.bars, 1_700_006_400_000 - self.bars * HOUR_MS)
+        df['timestamp'] = df['timestamp'].astype('int64') // 10 ** 6
+        return df.to_dict('records')
+
+
+def test_feed_warns_once_when_base_is_short(capsys):
+    feed = CandleFeed(ShortHistoryFetcher(400), tick_seconds=1)
+
+    frames = feed.get_frames(['NEW'])['NEW']
+    assert len(frames['1h']) == 400
+    assert len(frames['1d']) < 60
+    assert 'got 400/1440 1h bars for NEW' in capsys.readouterr().out
+
+    feed._tick = None
+    feed.get_frames(['NEW'])
+    assert 'Candle feed got' not in capsys.readouterr().out
+    assert feed.get_stats()['short_frames'] == 2
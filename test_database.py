@@ -0,0 +1,277 @@
+"""
+Database - indexes, ledger, account value rollups, retention and unit-of-work transactions
+数据库测试 - 热点查询使用受管索引、废弃索引在升级时删除；
+增量维护的 model_ledger / account_value_rollups 与全量重算一致；
+保留任务删除/归档过期数据并用 incremental vacuum 释放空闲页；
+unit of work 和保存点的回滚范围正确，事务开始时即持有写锁
+
+运行:
+    python -m pytest -q test_database.py
+"""
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from database import Database
+from retention import RetentionJob
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'test.db'), busy_timeout=0.2)
+    db.init_db()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def models(db):
+    provider_id = db.add_provider('test', 'http://127.0.0.1', 'key')
+    return [db.add_model(name=f'm{i}', provider_id=provider_id, model_name='test', initial_capital=10000)
+            for i in range(2)]
+
+
+def query(db, sql, params=()):
+    conn = db.get_connection()
+    rows = [tuple(row) for row in conn.execute(sql, params).fetchall()]
+    conn.close()
+    return rows
+
+
+def rebuild_rollups(db):
+    conn = db.get_connection()
+    db._rebuild_rollups(conn.cursor())
+    conn.commit()
+    conn.close()
+
+
+LEDGER = 'SELECT model_id, realized_pnl, total_fees, trade_count FROM model_ledger ORDER BY model_id'
+ROLLUPS = 'SELECT * FROM account_value_rollups ORDER BY bucket, model_id, bucket_start'
+LATEST = 'SELECT * FROM account_value_latest ORDER BY model_id'
+
+
+# ============ Indexes ============
+
+def plan(db, sql, params):
+    return ' '.join(row[-1] for row in query(db, 'EXPLAIN QUERY PLAN ' + sql, params))
+
+
+def test_hot_queries_use_indexes(db, models):
+    assert 'idx_account_values_history' in plan(
+        db, 'SELECT * FROM account_values WHERE model_id = ? ORDER BY timestamp DESC LIMIT ?', (models[0], 100))
+    assert 'sqlite_autoindex_portfolios_1' in plan(
+        db, 'SELECT * FROM portfolios WHERE model_id = ? AND quantity > 0', (models[0],))
+
+
+def test_upgrade_drops_retired_indexes(db):
+    conn = db.get_connection()
+    conn.execute('CREATE INDEX idx_portfolios_open ON portfolios(model_id, coin, side) WHERE quantity > 0')
+    conn.execute('CREATE INDEX idx_account_values_model_time ON account_values(model_id, timestamp, total_value)')
+    conn.commit()
+    conn.close()
+
+    db.init_db()
+
+    names = {row[0] for row in query(db, "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert not names & set(database.RETIRED_INDEXES)
+    assert set(database.INDEXES) <= names
+
+
+# ============ Ledger ============
+
+def test_ledger_matches_rebuild_from_trades(db, models):
+    for i in range(20):
+        model_id = models[i % 2]
+        db.add_trade(model_id, 'BTC', 'close_position', 0.1, 60000 + i, pnl=(i - 7) * 3.5, fee=1.25)
+    db.add_trade(models[0], 'ETH', 'buy_to_enter', 1, 3000, fee=3)
+
+    incremental = query(db, LEDGER)
+    assert db.rebuild_ledger() == 2
+    assert query(db, LEDGER) == incremental
+    assert incremental[0][3] == 11 and incremental[1][3] == 10
+
+
+def test_portfolio_realized_pnl_comes_from_ledger(db, models):
+    db.add_trade(models[0], 'BTC', 'close_position', 0.1, 60000, pnl=120, fee=6)
+    db.add_trade(models[0], 'BTC', 'close_position', 0.1, 60000, pnl=-20, fee=6)
+
+    portfolio = db.get_portfolio(models[0])
+    assert portfolio['realized_pnl'] == pytest.approx(88)
+    assert portfolio['cash'] == pytest.approx(10088)
+
+
+# ============ Rollups ============
+
+class FakeDatetime(datetime):
+    now_value = datetime(2024, 5, 1, 23, 58, 30)
+
+    @classmethod
+    def utcnow(cls):
+        return cls.now_value
+
+
+def test_rollups_match_full_recompute(db, models, monkeypatch):
+    monkeypatch.setattr(database, 'datetime', FakeDatetime)
+    # 跨越分钟、小时和天的边界，两个模型交错写入
+    values = [10000, 10050, 9980, 10120, 10090, 9900, 10010, 10200, 10150, 10030]
+    for step, value in enumerate(values * 3):
+        FakeDatetime.now_value = datetime(2024, 5, 1, 23, 58, 30) + timedelta(seconds=47 * step)
+        model_id = models[step % 2]
+        db.record_account_value(model_id, value + model_id, value / 2, value / 2 + model_id)
+
+    incremental_rollups = query(db, ROLLUPS)
+    incremental_latest = query(db, LATEST)
+    rebuild_rollups(db)
+
+    assert query(db, ROLLUPS) == incremental_rollups
+    assert query(db, LATEST) == incremental_latest
+    assert {row[0] for row in incremental_rollups} == {'1m', '1h', '1d'}
+    assert len([row for row in incremental_rollups if row[0] == '1d' and row[1] == database.ALL_MODELS]) == 2
+
+
+def test_chart_reads_bucket_closes(db, models, monkeypatch):
+    monkeypatch.setattr(database, 'datetime', FakeDatetime)
+    for second, value in ((0, 100), (20, 130), (40, 90)):
+        FakeDatetime.now_value = datetime(2024, 5, 1, 12, 0, second)
+        db.record_account_value(models[0], value, value, 0)
+
+    point = db.get_aggregated_account_value_history(limit=10)[0]
+    assert (point['open'], point['high'], point['low'], point['total_value']) == (100, 130, 90, 90)
+
+
+# ============ Retention ============
+
+def pragma(db, name):
+    return query(db, f'PRAGMA {name}')[0][0]
+
+
+def seed_history(db, model_id, monkeypatch, old=120, recent=20):
+    """old 条 60 天前的快照和 recent 条最近一小时的快照（每分钟一条），以及 300 条对话（前 200 条过期）"""
+    monkeypatch.setattr(database, 'datetime', FakeDatetime)
+    now = datetime.utcnow()
+    for i in range(old + recent):
+        start = now - timedelta(days=60) if i < old else now - timedelta(hours=1)
+        FakeDatetime.now_value = start + timedelta(minutes=i % old)
+        db.record_account_value(model_id, 10000 + i, 5000, 5000 + i)
+
+    for i in range(300):
+        db.add_conversation(model_id, f'prompt {i} ' + 'market data ' * 200, f'response {i}', 'thinking ' * 100)
+    conn = db.get_connection()
+    conn.execute("UPDATE conversations SET timestamp = '2020-01-01 00:00:00' WHERE id <= 200")
+    conn.commit()
+    conn.close()
+
+
+def test_retention_prunes_archives_and_releases_pages(db, models, monkeypatch):
+    seed_history(db, models[0], monkeypatch)
+    cutoff_1m = (datetime.utcnow() - timedelta(days=14)).strftime('%Y-%m-%d %H:%M:%S')
+    old_rollups = query(db, "SELECT COUNT(*) FROM account_value_rollups WHERE bucket = '1m' AND bucket_start < ?",
+                        (cutoff_1m,))[0][0]
+    originals = query(db, 'SELECT id, user_prompt, ai_response, cot_trace FROM conversations WHERE id <= 200')
+    pages_before = pragma(db, 'page_count')
+    assert pragma(db, 'auto_vacuum') == 2  # 新建的数据库直接启用 incremental auto-vacuum
+
+    job = RetentionJob(db, batch_size=50, pause=0)
+    result = job.run()
+
+    assert result['account_values_deleted'] == 120
+    assert result['rollups_deleted'] == old_rollups > 0
+    assert result['conversations_archived'] == 200
+    assert query(db, 'SELECT COUNT(*) FROM account_values') == [(20,)]
+    assert query(db, 'SELECT MIN(id) FROM conversations') == [(201,)]
+
+    archived = db.get_archived_conversations(models[0], limit=500)
+    assert sorted((c['id'], c['user_prompt'], c['ai_response'], c['cot_trace']) for c in archived) == originals
+
+    # 删除产生的空闲页被释放，文件变小
+    assert result['pages_vacuumed'] > 0
+    assert pragma(db, 'freelist_count') == 0
+    assert pragma(db, 'page_count') < pages_before
+
+    # 第二轮没有过期数据
+    assert job.run() == {'account_values_deleted': 0, 'rollups_deleted': 0,
+                         'conversations_archived': 0, 'pages_vacuumed': 0}
+    assert job.get_stats()['runs'] == 2
+
+
+def test_retention_converts_legacy_database_once(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)  # 升级前创建的数据库：auto_vacuum = NONE
+    conn.execute('CREATE TABLE legacy (id INTEGER PRIMARY KEY)')
+    conn.commit()
+    conn.close()
+    db = Database(path, busy_timeout=0.2)
+    db.init_db()
+    provider_id = db.add_provider('test', 'http://127.0.0.1', 'key')
+    model_id = db.add_model(name='m', provider_id=provider_id, model_name='test', initial_capital=10000)
+    seed_history(db, model_id, monkeypatch)
+    assert pragma(db, 'auto_vacuum') == 0
+
+    # 未开启转换：只告警一次，空闲页保留在文件中供复用
+    job = RetentionJob(db, batch_size=50, pause=0)
+    assert job.run()['pages_vacuumed'] == 0
+    job.run()
+    assert capsys.readouterr().out.count('not in incremental auto-vacuum mode') == 1
+    assert pragma(db, 'freelist_count') > 0
+
+    job = RetentionJob(db, batch_size=50, pause=0, convert_vacuum=True)
+    job.run()
+    assert 'Converting database to incremental auto-vacuum' in capsys.readouterr().out
+    assert pragma(db, 'auto_vacuum') == 2
+    assert pragma(db, 'freelist_count') == 0
+    assert job.convert_vacuum is False
+    db.close()
+
+
+# ============ Unit of work ============
+
+def test_unit_of_work_rolls_back_everything_on_error(db, models):
+    with pytest.raises(RuntimeError):
+        with db.unit_of_work():
+            db.add_trade(models[0], 'BTC', 'buy_to_enter', 1, 100, fee=1)
+            db.update_position(models[0], 'BTC', 1, 100, 1, 'long')
+            raise RuntimeError('crash')
+
+    assert query(db, 'SELECT COUNT(*) FROM trades') == [(0,)]
+    assert query(db, 'SELECT COUNT(*) FROM portfolios') == [(0,)]
+    assert query(db, LEDGER) == []
+
+
+def test_unit_of_work_commits_once(db, models):
+    with db.unit_of_work():
+        db.add_trade(models[0], 'BTC', 'buy_to_enter', 1, 100, fee=1)
+        with db.unit_of_work():  # 嵌套调用加入外层事务
+            db.add_trade(models[0], 'ETH', 'buy_to_enter', 1, 100, fee=1)
+        # 事务未提交前其他连接看不到写入
+        other = sqlite3.connect(db.db_path)
+        assert other.execute('SELECT COUNT(*) FROM trades').fetchone() == (0,)
+        other.close()
+
+    assert query(db, 'SELECT COUNT(*) FROM trades') == [(2,)]
+
+
+def test_savepoint_rolls_back_only_its_block(db, models):
+    with db.unit_of_work():
+        db.add_trade(models[0], 'BTC', 'buy_to_enter', 1, 100, fee=1)
+        with pytest.raises(RuntimeError):
+            with db.savepoint():
+                db.add_trade(models[0], 'ETH', 'buy_to_enter', 1, 100, fee=1)
+                raise RuntimeError('crash')
+        db.add_trade(models[0], 'SOL', 'buy_to_enter', 1, 100, fee=1)
+
+    assert query(db, 'SELECT coin FROM trades ORDER BY id') == [('BTC',), ('SOL',)]
+    assert query(db, LEDGER) == [(models[0], 0, 2, 2)]
+
+
+def test_unit_of_work_takes_the_write_lock_at_begin(db, models):
+    unit_of_work = db.begin_unit_of_work()
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            db.begin_unit_of_work()
+        # 读取不受影响（WAL）
+        assert db.get_model(models[0])['name'] == 'm0'
+    finally:
+        unit_of_work.rollback()
+    db.begin_unit_of_work().commit()
@@ -0,0 +1,73 @@
+"""
+Market data cache - TTL expiry and stale-while-revalidate windows
+行情缓存测试 - 有效期内 get 命中，过期后 get 未命中但 get_stale 在 max_staleness 内返回旧值，
+超过 max_staleness 后两者都未命中；set_many 的条目与逐个 set 相同
+
+运行:
+    python -m pytest -q test_market_cache.py
+"""
+import pytest
+
+import market_cache
+from market_cache import MarketDataCache
+
+
+class Clock:
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(market_cache.time, 'time', clock.time)
+    return clock
+
+
+def test_entry_is_fresh_within_ttl(clock):
+    cache = MarketDataCache(ttls={'ticker': 5}, max_staleness=60)
+    cache.set('ticker', 'BTC', {'price': 1})
+
+    clock.now += 4.9
+    assert cache.get('ticker', 'BTC') == {'price': 1}
+    assert cache.get_stale('ticker', 'BTC') == ({'price': 1}, True)
+
+
+def test_expired_entry_is_served_stale_until_max_staleness(clock):
+    cache = MarketDataCache(ttls={'ticker': 5}, max_staleness=60)
+    cache.set('ticker', 'BTC', {'price': 1})
+
+    clock.now += 30
+    assert cache.get('ticker', 'BTC') is None
+    assert cache.get_stale('ticker', 'BTC') == ({'price': 1}, False)
+
+    clock.now += 35  # 过期 60 秒以上
+    assert cache.get_stale('ticker', 'BTC') is None
+    assert cache.get('ticker', 'BTC') is None
+
+    stats = cache.get_stats()
+    assert (stats['l1_hits'], stats['stale_hits'], stats['misses']) == (0, 1, 3)
+
+
+def test_revalidated_entry_is_fresh_again(clock):
+    cache = MarketDataCache(ttls={'ticker': 5}, max_staleness=60)
+    cache.set('ticker', 'BTC', {'price': 1})
+    clock.now += 10
+    cache.set('ticker', 'BTC', {'price': 2})
+
+    assert cache.get_stale('ticker', 'BTC') == ({'price': 2}, True)
+
+
+def test_sweep_drops_entries_past_max_staleness(clock):
+    cache = MarketDataCache(ttls={'ticker': 5}, max_staleness=60)
+    cache.set_many('ticker', {'BTC': {'price': 1}, 'ETH': {'price': 2}})
+    clock.now += 30
+    cache.set('ticker', 'SOL', {'price': 3})
+
+    clock.now += 40
+    cache.sweep_expired()
+    assert cache.get_stats()['l1_size'] == 1
+    assert cache.get_stale('ticker', 'SOL') == ({'price': 3}, False)
@@ -0,0 +1,69 @@
+"""
+Market recorder - logs that were never closed or were cut short still replay
+行情录制测试 - 录制进程未 close（没有 gzip 结尾）或日志被截断时，回放保留已写入的记录
+
+运行:
+    python -m pytest -q test_market_recorder.py
+"""
+import pytest
+
+from market_recorder import MarketRecorder, MarketReplay
+
+
+TICKER_URL = 'https://api.binance.com/api/v3/ticker/24hr'
+KLINES_URL = 'https://api.binance.com/api/v3/klines'
+
+
+def record_session(path, count: int) -> MarketRecorder:
+    recorder = MarketRecorder(str(path))
+    for i in range(count):
+        recorder.record(TICKER_URL, {'symbols': '["BTCUSDT"]'},
+                        [{'symbol': 'BTCUSDT', 'lastPrice': str(100 + i)}])
+    recorder.record(KLINES_URL, {'symbol': 'BTCUSDT', 'interval': '1h'}, [[0, '1', '2', '0.5', '1.5', '10']])
+    return recorder
+
+
+def test_closed_log_replays_every_record(tmp_path):
+    path = tmp_path / 'log.jsonl.gz'
+    record_session(path, 5).close()
+
+    replay = MarketReplay(str(path), speed=1e9)
+
+    assert replay.records == 6
+    assert replay.lookup(TICKER_URL, {'symbols': '["BTCUSDT"]'}) == [{'symbol': 'BTCUSDT', 'lastPrice': '104'}]
+
+
+def test_unclosed_log_keeps_flushed_records(tmp_path, capsys):
+    path = tmp_path / 'log.jsonl.gz'
+    recorder = record_session(path, 5)  # 仍在写入：文件没有 gzip 结尾
+
+    replay = MarketReplay(str(path), speed=1e9)
+
+    assert replay.records == 6
+    assert replay.lookup(KLINES_URL, {'symbol': 'BTCUSDT', 'interval': '1h'}) == [[0, '1', '2', '0.5', '1.5', '10']]
+    assert 'has no gzip trailer' in capsys.readouterr().out
+    recorder.close()
+
+
+@pytest.mark.parametrize('cut', [1, 9, 40])
+def test_truncated_log_keeps_complete_lines(tmp_path, cut):
+    path = tmp_path / 'log.jsonl.gz'
+    record_session(path, 20).close()
+    data = path.read_bytes()
+    path.write_bytes(data[:-cut])
+
+    replay = MarketReplay(str(path), speed=1e9)
+
+    assert 1 <= replay.records <= 21
+    assert replay.lookup(TICKER_URL, {'symbols': '["BTCUSDT"]'})[0]['symbol'] == 'BTCUSDT'
+
+
+def test_second_session_appends_a_new_member(tmp_path):
+    path = tmp_path / 'log.jsonl.gz'
+    record_session(path, 2).close()
+    recorder = record_session(path, 3)
+
+    assert MarketReplay(str(path), speed=1e9).records == 7
+    recorder.close()
+    recorder.record(TICKER_URL, {}, [])  # close 之后的抓取被忽略
+    assert MarketReplay(str(path), speed=1e9).records == 7
@@ -0,0 +1,90 @@
+"""
+Market snapshot broker - replay clock, failed prices and single-flight fetching
+行情快照测试 - 快照按 market_fetcher.clock 过期（回放时不受真实时间影响）；
+价格抓取失败（为 0）的币种不进入快照、下一次请求重新抓取；
+同时到达的请求只抓取一次，抓取期间不持有锁
+
+运行:
+    python -m pytest -q test_market_snapshot.py
+"""
+import threading
+
+from market_snapshot import MarketSnapshotBroker
+
+
+class FakeFetcher:
+    """价格在 failing 中的币种返回 0（与所有数据源失败时一致）；gate 设置时抓取等待 gate"""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+        self.failing = set()
+        self.gate = None
+        self.started = threading.Event()
+        self.price_calls = []
+
+    def clock(self):
+        return self.now
+
+    def get_current_prices(self, coins):
+        self.price_calls.append(list(coins))
+        self.started.set()
+        if self.gate is not None:
+            assert self.gate.wait(5)
+        return {coin: {'price': 0 if coin in self.failing else 100.0, 'change_24h': 0} for coin in coins}
+
+    def calculate_technical_indicators_bulk(self, coins):
+        return {coin: {'rsi_14': 50} for coin in coins}
+
+
+def test_snapshot_expires_on_fetcher_clock():
+    fetcher = FakeFetcher()
+    broker = MarketSnapshotBroker(fetcher, tick_seconds=60)
+
+    first = broker.get_snapshot(['BTC'])
+    fetcher.now += 59
+    assert broker.get_snapshot(['BTC']) is first
+    fetcher.now += 1
+
+    assert broker.get_snapshot(['BTC']).tick == first.tick + 1
+    assert broker.stats['snapshots_built'] == 2
+    assert broker.stats['snapshot_hits'] == 1
+
+
+def test_failed_prices_are_not_cached():
+    fetcher = FakeFetcher()
+    fetcher.failing = {'ETH'}
+    broker = MarketSnapshotBroker(fetcher)
+
+    assert set(broker.get_market_state(['BTC', 'ETH'])) == {'BTC'}
+
+    fetcher.failing = set()
+    state = broker.get_market_state(['BTC', 'ETH'])
+    assert state['ETH']['price'] == 100.0
+    assert fetcher.price_calls == [['BTC', 'ETH'], ['ETH']]
+    assert (broker.stats['coins_failed'], broker.stats['snapshots_extended']) == (1, 1)
+
+
+def test_concurrent_requests_share_one_fetch():
+    fetcher = FakeFetcher()
+    fetcher.gate = threading.Event()
+    broker = MarketSnapshotBroker(fetcher)
+    results = []
+
+    def request(coins):
+        results.append(broker.get_market_state(coins))
+
+    threads = [threading.Thread(target=request, args=(['BTC', 'ETH'],)) for _ in range(5)]
+    threads[0].start()
+    assert fetcher.started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # 抓取期间锁是空闲的
+    assert broker._lock.acquire(timeout=1)
+    broker._lock.release()
+    fetcher.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert fetcher.price_calls == [['BTC', 'ETH']]
+    assert len(results) == 5 and all(set(state) == {'BTC', 'ETH'} for state in results)
+    assert broker.stats['snapshots_built'] == 1
@@ -0,0 +1,100 @@
+"""
+Price aggregator - hedged requests fire at the capped p95 and the hedge result is used
+价格聚合测试 - 主数据源样本足够时对冲延迟为 p95（上限为中位数的 max_median_multiple 倍）；
+主数据源卡住时在该延迟后对冲到备用数据源并采用备用数据源的结果
+
+运行:
+    python -m pytest -q test_price_aggregator.py
+"""
+import threading
+import time
+
+import pytest
+
+from price_aggregator import HedgedPriceAggregator
+
+
+PRIMARY_PRICES = {'BTC': {'price': 100.0, 'change_24h': 1.0}}
+BACKUP_PRICES = {'BTC': {'price': 101.0, 'change_24h': 1.5}}
+
+
+class FakeSource:
+    """返回固定价格；block 时等待 release（模拟卡住的请求），记录每次调用相对 t0 的时间"""
+
+    def __init__(self, prices, block: bool = False, error: Exception = None):
+        self.prices = prices
+        self.block = block
+        self.error = error
+        self.release = threading.Event()
+        self.t0 = None
+        self.calls = []
+
+    def __call__(self, coins):
+        self.calls.append(time.perf_counter() - self.t0)
+        if self.block:
+            self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.prices
+
+
+@pytest.fixture
+def sources():
+    primary, backup = FakeSource(PRIMARY_PRICES, block=True), FakeSource(BACKUP_PRICES)
+    yield primary, backup
+    primary.release.set()
+
+
+def make_aggregator(primary, backup, samples):
+    aggregator = HedgedPriceAggregator([('primary', primary), ('backup', backup)], default_hedge_delay=10)
+    for seconds in samples:
+        aggregator.trackers['primary'].record(seconds)
+    return aggregator
+
+
+def fetch(aggregator, *sources):
+    t0 = time.perf_counter()
+    for source in sources:
+        source.t0 = t0
+    return aggregator.fetch(['BTC'])
+
+
+@pytest.mark.parametrize('samples, expected_delay', [
+    ([0.02] * 18 + [0.06] * 2, 0.06),   # p95 低于 4 倍中位数：按 p95
+    ([0.02] * 16 + [1.0] * 4, 0.08),    # 慢请求占比超过 5%：p95 被拉到 1s，按 4 倍中位数封顶
+])
+def test_hedge_fires_after_capped_p95_and_uses_hedge_result(sources, samples, expected_delay):
+    primary, backup = sources
+    aggregator = make_aggregator(primary, backup, samples)
+    assert aggregator._hedge_delay('primary') == pytest.approx(expected_delay)
+
+    source, prices = fetch(aggregator, primary, backup)
+
+    assert (source, prices) == ('backup', BACKUP_PRICES)
+    assert len(primary.calls) == 1 and primary.calls[0] < expected_delay
+    assert expected_delay <= backup.calls[0] < expected_delay + 0.5
+    stats = aggregator.get_stats()
+    assert (stats['hedges'], stats['hedge_wins'], stats['failures']) == (1, 1, 0)
+
+
+def test_few_samples_use_default_delay(sources):
+    primary, backup = sources
+    primary.block = False
+    aggregator = make_aggregator(primary, backup, [0.02] * 5)
+
+    assert aggregator._hedge_delay('primary') == 10
+    assert fetch(aggregator, primary, backup) == ('primary', PRIMARY_PRICES)
+    assert backup.calls == []
+    assert aggregator.get_stats()['hedges'] == 0
+
+
+def test_failed_primary_falls_through_without_waiting(sources):
+    primary, backup = sources
+    primary.block, primary.error = False, RuntimeError('503')
+    aggregator = make_aggregator(primary, backup, [])
+
+    assert fetch(aggregator, primary, backup) == ('backup', BACKUP_PRICES)
+    assert backup.calls[0] < 1  # 默认对冲延迟为 10s
+    stats = aggregator.get_stats()
+    assert stats['hedges'] == 0
+    assert stats['sources']['primary']['failures'] == 1
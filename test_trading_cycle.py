@@ -0,0 +1,220 @@
+"""
+Trading cycle - position book and database stay consistent across failed cycles
+交易周期测试 - 成交在 execute 阶段只在内存中计算，persist 阶段在一个事务中写入；
+周期失败后持仓簿从数据库重新加载，与数据库一致；实盘请求期间不持有写锁；
+接口读取（verify=True）能看到其他进程的写入
+
+运行:
+    python -m pytest -q test_trading_cycle.py
+"""
+import threading
+import time
+
+import pytest
+
+from database import Database
+from position_book import PositionBook
+from trading_engine import TradingEngine
+
+
+COINS = ['BTC', 'ETH', 'SOL']
+
+
+class ScriptedTrader:
+    """按顺序返回预设的决策，之后一直 hold"""
+
+    api_url = 'http://127.0.0.1'
+
+    def __init__(self, *plan):
+        self.plan = list(plan)
+
+    def make_decision(self, *args, **kwargs):
+        if self.plan:
+            return self.plan.pop(0)
+        return {coin: {'signal': 'hold'} for coin in COINS}
+
+
+class FixedPrices:
+    def __init__(self, price: float = 10.0):
+        self.price = price
+
+    def get_current_prices(self, coins):
+        return {coin: {'price': self.price, 'change_24h': 0} for coin in coins}
+
+    def calculate_technical_indicators_bulk(self, coins):
+        return {}
+
+
+class SlowExchange:
+    """模拟耗时的实盘下单"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def execute_signal(self, *args):
+        time.sleep(self.seconds)
+        return {'success': True}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(TradingEngine, '_load_model_coins', lambda self: list(COINS))
+    db = Database(str(tmp_path / 'test.db'), busy_timeout=1)
+    db.init_db()
+    yield db
+    db.close()
+
+
+def add_model(db, **kwargs) -> int:
+    provider_id = db.add_provider('test', 'http://127.0.0.1', 'key')
+    return db.add_model(name='m', provider_id=provider_id, model_name='test', initial_capital=100000, **kwargs)
+
+
+def assert_book_matches_db(book, db, model_id, price):
+    prices = {coin: price for coin in COINS}
+    in_memory, stored = book.get_portfolio(model_id, prices), db.get_portfolio(model_id, prices)
+    positions = lambda p: sorted((x['coin'], x['side'], x['quantity'], x['avg_price']) for x in p['positions'])
+    assert positions(in_memory) == positions(stored)
+    for key in ('cash', 'total_value', 'realized_pnl', 'positions_value'):
+        assert in_memory[key] == pytest.approx(stored[key]), key
+
+
+def count(db, table: str) -> int:
+    conn = db.get_connection()
+    value = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    conn.close()
+    return value
+
+
+def test_book_matches_db_after_cycles(db):
+    model_id = add_model(db)
+    book = PositionBook(db)
+    engine = TradingEngine(model_id, db, FixedPrices(), ScriptedTrader(
+        {coin: {'signal': 'buy_to_enter', 'quantity': 2, 'leverage': 2} for coin in COINS},
+        {'BTC': {'signal': 'close_position'}, 'ETH': {'signal': 'sell_to_enter', 'quantity': 1, 'leverage': 1}},
+    ), position_book=book)
+
+    for _ in range(3):
+        assert engine.execute_trading_cycle()['success']
+        assert_book_matches_db(book, db, model_id, 10.0)
+    assert count(db, 'trades') == 5
+
+
+def test_own_commits_do_not_reload_the_book(db):
+    model_id = add_model(db)
+    book = PositionBook(db)
+    engine = TradingEngine(model_id, db, FixedPrices(), ScriptedTrader(
+        {coin: {'signal': 'buy_to_enter', 'quantity': 1, 'leverage': 1} for coin in COINS},
+        {'BTC': {'signal': 'close_position'}},
+    ), position_book=book)
+
+    for _ in range(2):
+        assert engine.execute_trading_cycle()['success']
+        book.get_portfolio(model_id, verify=True)
+    assert book.get_stats()['reloads'] == 0
+
+
+def test_verified_reads_pick_up_writes_from_another_process(db):
+    """另一个 worker 的持仓簿（同一数据库）执行交易，本进程的接口读取看到最新状态"""
+    model_id = add_model(db)
+    reader, writer = PositionBook(db), PositionBook(db)
+    assert reader.get_portfolio(model_id)['positions'] == []
+
+    engine = TradingEngine(model_id, db, FixedPrices(), ScriptedTrader(
+        {'BTC': {'signal': 'buy_to_enter', 'quantity': 2, 'leverage': 1}},
+    ), position_book=writer)
+    assert engine.execute_trading_cycle()['success']
+
+    assert reader.get_portfolio(model_id)['positions'] == []  # 引擎读取不访问数据库
+    assert [p['coin'] for p in reader.get_portfolio(model_id, verify=True)['positions']] == ['BTC']
+    assert_book_matches_db(reader, db, model_id, 10.0)
+
+
+def test_ledger_rebuild_is_picked_up(db):
+    model_id = add_model(db)
+    book = PositionBook(db)
+    db.add_trade(model_id, 'BTC', 'close_position', 1, 10, pnl=50, fee=1)
+    assert book.get_portfolio(model_id)['realized_pnl'] == pytest.approx(49)
+
+    conn = db.get_connection()
+    conn.execute('UPDATE trades SET pnl = 80')  # 修正交易记录后重建账本（rebuild_ledger.py）
+    conn.commit()
+    conn.close()
+    db.rebuild_ledger(model_id)
+
+    assert book.get_portfolio(model_id, verify=True)['realized_pnl'] == pytest.approx(79)
+
+
+def test_pending_changes_are_never_discarded(db):
+    model_id = add_model(db)
+    book = PositionBook(db)
+    book.update_position(model_id, 'BTC', 1, 10, 1, 'long')
+    book.record_trade(model_id, 0, 0.01)
+    db.add_trade(model_id, 'ETH', 'buy_to_enter', 1, 10, fee=0.5)  # 其他进程的写入
+
+    assert not book.refresh(model_id)
+    assert book.get_position(model_id, 'BTC') is not None
+
+
+def test_failed_persist_writes_nothing_and_reloads_book(db, monkeypatch):
+    model_id = add_model(db)
+    book = PositionBook(db)
+    engine = TradingEngine(model_id, db, FixedPrices(), ScriptedTrader(
+        {'BTC': {'signal': 'buy_to_enter', 'quantity': 1, 'leverage': 1}},
+        {'BTC': {'signal': 'close_position'}, 'SOL': {'signal': 'buy_to_enter', 'quantity': 3, 'leverage': 1}},
+    ), position_book=book)
+    assert engine.execute_trading_cycle()['success']
+    trades, snapshots = count(db, 'trades'), count(db, 'account_values')
+
+    def crash(*args, **kwargs):
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(db, 'record_account_value', crash)
+    assert not engine.execute_trading_cycle()['success']
+
+    assert (count(db, 'trades'), count(db, 'account_values')) == (trades, snapshots)
+    assert book.get_position(model_id, 'BTC') is not None
+    assert book.get_position(model_id, 'SOL') is None
+    assert_book_matches_db(book, db, model_id, 10.0)
+
+
+def test_failed_decision_is_dropped_others_kept(db, monkeypatch):
+    model_id = add_model(db)
+    book = PositionBook(db)
+    engine = TradingEngine(model_id, db, FixedPrices(), ScriptedTrader(
+        {coin: {'signal': 'buy_to_enter', 'quantity': 1, 'leverage': 1} for coin in COINS},
+    ), position_book=book)
+    update_position = engine._update_position
+
+    def failing_update(fills, coin, *args):
+        if coin == 'ETH':
+            raise RuntimeError('bad position')
+        update_position(fills, coin, *args)
+    monkeypatch.setattr(engine, '_update_position', failing_update)
+
+    result = engine.execute_trading_cycle()
+    assert result['success']
+    assert [e['coin'] for e in result['executions'] if 'error' in e] == ['ETH']
+    assert sorted(p['coin'] for p in db.get_portfolio(model_id)['positions']) == ['BTC', 'SOL']
+    assert count(db, 'trades') == 2
+    assert_book_matches_db(book, db, model_id, 10.0)
+
+
+def test_slow_live_order_does_not_block_other_models(db):
+    live_model = add_model(db, live_trading_enabled=True, live_exchange='binance')
+    paper_model = add_model(db)
+    book = PositionBook(db)
+    buy = {'BTC': {'signal': 'buy_to_enter', 'quantity': 1, 'leverage': 1}}
+    live = TradingEngine(live_model, db, FixedPrices(), ScriptedTrader(buy), live_executor=SlowExchange(2),
+                         position_book=book)
+    paper = TradingEngine(paper_model, db, FixedPrices(), ScriptedTrader(buy), position_book=book)
+
+    thread = threading.Thread(target=live.execute_trading_cycle)
+    thread.start()
+    time.sleep(0.3)  # 实盘下单进行中
+    started = time.monotonic()
+    assert paper.execute_trading_cycle()['success']
+    assert time.monotonic() - started < 1
+    thread.join()
+
+    assert_book_matches_db(book, db, live_model, 10.0)
+    assert_book_matches_db(book, db, paper_model, 10.0)
@@ -0,0 +1,123 @@
+"""
+Trading pipeline - stage hand-off, failure resolution and per-stage stats
+交易流水线测试 - 周期按顺序经过每个阶段并共享 cycle 字典；任一阶段失败（包括 BaseException）
+时提交方的 Future 立即完成；阶段统计反映排队深度、处理数和失败数；
+使用流水线的 CycleExecutor 不创建自己的线程池
+
+运行:
+    python -m pytest -q test_trading_pipeline.py
+"""
+import threading
+
+import pytest
+
+from cycle_executor import CycleExecutor
+from trading_engine import PIPELINE_STAGES
+from trading_pipeline import TradingPipeline
+
+
+class FakeEngine:
+    """记录经过的阶段；fail_at 阶段抛出 error，block_at 阶段等待 release"""
+
+    def __init__(self, model_id: int, fail_at: str = None, error: BaseException = None, block_at: str = None):
+        self.model_id = model_id
+        self.fail_at = fail_at
+        self.error = error or RuntimeError('boom')
+        self.block_at = block_at
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.stages = []
+
+    def run_stage(self, stage: str, cycle: dict):
+        self.stages.append(stage)
+        cycle.setdefault('trail', []).append(stage)
+        if stage == self.block_at:
+            self.entered.set()
+            assert self.release.wait(5)
+        if stage == self.fail_at:
+            raise self.error
+        if stage == 'persist':
+            cycle['result'] = {'success': True, 'model_id': self.model_id, 'trail': list(cycle['trail'])}
+
+
+class StopCycle(BaseException):
+    pass
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = TradingPipeline(stage_workers={name: 1 for name in PIPELINE_STAGES})
+    yield pipeline
+    pipeline.stop()
+
+
+def test_cycle_passes_every_stage_in_order(pipeline):
+    engine = FakeEngine(1)
+
+    result = pipeline.submit(engine).result(timeout=5)
+
+    assert result == {'success': True, 'model_id': 1, 'trail': list(PIPELINE_STAGES)}
+    assert all(stats['processed'] == 1 and stats['failed'] == 0 for stats in pipeline.get_stats().values())
+
+
+@pytest.mark.parametrize('error', [RuntimeError('llm timeout'), StopCycle()])
+def test_failing_stage_resolves_the_future(pipeline, error):
+    engine = FakeEngine(1, fail_at='decide', error=error)
+
+    result = pipeline.submit(engine).result(timeout=5)
+
+    assert result['success'] is False
+    assert engine.stages == ['gather', 'analyze', 'decide']
+    stats = pipeline.get_stats()
+    assert stats['decide']['failed'] == 1
+    assert stats['execute']['processed'] == 0
+
+    # 工作线程在失败后继续处理后续周期
+    assert pipeline.submit(FakeEngine(2)).result(timeout=5)['success']
+
+
+def test_slow_stage_queues_work_without_blocking_earlier_stages(pipeline):
+    slow = FakeEngine(1, block_at='decide')
+    futures = [pipeline.submit(slow)]
+    assert slow.entered.wait(5)
+    others = [FakeEngine(model_id) for model_id in range(2, 5)]
+    futures += [pipeline.submit(engine) for engine in others]
+
+    # 其他周期完成 gather/analyze 后在 decide 队列中等待唯一的 decide 线程
+    for _ in range(100):
+        stats = pipeline.get_stats()
+        if stats['decide']['queue_depth'] == 3:
+            break
+        threading.Event().wait(0.01)
+    assert stats['decide']['queue_depth'] == 3
+    assert stats['decide']['busy'] == 1
+    assert stats['analyze']['processed'] == 4
+
+    slow.release.set()
+    assert [f.result(timeout=5)['model_id'] for f in futures] == [1, 2, 3, 4]
+    stats = pipeline.get_stats()
+    assert stats['persist']['processed'] == 4
+    assert stats['decide']['queue_depth'] == 0
+    assert stats['decide']['latency_max'] >= stats['decide']['latency_avg'] > 0
+
+
+def test_executor_in_pipeline_mode_has_no_thread_pool(pipeline):
+    executor = CycleExecutor(pipeline=pipeline)
+    assert executor._pool is None
+    with pytest.raises(RuntimeError):
+        executor.submit(1, lambda: None)
+
+    engine = FakeEngine(1, block_at='decide')
+    future = executor.submit_cycle(1, engine)
+    assert engine.entered.wait(5)
+    assert executor.submit_cycle(1, engine) is None  # 同一模型的周期未结束时不重复排队
+    engine.release.set()
+
+    assert future.result(timeout=5)['success']
+    for _ in range(100):  # 完成回调在 Future 完成后执行
+        if not executor.is_pending(1):
+            break
+        threading.Event().wait(0.01)
+    stats = executor.get_stats()
+    assert (stats['submitted'], stats['skipped'], stats['completed'], stats['workers']) == (1, 1, 1, 0)
+    assert not any(t.name.startswith('trading-cycle') for t in threading.enumerate())
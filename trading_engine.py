@@ -1,33 +1,48 @@
+from contextlib import nullcontext
 from datetime import datetime
 from typing import Dict
 import json
+from metrics import CYCLE_STAGE_SECONDS, CYCLE_STAGE_FAILURES
+
+# 交易周期的阶段（按执行顺序）
+PIPELINE_STAGES = ('gather', 'analyze', 'decide', 'execute', 'persist')
 
 class TradingEngine:
-    def __init__(self, model_id: int, db, market_fetcher, ai_trader, trade_fee_rate: float = 0.001, live_executor=None):
+    def __init__(self, model_id: int, db, market_fetcher, ai_trader, trade_fee_rate: float = 0.001, live_executor=None,
+                 snapshot_broker=None, candle_feed=None, cycle_executor=None, model_config=None,
+                 position_book=None):
         self.model_id = model_id
         self.db = db
         self.market_fetcher = market_fetcher
         self.ai_trader = ai_trader
+        self.model_config = model_config  # 模型配置/币种池缓存（可选），交易周期中不查询配置
+        self.position_book = position_book  # 内存持仓簿（可选），交易周期中读取组合不访问数据库
         self.coins = self._load_model_coins()  # 从数据库加载模型的币种池
         self.trade_fee_rate = trade_fee_rate  # 从配置中传入费率
         self.live_executor = live_executor  # 实盘交易执行器
+        self.snapshot_broker = snapshot_broker  # 共享行情快照（同一 tick 内所有引擎复用）
+        self.candle_feed = candle_feed  # 多周期 OHLCV K线（策略信号使用）
+        self.cycle_executor = cycle_executor  # 限制 LLM 提供商/交易所并发的周期执行器
 
     def _load_model_coins(self):
         """从数据库加载该模型启用的币种列表"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
+            if self.model_config:
+                coins = self.model_config.get_coins(self.model_id)
+            else:
+                conn = self.db.get_connection()
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                SELECT c.symbol
-                FROM model_coin_pools mcp
-                JOIN coins c ON mcp.coin_id = c.id
-                WHERE mcp.model_id = ? AND mcp.is_enabled = 1 AND c.is_active = 1
-                ORDER BY c.market_cap_rank ASC, c.symbol ASC
-            """, (self.model_id,))
+                cursor.execute("""
+                    SELECT c.symbol
+                    FROM model_coin_pools mcp
+                    JOIN coins c ON mcp.coin_id = c.id
+                    WHERE mcp.model_id = ? AND mcp.is_enabled = 1 AND c.is_active = 1
+                    ORDER BY c.market_cap_rank ASC, c.symbol ASC
+                """, (self.model_id,))
 
-            coins = [row['symbol'] for row in cursor.fetchall()]
-            conn.close()
+                coins = [row['symbol'] for row in cursor.fetchall()]
+                conn.close()
 
             if not coins:
                 print(f"[WARNING] Model {self.model_id} has no enabled coins, using default set")
@@ -42,70 +57,198 @@ class TradingEngine:
             return ['BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE']
 
     def refresh_coins(self):
-        """刷新币种列表（用于动态更新币种池）"""
+        """刷新币种列表（用于动态更新币种池，有配置缓存时读取缓存）"""
         self.coins = self._load_model_coins()
+
+    def _get_model(self):
+        """模型配置（优先读取配置缓存）"""
+        if self.model_config:
+            return self.model_config.get_model(self.model_id)
+        return self.db.get_model(self.model_id)
     
     def execute_trading_cycle(self) -> Dict:
+        """在当前线程中依次执行所有阶段（TradingPipeline 把各阶段分配到独立的线程池）"""
         try:
-            market_state = self._get_market_state()
-            
-            current_prices = {coin: market_state[coin]['price'] for coin in market_state}
-            
-            portfolio = self.db.get_portfolio(self.model_id, current_prices)
-            
-            account_info = self._build_account_info(portfolio)
-            
-            decisions = self.ai_trader.make_decision(
-                market_state, portfolio, account_info
-            )
+            cycle = {}
+            for stage in PIPELINE_STAGES:
+                self.run_stage(stage, cycle)
+            return cycle['result']
             
+        except Exception as e:
+            print(f"[ERROR] Trading cycle failed (Model {self.model_id}): {e}")
+            import traceback
+            print(traceback.format_exc())
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def run_stage(self, stage: str, cycle: Dict):
+        """执行交易周期的一个阶段，结果写回 cycle"""
+        try:
+            with CYCLE_STAGE_SECONDS.time(stage=stage):
+                getattr(self, f'_{stage}_stage')(cycle)
+        except Exception:
+            CYCLE_STAGE_FAILURES.inc(stage=stage)
+            if stage in ('execute', 'persist') and self.position_book:
+                # 已计入内存持仓簿的成交没有写入数据库，从数据库重新加载
+                self.position_book.invalidate(self.model_id)
+            raise
+
+    def _gather_stage(self, cycle: Dict):
+        """行情、持仓和账户信息"""
+        market_state = self._get_market_state()
+        current_prices = {coin: market_state[coin]['price'] for coin in market_state}
+        portfolio = self._get_portfolio(current_prices)
+
+        cycle['market_state'] = market_state
+        cycle['current_prices'] = current_prices
+        cycle['portfolio'] = portfolio
+        cycle['account_info'] = self._build_account_info(portfolio)
+
+    def _analyze_stage(self, cycle: Dict):
+        """策略信号需要的多周期K线"""
+        cycle['historical_data'] = self._get_historical_data(cycle['market_state'])
+
+    def _decide_stage(self, cycle: Dict):
+        """LLM 决策"""
+        market_state, portfolio, account_info = cycle['market_state'], cycle['portfolio'], cycle['account_info']
+        historical_data = cycle.get('historical_data')
+        with self._provider_slot():
+            if historical_data:
+                decisions = self.ai_trader.make_decision(
+                    market_state, portfolio, account_info, historical_data=historical_data
+                )
+            else:
+                decisions = self.ai_trader.make_decision(
+                    market_state, portfolio, account_info
+                )
+        cycle['decisions'] = decisions
+
+    def _execute_stage(self, cycle: Dict):
+        """模拟成交（以及实盘同步）：成交只在内存中计算，数据库写入全部留给 persist 阶段"""
+        cycle['fills'] = []
+        cycle['executions'] = self._execute_decisions(cycle['decisions'], cycle['market_state'],
+                                                      cycle['portfolio'], cycle['fills'])
+
+    def _persist_stage(self, cycle: Dict):
+        """在一个事务中写入成交、持仓、对话和账户净值
+
+        事务在本线程上开始并提交（BEGIN IMMEDIATE），期间没有网络调用，也不跨越流水线队列，
+        写锁只占用写入本身的时间。
+        """
+        market_state, portfolio, account_info = cycle['market_state'], cycle['portfolio'], cycle['account_info']
+        with self.db.unit_of_work():
+            self._write_fills(cycle['fills'])
             self.db.add_conversation(
                 self.model_id,
                 user_prompt=self._format_prompt(market_state, portfolio, account_info),
-                ai_response=json.dumps(decisions, ensure_ascii=False),
+                ai_response=json.dumps(cycle['decisions'], ensure_ascii=False),
                 cot_trace=''
             )
-            
-            execution_results = self._execute_decisions(decisions, market_state, portfolio)
-            
-            updated_portfolio = self.db.get_portfolio(self.model_id, current_prices)
+
+            updated_portfolio = self._get_portfolio(cycle['current_prices'])
             self.db.record_account_value(
                 self.model_id,
                 updated_portfolio['total_value'],
                 updated_portfolio['cash'],
                 updated_portfolio['positions_value']
             )
-            
-            return {
-                'success': True,
-                'decisions': decisions,
-                'executions': execution_results,
-                'portfolio': updated_portfolio
-            }
-            
-        except Exception as e:
-            print(f"[ERROR] Trading cycle failed (Model {self.model_id}): {e}")
-            import traceback
-            print(traceback.format_exc())
-            return {
-                'success': False,
-                'error': str(e)
-            }
+            if self.position_book:
+                # 持仓变更与交易记录在同一事务中提交
+                self.position_book.flush(self.model_id)
+
+        cycle['result'] = {
+            'success': True,
+            'decisions': cycle['decisions'],
+            'executions': cycle['executions'],
+            'portfolio': updated_portfolio
+        }
     
     def _get_market_state(self) -> Dict:
+        if self.snapshot_broker:
+            return self.snapshot_broker.get_market_state(self.coins)
+
         market_state = {}
         prices = self.market_fetcher.get_current_prices(self.coins)
+        priced = [coin for coin in self.coins if (prices.get(coin) or {}).get('price')]  # 抓取失败时价格为 0
+        indicators = self.market_fetcher.calculate_technical_indicators_bulk(priced)
         
-        for coin in self.coins:
-            if coin in prices:
-                market_state[coin] = prices[coin].copy()
-                indicators = self.market_fetcher.calculate_technical_indicators(coin)
-                market_state[coin]['indicators'] = indicators
+        for coin in priced:
+            market_state[coin] = prices[coin].copy()
+            market_state[coin]['indicators'] = indicators.get(coin, {})
         
         return market_state
     
+    def _get_historical_data(self, market_state: Dict) -> Dict:
+        """真实 OHLCV K线 {coin: {timeframe: DataFrame}}，仅在交易员启用了技术指标策略时获取"""
+        if not self.candle_feed:
+            return {}
+        if not (getattr(self.ai_trader, 'strategy', None) or getattr(self.ai_trader, 'multi_indicator_analyzer', None)):
+            return {}
+        return self.candle_feed.get_frames([coin for coin in self.coins if coin in market_state])
+
+    def _get_portfolio(self, current_prices: Dict) -> Dict:
+        if self.position_book:
+            return self.position_book.get_portfolio(self.model_id, current_prices)
+        return self.db.get_portfolio(self.model_id, current_prices)
+
+    # ============ Fills (computed in execute, written in persist) ============
+
+    def _update_position(self, fills: list, coin: str, quantity: float, avg_price: float, leverage: int,
+                         side: str):
+        fills.append({'type': 'position', 'coin': coin, 'quantity': quantity, 'avg_price': avg_price,
+                      'leverage': leverage, 'side': side})
+
+    def _close_position(self, fills: list, coin: str, side: str):
+        fills.append({'type': 'close', 'coin': coin, 'side': side})
+
+    def _add_trade(self, fills: list, coin: str, signal: str, quantity: float, price: float, leverage: int,
+                   side: str, pnl: float = 0, fee: float = 0):
+        fills.append({'type': 'trade', 'coin': coin, 'signal': signal, 'quantity': quantity, 'price': price,
+                      'leverage': leverage, 'side': side, 'pnl': pnl, 'fee': fee})
+
+    def _apply_to_book(self, fills: list):
+        """一个决策的成交计入内存持仓簿，本周期之后的决策读到最新持仓，persist 阶段 flush 写入"""
+        if not self.position_book:
+            return
+        for fill in fills:
+            if fill['type'] == 'trade':
+                self.position_book.record_trade(self.model_id, fill['pnl'], fill['fee'])
+            elif fill['type'] == 'position':
+                self.position_book.update_position(self.model_id, fill['coin'], fill['quantity'],
+                                                   fill['avg_price'], fill['leverage'], fill['side'])
+            else:
+                self.position_book.close_position(self.model_id, fill['coin'], fill['side'])
+
+    def _write_fills(self, fills: list):
+        """写入交易记录；没有持仓簿时同时写入持仓（有持仓簿时由 flush 写入）"""
+        for fill in fills:
+            if fill['type'] == 'trade':
+                self.db.add_trade(self.model_id, fill['coin'], fill['signal'], fill['quantity'], fill['price'],
+                                  fill['leverage'], fill['side'], pnl=fill['pnl'], fee=fill['fee'])
+            elif self.position_book:
+                continue
+            elif fill['type'] == 'position':
+                self.db.update_position(self.model_id, fill['coin'], fill['quantity'], fill['avg_price'],
+                                        fill['leverage'], fill['side'])
+            else:
+                self.db.close_position(self.model_id, fill['coin'], fill['side'])
+
+    def _provider_slot(self):
+        """LLM 调用的并发名额（未配置执行器时不限制）"""
+        if not self.cycle_executor:
+            return nullcontext()
+        return self.cycle_executor.provider_slot(getattr(self.ai_trader, 'api_url', ''))
+
+    def _exchange_slot(self, exchange_id: str):
+        """实盘下单的并发名额（未配置执行器时不限制）"""
+        if not self.cycle_executor:
+            return nullcontext()
+        return self.cycle_executor.exchange_slot(exchange_id)
+
     def _build_account_info(self, portfolio: Dict) -> Dict:
-        model = self.db.get_model(self.model_id)
+        model = self._get_model()
         initial_capital = model['initial_capital']
         total_value = portfolio['total_value']
         total_return = ((total_value - initial_capital) / initial_capital) * 100
@@ -121,7 +264,8 @@ class TradingEngine:
         return f"Market State: {len(market_state)} coins, Portfolio: {len(portfolio['positions'])} positions"
     
     def _execute_decisions(self, decisions: Dict, market_state: Dict,
-                          portfolio: Dict) -> list:
+                          portfolio: Dict, fills: list) -> list:
+        """执行决策，成交追加到 fills（每个决策的成交全部成功后才加入）"""
         results = []
 
         for coin, decision in decisions.items():
@@ -129,18 +273,26 @@ class TradingEngine:
                 continue
 
             signal = decision.get('signal', '').lower()
+            if signal != 'hold' and coin not in market_state:
+                # 本周期没有抓到价格的币种不在行情中，不能按 0 或旧价格成交
+                results.append({'coin': coin, 'error': 'No market price'})
+                continue
 
             try:
+                # 持仓和交易记录一起生效或一起丢弃
+                decision_fills = []
                 if signal == 'buy_to_enter':
-                    result = self._execute_buy(coin, decision, market_state, portfolio)
+                    result = self._execute_buy(coin, decision, market_state, portfolio, decision_fills)
                 elif signal == 'sell_to_enter':
-                    result = self._execute_sell(coin, decision, market_state, portfolio)
+                    result = self._execute_sell(coin, decision, market_state, portfolio, decision_fills)
                 elif signal == 'close_position':
-                    result = self._execute_close(coin, decision, market_state, portfolio)
+                    result = self._execute_close(coin, decision, market_state, portfolio, decision_fills)
                 elif signal == 'hold':
                     result = {'coin': coin, 'signal': 'hold', 'message': 'Hold position'}
                 else:
                     result = {'coin': coin, 'error': f'Unknown signal: {signal}'}
+                self._apply_to_book(decision_fills)
+                fills.extend(decision_fills)
 
                 # 如果开启了实盘交易，同步执行到真实交易所
                 if signal != 'hold' and 'error' not in result:
@@ -165,7 +317,7 @@ class TradingEngine:
             return None
 
         try:
-            model = self.db.get_model(self.model_id)
+            model = self._get_model()
             if not model or not model.get('live_trading_enabled'):
                 return None
 
@@ -184,7 +336,8 @@ class TradingEngine:
 
             # 执行实盘交易
             print(f"\n[实盘] Model {self.model_id} 执行: {live_exchange} {live_symbol} {live_signal['action']}")
-            result = self.live_executor.execute_signal(live_exchange, live_symbol, live_signal)
+            with self._exchange_slot(live_exchange):
+                result = self.live_executor.execute_signal(live_exchange, live_symbol, live_signal)
 
             return result
 
@@ -204,7 +357,7 @@ class TradingEngine:
             return 'hold'
     
     def _execute_buy(self, coin: str, decision: Dict, market_state: Dict,
-                    portfolio: Dict) -> Dict:
+                    portfolio: Dict, fills: list) -> Dict:
         quantity = float(decision.get('quantity', 0))
         leverage = int(decision.get('leverage', 1))
         price = market_state[coin]['price']
@@ -222,16 +375,11 @@ class TradingEngine:
         if total_required > portfolio['cash']:
             return {'coin': coin, 'error': 'Insufficient cash (including fees)'}
 
-        # 更新持仓
-        self.db.update_position(
-            self.model_id, coin, quantity, price, leverage, 'long'
-        )
+        # 记录交易（包含交易费）：只加入本决策的 fills，persist 阶段在事务中写入
+        self._add_trade(fills, coin, 'buy_to_enter', quantity, price, leverage, 'long', pnl=0, fee=trade_fee)
 
-        # 记录交易（包含交易费）
-        self.db.add_trade(
-            self.model_id, coin, 'buy_to_enter', quantity,
-            price, leverage, 'long', pnl=0, fee=trade_fee
-        )
+        # 更新持仓（决策出错时本决策的 fills 整体丢弃）
+        self._update_position(fills, coin, quantity, price, leverage, 'long')
         
         return {
             'coin': coin,
@@ -244,7 +392,7 @@ class TradingEngine:
         }
     
     def _execute_sell(self, coin: str, decision: Dict, market_state: Dict, 
-                 portfolio: Dict) -> Dict:
+                 portfolio: Dict, fills: list) -> Dict:
         quantity = float(decision.get('quantity', 0))
         leverage = int(decision.get('leverage', 1))
         price = market_state[coin]['price']
@@ -262,16 +410,11 @@ class TradingEngine:
         if total_required > portfolio['cash']:
             return {'coin': coin, 'error': 'Insufficient cash (including fees)'}
         
-        # 更新持仓
-        self.db.update_position(
-            self.model_id, coin, quantity, price, leverage, 'short'
-        )
+        # 记录交易（包含交易费）：只加入本决策的 fills，persist 阶段在事务中写入
+        self._add_trade(fills, coin, 'sell_to_enter', quantity, price, leverage, 'short', pnl=0, fee=trade_fee)
         
-        # 记录交易（包含交易费）
-        self.db.add_trade(
-            self.model_id, coin, 'sell_to_enter', quantity, 
-            price, leverage, 'short', pnl=0, fee=trade_fee  # 新增fee参数
-        )
+        # 更新持仓（决策出错时本决策的 fills 整体丢弃）
+        self._update_position(fills, coin, quantity, price, leverage, 'short')
         
         return {
             'coin': coin,
@@ -284,12 +427,11 @@ class TradingEngine:
         }
     
     def _execute_close(self, coin: str, decision: Dict, market_state: Dict, 
-                    portfolio: Dict) -> Dict:
-        position = None
-        for pos in portfolio['positions']:
-            if pos['coin'] == coin:
-                position = pos
-                break
+                    portfolio: Dict, fills: list) -> Dict:
+        if self.position_book:
+            position = self.position_book.get_position(self.model_id, coin)
+        else:
+            position = next((pos for pos in portfolio['positions'] if pos['coin'] == coin), None)
         
         if not position:
             return {'coin': coin, 'error': 'Position not found'}
@@ -310,14 +452,12 @@ class TradingEngine:
         trade_fee = trade_amount * self.trade_fee_rate
         net_pnl = gross_pnl - trade_fee  # 净利润 = 毛利润 - 交易费
         
-        # 关闭持仓
-        self.db.close_position(self.model_id, coin, side)
+        # 记录平仓交易（包含费用和净利润）：只加入本决策的 fills，persist 阶段在事务中写入
+        self._add_trade(fills, coin, 'close_position', quantity, current_price, position['leverage'], side,
+                        pnl=net_pnl, fee=trade_fee)
         
-        # 记录平仓交易（包含费用和净利润）
-        self.db.add_trade(
-            self.model_id, coin, 'close_position', quantity,
-            current_price, position['leverage'], side, pnl=net_pnl, fee=trade_fee  # 新增fee参数
-        )
+        # 关闭持仓（决策出错时本决策的 fills 整体丢弃）
+        self._close_position(fills, coin, side)
         
         return {
             'coin': coin,
@@ -0,0 +1,165 @@
+"""
+Trading pipeline - staged execution of model trading cycles
+交易周期流水线 - 把交易周期拆分为 gather / analyze / decide / execute / persist 五个阶段，
+阶段之间用队列连接，每个阶段有独立的线程数；耗时的 LLM 调用只占用 decide 阶段的线程，
+与其他模型的行情收集和持久化并行进行
+"""
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from trading_engine import PIPELINE_STAGES
+
+
+# 每个阶段的线程数：decide 等待 LLM（I/O 密集，同时受提供商并发上限约束），其余阶段很快
+DEFAULT_STAGE_WORKERS = {
+    'gather': 8,
+    'analyze': 4,
+    'decide': 16,
+    'execute': 4,
+    'persist': 2,
+}
+LATENCY_WINDOW = 1000  # 每个阶段保留的最近耗时样本数
+
+
+class _CycleJob:
+    """流水线中的一个交易周期"""
+
+    __slots__ = ('engine', 'cycle', 'future', 'enqueued_at')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.cycle: Dict = {}
+        self.future = Future()
+        self.enqueued_at = 0.0
+
+
+class _Stage:
+    """一个阶段的输入队列、工作线程和统计"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.queue: queue.Queue = queue.Queue()
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.waits = deque(maxlen=LATENCY_WINDOW)
+
+
+class TradingPipeline:
+    """Staged, queue-connected executor for TradingEngine cycles"""
+
+    def __init__(self, stage_workers: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            stage_workers: 覆盖默认值的 {阶段名: 线程数}
+        """
+        workers = dict(DEFAULT_STAGE_WORKERS)
+        if stage_workers:
+            workers.update(stage_workers)
+
+        self._stages = [_Stage(name, workers[name]) for name in PIPELINE_STAGES]
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for index, stage in enumerate(self._stages):
+                for n in range(stage.workers):
+                    thread = threading.Thread(target=self._worker, args=(index,), daemon=True,
+                                              name=f'pipeline-{stage.name}-{n}')
+                    thread.start()
+                    self._threads.append(thread)
+        print(f"[INFO] Trading pipeline started "
+              f"({', '.join(f'{s.name}={s.workers}' for s in self._stages)})")
+
+    def stop(self):
+        """每个线程放入一个结束标记，已在队列中的周期先执行完"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            threads, self._threads = self._threads, []
+        for stage in self._stages:
+            for _ in range(stage.workers):
+                stage.queue.put(None)
+        for thread in threads:
+            thread.join(timeout=5)
+
+    def submit(self, engine) -> Future:
+        """提交一个交易周期，Future 的结果与 execute_trading_cycle 的返回值相同"""
+        if not self._running:
+            self.start()
+        job = _CycleJob(engine)
+        self._enqueue(0, job)
+        return job.future
+
+    def _enqueue(self, index: int, job: _CycleJob):
+        job.enqueued_at = time.monotonic()
+        self._stages[index].queue.put(job)
+
+    def _worker(self, index: int):
+        stage = self._stages[index]
+        while True:
+            job = stage.queue.get()
+            if job is None:
+                return
+
+            started = time.monotonic()
+            with self._lock:
+                stage.busy += 1
+                stage.waits.append(started - job.enqueued_at)
+
+            error = None
+            try:
+                job.engine.run_stage(stage.name, job.cycle)
+            except BaseException as e:
+                # 包括 SystemExit 等非 Exception：提交方的 Future 必须完成，工作线程继续处理队列
+                error = e
+                print(f"[ERROR] Trading cycle failed (Model {job.engine.model_id}) at {stage.name}: "
+                      f"{type(e).__name__}: {e}")
+                print(traceback.format_exc())
+
+            with self._lock:
+                stage.busy -= 1
+                stage.latencies.append(time.monotonic() - started)
+                if error is None:
+                    stage.processed += 1
+                else:
+                    stage.failed += 1
+
+            if error is not None:
+                job.future.set_result({'success': False, 'error': str(error) or type(error).__name__})
+            elif index + 1 < len(self._stages):
+                self._enqueue(index + 1, job)
+            else:
+                job.future.set_result(job.cycle['result'])
+
+    def get_stats(self) -> Dict:
+        stats = {}
+        with self._lock:
+            for stage in self._stages:
+                latencies = sorted(stage.latencies)
+                waits = list(stage.waits)
+                stats[stage.name] = {
+                    'workers': stage.workers,
+                    'queue_depth': stage.queue.qsize(),
+                    'busy': stage.busy,
+                    'processed': stage.processed,
+                    'failed': stage.failed,
+                    'latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                    'latency_p95': round(latencies[int(len(latencies) * 0.95)], 3) if latencies else 0.0,
+                    'latency_max': round(latencies[-1], 3) if latencies else 0.0,
+                    'queue_wait_avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                }
+        return stats
@@ -238,19 +238,16 @@ class TrendStrengthAnalyzer:
         if not prices or len(prices) < period_minutes:
             return pd.DataFrame(columns=['open', 'high', 'low', 'close'])
 
-        # 将价格按周期分组
-        klines = []
-        for i in range(0, len(prices) - period_minutes + 1, period_minutes):
-            period_prices = prices[i:i + period_minutes]
-            if len(period_prices) > 0:
-                klines.append({
-                    'open': period_prices[0],
-                    'high': max(period_prices),
-                    'low': min(period_prices),
-                    'close': period_prices[-1]
-                })
-
-        return pd.DataFrame(klines)
+        # 按周期分组：截掉不足一个周期的尾部后 reshape 成 (K线数, 周期) 矩阵，按行归约
+        count = len(prices) // period_minutes
+        groups = np.asarray(prices[:count * period_minutes], dtype=float).reshape(count, period_minutes)
+
+        return pd.DataFrame({
+            'open': groups[:, 0],
+            'high': groups.max(axis=1),
+            'low': groups.min(axis=1),
+            'close': groups[:, -1]
+        })
 
 
 def create_trend_strength_analyzer(config: Dict[str, Any]) -> TrendStrengthAnalyzer: